@@ -0,0 +1,98 @@
+"""
+Author: Christian R. Garcia
+Benchmarks the stored encodings. For the dataset, compares the bytes and
+decode time of the per record "year,spots" hash against the packed
+snapshot from codec.encode_columns. For job results, compares json,
+zlib, and msgpack on a data job's list of rows and a stats job's list.
+
+Run with "python3 bench_codecs.py --rows 1000000"
+"""
+import sys
+import os
+import argparse
+from time import perf_counter
+import numpy as np
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CODE_DIR + "/../src/")
+
+import codec
+from stats_engine import describe
+
+
+def timed(function, repeat):
+    """
+    Takes a function and how many times to run it.
+    Returns (its last result, best time in ms).
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        started = perf_counter()
+        result = function()
+        best = min(best, perf_counter() - started)
+    return result, best * 1000
+
+
+def parse_records(records):
+    """
+    The record parsing get_db_data falls back to without a snapshot.
+    """
+    years = np.zeros(len(records), dtype=np.int64)
+    spots = np.zeros(len(records), dtype=np.int64)
+    for id_x, record in records.items():
+        year, spot = record.decode("utf-8").split(',')
+        years[int(id_x)] = int(year)
+        spots[int(id_x)] = int(spot)
+    return years, spots
+
+
+def bench_dataset(rows, repeat):
+    rng = np.random.default_rng(22)
+    years = np.sort(rng.integers(1700, 2100, rows))
+    spots = rng.integers(0, 300, rows)
+    # What HGETALL hands back for the records hash.
+    records = {str(id_x).encode(): "{},{}".format(year, spot).encode() for id_x, (year, spot)
+               in enumerate(zip(years.tolist(), spots.tolist()))}
+    record_bytes = sum(len(key) + len(value) for key, value in records.items())
+    snapshot = codec.encode_columns(years, spots)
+
+    parsed, parse_ms = timed(lambda: parse_records(records), repeat)
+    decoded, decode_ms = timed(lambda: codec.decode_columns(snapshot), repeat)
+    assert np.array_equal(parsed[1], decoded[1])
+    print("dataset of {} rows".format(rows))
+    print("  {:<16}{:>14}{:>14}".format("", "bytes", "decode ms"))
+    print("  {:<16}{:>14}{:>14.2f}".format("records hash", record_bytes, parse_ms))
+    print("  {:<16}{:>14}{:>14.2f}".format("snapshot", len(snapshot), decode_ms))
+
+
+def bench_results(name, results, repeat):
+    print("{} results".format(name))
+    print("  {:<16}{:>14}{:>14}{:>14}".format("", "bytes", "encode ms", "decode ms"))
+    for codec_name in ("json", "zlib", "msgpack"):
+        if codec_name == "msgpack" and codec.msgpack is None:
+            print("  msgpack not installed")
+            continue
+        raw, encode_ms = timed(lambda: codec.encode_value(results, codec_name), repeat)
+        decoded, decode_ms = timed(lambda: codec.decode_value(raw), repeat)
+        assert decoded == results
+        print("  {:<16}{:>14}{:>14.2f}{:>14.2f}".format(codec_name, len(raw), encode_ms, decode_ms))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    bench_dataset(args.rows, args.repeat)
+    rng = np.random.default_rng(23)
+    years = np.arange(args.rows // 10) + 1700
+    spots = rng.integers(0, 300, len(years))
+    bench_results("data job, {} rows".format(len(years)),
+                  [{'id': id_x, 'year': year, 'spots': spot} for id_x, (year, spot)
+                   in enumerate(zip(years.tolist(), spots.tolist()))], args.repeat)
+    bench_results("stats job", describe(spots), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
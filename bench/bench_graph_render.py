@@ -0,0 +1,87 @@
+"""
+Author: Christian R. Garcia
+Benchmarks graph rendering over many jobs. Reports per-job render time
+and resident memory as the jobs go by for graph_render.render_graph, and
+with --pyplot also for the old pyplot path that never cleared its figure.
+
+Run with "python3 bench_graph_render.py --jobs 2000"
+"""
+import sys
+import os
+import argparse
+from io import BytesIO
+from time import perf_counter
+import numpy as np
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CODE_DIR + "/../src/")
+
+import matplotlib
+matplotlib.use("Agg")
+from graph_render import render_graph
+CSV_FILE = CODE_DIR + "/../src/sunspots.csv"
+
+
+def rss_mb():
+    """
+    Returns current resident set size in MB, from /proc where available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def pyplot_render(years, spots):
+    """
+    The graph worker's old rendering, kept here only to compare against.
+    """
+    import matplotlib.pyplot as plt
+    plt.bar(years, spots)
+    plt.title("Sunspots recorded per year")
+    plt.xlabel("Year")
+    plt.ylabel("Number of Sunspots")
+    image = BytesIO()
+    plt.savefig(image, format="png")
+    return image.getvalue()
+
+
+def run(name, render, jobs, years, spots):
+    rng = np.random.default_rng(17)
+    times = []
+    checkpoints = {}
+    for job in range(1, jobs + 1):
+        first = int(rng.integers(0, len(years) - 10))
+        last = int(rng.integers(first + 10, len(years) + 1))
+        started = perf_counter()
+        render(years[first:last], spots[first:last])
+        times.append(perf_counter() - started)
+        if job in (1, 10, 100) or job % max(jobs // 10, 1) == 0:
+            checkpoints[job] = rss_mb()
+
+    times = np.array(times) * 1000
+    print("{}: {} jobs, mean {:.1f} ms, p50 {:.1f} ms, p95 {:.1f} ms, last 100 mean {:.1f} ms"
+          .format(name, jobs, times.mean(), np.percentile(times, 50),
+                  np.percentile(times, 95), times[-100:].mean()))
+    print("  rss MB by job: " + ", ".join("{}: {:.0f}".format(job, rss)
+                                          for job, rss in sorted(checkpoints.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--pyplot", action="store_true",
+                        help="also run the old pyplot path, which slows down as bars pile up")
+    args = parser.parse_args()
+
+    data = np.loadtxt(CSV_FILE, delimiter=',', dtype=np.int64)
+    years, spots = data[:, 0], data[:, 1]
+    run("reused Agg figure", render_graph, args.jobs, years, spots)
+    if args.pyplot:
+        run("pyplot global figure", pyplot_render, args.jobs, years, spots)
+
+
+if __name__ == "__main__":
+    main()
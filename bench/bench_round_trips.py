@@ -0,0 +1,93 @@
+"""
+Author: Christian R. Garcia
+Counts the redis round trips and new connections behind the api's and
+workers' common operations: submitting a job, submitting it again and
+hitting the job cache, a worker running it, reading the job, its
+results, a page of jobs, and a data read. Writes a synthetic dataset and
+jobs, so point REDIS_IP, REDIS_PORT, and the *_DB_ID env vars at a redis
+used for nothing else.
+
+Run with "python3 bench_round_trips.py --jobs 100"
+"""
+import sys
+import os
+import io
+import argparse
+from collections import Counter
+from contextlib import redirect_stdout
+import numpy as np
+import redis
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CODE_DIR + "/../src/")
+
+import jobs
+import worker
+import file_ops
+from get_db_data import get_db_data
+from spots_data import SpotsData
+
+COUNTS = Counter()
+
+
+def counted(name, method):
+    """
+    Takes a counter name and a connection method.
+    Returns the method counting its calls under name.
+    """
+    def wrapper(*args, **kwargs):
+        COUNTS[name] += 1
+        return method(*args, **kwargs)
+    return wrapper
+
+
+# Every command or pipeline is sent with one send_packed_command call.
+redis.connection.AbstractConnection.send_packed_command = counted(
+    "round trips", redis.connection.AbstractConnection.send_packed_command)
+redis.connection.AbstractConnection.connect = counted(
+    "connections", redis.connection.AbstractConnection.connect)
+
+
+def measure(name, function, repeat):
+    """
+    Takes an operation name, the function doing it, and how many times.
+    Prints its round trips and new connections per call.
+    """
+    COUNTS.clear()
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            function()
+    print("  {:<28}{:>14.1f}{:>14.2f}".format(name, COUNTS["round trips"] / repeat,
+                                             COUNTS["connections"] / repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100)
+    args = parser.parse_args()
+
+    years = np.arange(1700, 1700 + 300)
+    file_ops.pipe_write_redis(SpotsData.from_columns(years, np.arange(len(years)) % 250))
+    COUNTS.clear()
+    get_db_data("1700", "1999", None, None)
+    print("  {:<28}{:>14}{:>14}".format("", "round trips", "connections"))
+    print("  {:<28}{:>14}{:>14}".format("first data read", COUNTS["round trips"],
+                                       COUNTS["connections"]))
+
+    submitted = []
+    offsets = iter(range(10 ** 9))
+    measure("add_job", lambda: submitted.append(
+        jobs.add_job("data", "1700", "1999", None, str(next(offsets)))), args.jobs)
+    measure("add_job, cached", lambda: jobs.add_job("data", "1700", "1999", None, "0"), args.jobs)
+    queue = jobs.work_queue("data")
+    measure("worker run_job", lambda: worker.run_job(
+        lambda job_dict: [], queue.get()), args.jobs)
+    job_id = jobs.get_jobs(count=1)[0][0]["id"]
+    measure("get_job", lambda: jobs.get_job(job_id), args.jobs)
+    measure("get_job_results", lambda: jobs.get_job_results(job_id), args.jobs)
+    measure("get_jobs, page of 100", lambda: jobs.get_jobs(count=100), 10)
+    measure("data read", lambda: get_db_data("1800", "1900", None, None), args.jobs)
+
+
+if __name__ == "__main__":
+    main()
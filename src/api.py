@@ -4,14 +4,34 @@ Creates a flask server with different routes that allows for calling data,
 posting data, and creating jobs based off of the "sunspots.csv" data collection
 """
 from time import sleep
+from collections.abc import Iterator
+from datetime import datetime, timezone
+import hashlib
 import json
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, quote_etag
 import jobs
 import file_ops
-from get_db_data import get_db_data
+import artifacts
+import rolling
+import downsample
+from get_db_data import get_db_data, current_dataset, get_data_version
 
 app = Flask(__name__)
 
+JOBS_PAGE_SIZE = 100
+MAX_JOBS_PAGE_SIZE = 1000
+MAX_PERCENTILES = 100
+DOWNSAMPLE_POINTS = 640
+MAX_DOWNSAMPLE_POINTS = 10000
+MAX_BATCH_JOBS = 10000
+MAX_CLIENT_ID_LENGTH = 64
+# Rows are kept in int64 columns, see spots_data. Spots are held to
+# int32, which keeps each row's square in int64 for the stats' sums.
+MAX_YEAR = 2 ** 63 - 1
+MAX_SPOTS = 2 ** 31 - 1
+
 
 @app.route('/spots', methods=['GET'])
 def get_db_data_with_args():
@@ -19,6 +39,9 @@ def get_db_data_with_args():
     Takes a start, end, limit, and offset value from route arguments.
     Checks input with input_checker, returns 400 and errors if they exist.
     Otherwises returns json list of data requested.
+    Streams the list instead if requested, see get_stream_format.
+    Tagged with spots_etag, a matching If-None-Match gets a 304 before
+    the data is read.
     """
     start = request.args.get('start')
     end = request.args.get('end')
@@ -28,8 +51,14 @@ def get_db_data_with_args():
     start, end, limit, offset, errors = input_checker(start, end, limit, offset)
     if errors:
         return jsonify(errors), 400
-    data_list = get_db_data(start, end, limit, offset)
-    return jsonify(data_list)
+    stream_format = get_stream_format()
+    etag = spots_etag(get_data_version(), start, end, limit, offset, stream_format)
+    if not_modified(etag):
+        return tag_response(Response(status=304), etag)
+    data = get_db_data(start, end, limit, offset, columnar=True)
+    if stream_format:
+        return tag_response(stream_response(data.iter_rows(), stream_format), etag)
+    return tag_response(jsonify(data.to_list()), etag)
 
 
 @app.route('/spots', methods=['POST'])
@@ -48,12 +77,14 @@ def add_dict():
                     return jsonify("Sorry, your dict may only have keys",
                                    "for 'id', 'year', and 'spots'"), 400
                 try:
-                    if dict_x['year'] < 0 or not isinstance(dict_x['year'], int):
+                    if dict_x['year'] < 0 or dict_x['year'] > MAX_YEAR or \
+                            not isinstance(dict_x['year'], int):
                         return jsonify("Sorry your value for 'year' must be a postive int"), 400
                 except:
                     return jsonify("Sorry, your dicts must have a value for 'year'"), 400
                 try:
-                    if dict_x['spots'] < 0 or not isinstance(dict_x['spots'], int):
+                    if dict_x['spots'] < 0 or dict_x['spots'] > MAX_SPOTS or \
+                            not isinstance(dict_x['spots'], int):
                         return jsonify("Sorry your value for 'spots' must be a postive int"), 400
                 except:
                     return jsonify("Sorry, your dicts must have a value for 'spots'"), 400
@@ -66,6 +97,121 @@ def add_dict():
     return jsonify("Your additions went through!")
 
 
+@app.route('/spots/summary', methods=['GET'])
+def get_summary():
+    """
+    Takes a start, end, limit, and offset value from route arguments.
+    Checks input with input_checker, returns 400 and errors if they exist.
+    Otherwise returns json dictionary of count, sum, mean, variance,
+    standard deviation, min, and max of the requested data, answered from
+    the dataset's prefix aggregates without a job.
+    """
+    start = request.args.get('start')
+    end = request.args.get('end')
+    limit = request.args.get('limit')
+    offset = request.args.get('offset')
+
+    start, end, limit, offset, errors = input_checker(start, end, limit, offset)
+    if errors:
+        return jsonify(errors), 400
+    dataset = current_dataset()
+    first, last = dataset.bounds(start, end, limit, offset)
+    return jsonify(dataset.aggregates.summary(first, last))
+
+
+@app.route('/spots/rolling', methods=['GET'])
+def get_rolling():
+    """
+    Takes window and agg route arguments along with start, end, limit,
+    and offset.
+    Checks input with input_checker, returns 400 and errors if they exist.
+    Otherwise returns json list of the 'agg' of every full window of
+    'window' datapoints in the requested data, each with the years the
+    window starts and ends on. Streams the list if requested.
+    """
+    start = request.args.get('start')
+    end = request.args.get('end')
+    limit = request.args.get('limit')
+    offset = request.args.get('offset')
+    window = request.args.get('window')
+    agg = request.args.get('agg', "mean")
+
+    start, end, limit, offset, errors = input_checker(start, end, limit, offset)
+    try:
+        window = int(window)
+        if window < 1:
+            errors.append("Input for 'window' must be positive")
+    except (TypeError, ValueError):
+        errors.append("Input for 'window' must be an int")
+    if agg not in rolling.AGGREGATES:
+        errors.append("Input for 'agg' must be one of {}".format(", ".join(rolling.AGGREGATES)))
+    if errors:
+        return jsonify(errors), 400
+
+    data = get_db_data(start, end, limit, offset, columnar=True)
+    values = rolling.rolling(data.spots, window, agg)
+    records = rolling_records(data.years, values, window)
+    stream_format = get_stream_format()
+    if stream_format:
+        return stream_response(records, stream_format)
+    return jsonify(list(records))
+
+
+def rolling_records(years, values, window, chunk_size=1024):
+    """
+    Takes the years column, rolling values, and the window length.
+    Yields 'start year', 'end year', 'value' dictionaries, converting
+    chunk_size at a time. Undefined values come out as None.
+    """
+    for first in range(0, len(values), chunk_size):
+        last = min(first + chunk_size, len(values))
+        chunk = values[first:last].tolist()
+        for start_year, end_year, value in zip(years[first:last].tolist(),
+                                               years[first + window - 1:last + window - 1].tolist(),
+                                               chunk):
+            if value != value:
+                value = None
+            yield {'start year': start_year, 'end year': end_year, 'value': value}
+
+
+@app.route('/spots/downsampled', methods=['GET'])
+def get_downsampled():
+    """
+    Takes points and method route arguments along with start, end, limit,
+    and offset.
+    Checks input with input_checker, returns 400 and errors if they exist.
+    Otherwise returns json list of at most 'points' datapoints picked from
+    the requested data by 'method', 'lttb' or 'minmax'. The defaults give
+    the same series graph jobs plot. Streams the list if requested.
+    """
+    start = request.args.get('start')
+    end = request.args.get('end')
+    limit = request.args.get('limit')
+    offset = request.args.get('offset')
+    points = request.args.get('points', DOWNSAMPLE_POINTS)
+    method = request.args.get('method', "lttb")
+
+    start, end, limit, offset, errors = input_checker(start, end, limit, offset)
+    try:
+        points = int(points)
+        if points < 3 or points > MAX_DOWNSAMPLE_POINTS:
+            errors.append("Input for 'points' must be between 3 and {}"
+                          .format(MAX_DOWNSAMPLE_POINTS))
+    except ValueError:
+        errors.append("Input for 'points' must be an int")
+    if method not in downsample.METHODS:
+        errors.append("Input for 'method' must be one of {}".format(", ".join(downsample.METHODS)))
+    if errors:
+        return jsonify(errors), 400
+
+    data = get_db_data(start, end, limit, offset, columnar=True)
+    data = data[downsample.downsample(data.years, data.spots, points, method)]
+    stream_format = get_stream_format()
+    if stream_format:
+        return stream_response(data.iter_rows(), stream_format)
+    return jsonify(data.to_list())
+
+
 @app.route('/spots/ids/<id_input>', methods=['GET'])
 def get_id(id_input):
     """
@@ -76,8 +222,8 @@ def get_id(id_input):
     start, end, limit, offset, errors = input_checker(id_input=id_input)
     if errors:
         return jsonify(errors), 400
-    data_list = get_db_data(start, end, limit, offset)
-    return jsonify(data_list[0])
+    data = get_db_data(start, end, limit, offset, columnar=True)
+    return jsonify(data[:1].to_list()[0])
 
 
 @app.route('/spots/years/<year>', methods=['GET'])
@@ -90,21 +236,26 @@ def get_year(year):
     start, end, limit, offset, errors = input_checker(year=year)
     if errors:
         return jsonify(errors), 400
-    data_list = get_db_data(start, end, limit, offset)
-    return jsonify(data_list[0])
+    data = get_db_data(start, end, limit, offset, columnar=True)
+    return jsonify(data[:1].to_list()[0])
 
 @app.route('/jobs', methods=['POST'])
 @app.route('/jobs/<job_type>', methods=['POST'])
 def job_creation(job_type="data"):
     """
-    Takes a json dictionary with start, end, limit, or offset keys.
+    Takes a json dictionary with start, end, limit, or offset keys, an
+    optional priority, and for stats jobs an optional percentiles list.
     Checks input with input_checker, returns 400 and errors if they exist.
-    'job_type' may be 'stats', 'graph', or 'data'.
+    'job_type' may be 'stats', 'graph', 'cycles', or 'data'.
     If none given at /jobs post, a data job will be default.
     Submits jobs to job database for use with worker queues.
     Returns job details as json dictionary.
     """
+    if job_type not in jobs.WORK_TYPES:
+        return jsonify(["Job type must be one of {}".format(", ".join(jobs.WORK_TYPES))]), 400
     post_data = json.loads(request.get_data().decode("utf-8"))
+    start = end = limit = offset = percentiles = None
+    priority = jobs.DEFAULT_PRIORITY
     if post_data:
         if "start" in post_data:
             start = post_data["start"]
@@ -126,18 +277,115 @@ def job_creation(job_type="data"):
         else:
             offset = None
 
-    start, end, limit, offset, errors = input_checker(start, end, limit, offset)
+        if "percentiles" in post_data:
+            percentiles = post_data["percentiles"]
+
+        if post_data.get("priority") is not None:
+            priority = post_data["priority"]
+
+    start, end, limit, offset, errors = input_checker(start, end, limit, offset,
+                                                      percentiles=percentiles,
+                                                      priority=priority)
     if errors:
         return jsonify(errors), 400
-    return jobs.add_job(job_type, start, end, limit, offset) + "\n"
+    return jobs.add_job(job_type, start, end, limit, offset, percentiles,
+                        priority, get_client()) + "\n"
+
+
+@app.route('/jobs/batch', methods=['POST'])
+def batch_job_creation():
+    """
+    Takes a json list of job specs, dictionaries with a 'type' key, 'stats',
+    'graph', 'cycles', or 'data' (the default), and the start, end, limit,
+    offset, priority, and percentiles keys POST /jobs takes.
+    Checks every spec with input_checker, returns 400 and the errors of
+    every bad spec if there are any, so nothing is submitted.
+    Otherwise submits all the jobs at once with jobs.add_jobs.
+    Returns json list of job ids in the order of the specs.
+    """
+    post_data = json.loads(request.get_data().decode("utf-8"))
+    if not isinstance(post_data, list) or not 0 < len(post_data) <= MAX_BATCH_JOBS:
+        return jsonify(["Post data must be a json list of 1 to {} job dicts"
+                        .format(MAX_BATCH_JOBS)]), 400
+
+    specs = []
+    errors = []
+    for position, spec in enumerate(post_data):
+        if not isinstance(spec, dict):
+            errors.append("Job {}: Must be a json dict".format(position))
+            continue
+        job_type = spec.get("type", "data")
+        priority = spec.get("priority")
+        if priority is None:
+            priority = jobs.DEFAULT_PRIORITY
+        start, end, limit, offset, spec_errors = input_checker(
+            spec.get("start"), spec.get("end"), spec.get("limit"), spec.get("offset"),
+            percentiles=spec.get("percentiles"), priority=priority)
+        if job_type not in jobs.WORK_TYPES:
+            spec_errors.append("Job type must be one of {}".format(", ".join(jobs.WORK_TYPES)))
+        errors.extend("Job {}: {}".format(position, error) for error in spec_errors)
+        specs.append({"work type": job_type, "start": start, "end": end, "limit": limit,
+                      "offset": offset, "percentiles": spec.get("percentiles"),
+                      "priority": priority})
+    if errors:
+        return jsonify(errors), 400
+    return jsonify(jobs.add_jobs(specs, get_client()))
+
+
+def get_client():
+    """
+    Returns who is submitting jobs, for fair share between clients: the
+    'X-Client-Id' header if it names a client in CLIENT_WEIGHTS, or else
+    the remote address, so a client can not get more turns by making up
+    new ids.
+    """
+    client = request.headers.get('X-Client-Id')
+    if client not in jobs.CLIENT_WEIGHTS:
+        client = request.remote_addr or ""
+    return client[:MAX_CLIENT_ID_LENGTH]
 
 
 @app.route('/jobs', methods=['GET'])
 def get_all_jobs():
     """
-    Returns all jobs in jobs database as json list of dictionaries.
+    Takes optional status, type, cursor, and count route arguments.
+    Returns one page of jobs, newest first, as json list of dictionaries.
+    If there are more jobs the 'X-Next-Cursor' header holds the cursor
+    to pass for the next page.
+    """
+    status = request.args.get('status')
+    work_type = request.args.get('type')
+    cursor, count, errors = jobs_page_checker(request.args.get('cursor'),
+                                              request.args.get('count', JOBS_PAGE_SIZE))
+    if errors:
+        return jsonify(errors), 400
+
+    jobs_list, next_cursor = jobs.get_jobs(status, work_type, cursor, count)
+    response = jsonify(jobs_list)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def jobs_page_checker(cursor, count):
+    """
+    Takes the cursor and count route arguments of GET /jobs.
+    Checks count is an int in range and cursor came from 'X-Next-Cursor'.
+    Returns (cursor, count, list of errors), also used by asgi.py.
     """
-    return jsonify(jobs.get_all_jobs())
+    errors = []
+    try:
+        count = int(count)
+        if count < 1 or count > MAX_JOBS_PAGE_SIZE:
+            errors.append("Input for 'count' must be between 1 and {}".format(MAX_JOBS_PAGE_SIZE))
+    except ValueError:
+        errors.append("Input for 'count' must be an int")
+    if cursor is not None:
+        try:
+            jobs.parse_cursor(cursor)
+        except ValueError:
+            errors.append("Input for 'cursor' must come from 'X-Next-Cursor'")
+    return cursor, count, errors
 
 
 @app.route('/jobs/<job_id>', methods=['GET'])
@@ -158,14 +406,191 @@ def get_job_results(job_id):
     """
     Checks validity of job_id, if non-valid a 400 error will be returned.
     Returns job results corresponding to job_id if valid.
+    List results are streamed instead if requested, see get_stream_format,
+    and decoded record by record as they go out.
+    Tagged with results_etag, and with the completion time once completed.
+    A matching If-None-Match, or If-Modified-Since for completed jobs,
+    gets a 304 before the results are read.
     """
     try:
-        results = jobs.get_job(job_id)["results"]
-        if not results:
-            return jsonify("Your job is not yet completed.")
+        status, updated_time = jobs.get_job_state(job_id)
+    except KeyError:
+        return jsonify("Job id supplied led to no hits in our database, please try again."), 400
+    stream_format = get_stream_format()
+    etag = results_etag(status, updated_time, stream_format)
+    last_modified = results_last_modified(status, updated_time)
+    if not_modified(etag, last_modified):
+        return tag_response(Response(status=304), etag, last_modified)
+    try:
+        results = jobs.get_job_results(job_id, stream=stream_format is not None)
+        if results == "":
+            return tag_response(jsonify("Your job is not yet completed."), etag)
     except:
         return jsonify("Job id supplied led to no hits in our database, please try again."), 400
-    return jsonify(results)
+    if isinstance(results, Iterator):
+        return tag_response(stream_response(results, stream_format), etag, last_modified)
+    return tag_response(jsonify(results), etag, last_modified)
+
+
+@app.route('/jobs/<job_id>/graph', methods=['GET'])
+def get_job_graph(job_id):
+    """
+    Checks validity of job_id, if non-valid a 400 error will be returned.
+    Returns png graph of a completed graph job from the artifact store.
+    Graphs are content addressed, so the digest is a strong ETag and the
+    png may be cached for good. An evicted graph's job is released from
+    the job cache so submitting it again renders it again.
+    """
+    try:
+        results = jobs.get_job_results(job_id)
+    except KeyError:
+        return jsonify("Job id supplied led to no hits in our database, please try again."), 400
+    if results == "":
+        return jsonify("Your job is not yet completed."), 404
+    if not isinstance(results, dict) or not results.get("artifact"):
+        return jsonify("Your job has no graph."), 404
+
+    address = results["artifact"]
+    if address in request.if_none_match:
+        response = Response(status=304)
+    else:
+        image = artifacts.get(address)
+        if image is None:
+            jobs.release_job(job_id)
+            return jsonify("This graph has been evicted, please submit the job again."), 410
+        response = Response(image, mimetype="image/png")
+    response.set_etag(address)
+    response.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+    return response
+
+
+def spots_etag(version, start, end, limit, offset, stream_format):
+    """
+    Takes the data version, checked start, end, limit, and offset, and the
+    stream format of a GET /spots.
+    Returns strong ETag of its response, which only changes with the data.
+    """
+    params = json.dumps([start, end, limit, offset, stream_format], separators=(',', ':'))
+    return "spots.{}.{}".format(version, hashlib.sha256(params.encode("utf-8")).hexdigest()[:16])
+
+
+def results_etag(status, updated_time, stream_format):
+    """
+    Takes a job's status and updated time and the stream format of a
+    GET /jobs/<id>/results.
+    Returns strong ETag of its response, which changes with the job's state.
+    """
+    state = json.dumps([status, updated_time, stream_format], separators=(',', ':'))
+    return "results.{}".format(hashlib.sha256(state.encode("utf-8")).hexdigest()[:16])
+
+
+def results_last_modified(status, updated_time):
+    """
+    Takes a job's status and updated time.
+    Returns utc datetime the job completed, or None if it has not, as
+    results only settle on completion. Updated times are in the local
+    time of the process that set them.
+    """
+    if status != "Completed" or not updated_time:
+        return None
+    updated = datetime.fromisoformat(updated_time).astimezone(timezone.utc)
+    return updated.replace(microsecond=0)
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Takes the ETag and last modified datetime, if any, of the response.
+    Returns headers_not_modified for the request's headers.
+    """
+    return headers_not_modified(etag, last_modified, request.headers.get("If-None-Match"),
+                                request.headers.get("If-Modified-Since"))
+
+
+def headers_not_modified(etag, last_modified, if_none_match, if_modified_since):
+    """
+    Takes the ETag and last modified datetime, if any, of a response, and
+    the If-None-Match and If-Modified-Since headers of its request, if any.
+    Returns True if If-None-Match, or If-Modified-Since when there is no
+    If-None-Match, shows the client already has it. Used by asgi.py too.
+    """
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    since = parse_date(if_modified_since)
+    return last_modified is not None and since is not None and last_modified <= since
+
+
+def tag_response(response, etag, last_modified=None):
+    """
+    Takes a Response, its ETag, and last modified datetime, if any.
+    Returns response with the tag_headers set.
+    """
+    for name, value in tag_headers(etag, last_modified).items():
+        response.headers[name] = value
+    return response
+
+
+def tag_headers(etag, last_modified=None):
+    """
+    Takes an ETag and last modified datetime, if any.
+    Returns dict of the headers tagging a response with them, to be
+    revalidated on every use. Used by asgi.py too.
+    """
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': "no-cache", 'Vary': "Accept"}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def get_stream_format():
+    """
+    Returns choose_stream_format for the request's 'stream' route argument
+    and Accept header.
+    """
+    return choose_stream_format(request.args.get('stream'), request.headers.get("Accept"))
+
+
+def choose_stream_format(stream, accept):
+    """
+    Takes the 'stream' route argument and Accept header, if any.
+    Checks stream, 'json' or 'ndjson', and falls back to the Accept header,
+    where "application/x-ndjson" as the best match means ndjson.
+    Returns the streaming format to use, or None to respond normally.
+    Used by asgi.py too.
+    """
+    if stream in ("json", "ndjson"):
+        return stream
+    if parse_accept_header(accept, MIMEAccept).best == "application/x-ndjson":
+        return "ndjson"
+    return None
+
+
+def stream_response(records, stream_format):
+    """
+    Takes an iterable of json serializable records and a stream format.
+    Returns streamed Response of stream_chunks.
+    """
+    mimetype = "application/x-ndjson" if stream_format == "ndjson" else "application/json"
+    return Response(stream_with_context(stream_chunks(records, stream_format)),
+                    mimetype=mimetype)
+
+
+def stream_chunks(records, stream_format):
+    """
+    Takes an iterable of json serializable records and a stream format.
+    'json' yields a chunked json list, 'ndjson' yields one record per line.
+    Records are serialized as they are yielded so the first byte goes out
+    before the whole payload is built.
+    """
+    if stream_format == "ndjson":
+        for record in records:
+            yield json.dumps(record, sort_keys=True) + "\n"
+        return
+
+    separator = "["
+    for record in records:
+        yield separator + json.dumps(record, sort_keys=True)
+        separator = ","
+    yield "[]\n" if separator == "[" else "]\n"
 
 
 def input_checker(start=None, end=None, limit=None, offset=None, **special_flags):
@@ -225,6 +650,25 @@ def input_checker(start=None, end=None, limit=None, offset=None, **special_flags
         except ValueError:
             input_errors.append("Input for 'id' must be an int")
 
+    if special_flags.get("percentiles") is not None:
+        percentiles = special_flags["percentiles"]
+        if not isinstance(percentiles, list) or len(percentiles) > MAX_PERCENTILES:
+            input_errors.append("Input for 'percentiles' must be a list of at most {} numbers"
+                                .format(MAX_PERCENTILES))
+        else:
+            for percent in percentiles:
+                if isinstance(percent, bool) or not isinstance(percent, (int, float)) \
+                        or not 0 <= percent <= 100:
+                    input_errors.append("Input for 'percentiles' must be numbers from 0 to 100")
+                    break
+
+    if special_flags.get("priority") is not None:
+        priority = special_flags["priority"]
+        if isinstance(priority, bool) or not isinstance(priority, int) \
+                or not 0 <= priority <= jobs.MAX_PRIORITY:
+            input_errors.append("Input for 'priority' must be an int from 0 to {}"
+                                .format(jobs.MAX_PRIORITY))
+
     if "year" in special_flags:
         try:
             year = int(special_flags["year"])
@@ -241,8 +685,12 @@ def input_checker(start=None, end=None, limit=None, offset=None, **special_flags
     return start, end, limit, offset, input_errors
 
 
-if __name__ == "__main__":
-    # Waits for db initialization to be success with running redis.
+def start_up():
+    """
+    Waits for db initialization to be success with running redis, then
+    migrates jobs from older versions and starts the csv compactor.
+    Run before serving, by either server.
+    """
     while True:
         try:
             file_ops.init_db_data()
@@ -250,4 +698,11 @@ if __name__ == "__main__":
         except:
             print("Error: Redis not yet initialized. Reattempting reconnection in 3 seconds")
             sleep(3)
+    jobs.index_existing_jobs()
+    jobs.requeue_legacy_jobs()
+    file_ops.start_compactor()
+
+
+if __name__ == "__main__":
+    start_up()
     app.run(debug=False, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+Author: Christian R. Garcia
+Content addressed artifact store in redis for rendered graphs.
+Artifacts are keyed by the sha256 of their bytes, and a render key made
+from the inputs of a render points at the artifact it produced, so the
+same data and parameters never get rendered twice. Total size is bounded,
+least recently used artifacts are evicted first, along with the render
+keys pointing at them.
+"""
+import os
+import hashlib
+from time import time
+import redis_conn
+
+ARTIFACT_DB_ID = os.getenv("ARTIFACT_DB_ID", os.getenv("JOB_DB_ID"))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+ARTIFACT_DB = redis_conn.get_client(ARTIFACT_DB_ID)
+
+ARTIFACT_PREFIX = "artifact."
+RENDER_PREFIX = "artifact.render."
+LRU_KEY = "artifact.lru"
+BYTES_KEY = "artifact.bytes"
+# Set of the render keys pointing at an artifact, followed by its digest.
+RENDERS_PREFIX = "artifact.renders."
+
+# KEYS: artifact key, render pointer key, the artifact's renders set.
+# ARGV: digest, render key. Points the render key at the artifact only if
+# it has not been evicted, so no pointer outlives its artifact.
+REMEMBER_SCRIPT = ARTIFACT_DB.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+return 1
+""")
+
+
+def digest(*parts):
+    """
+    Takes bytes or str parts.
+    Returns hex sha256 of them joined together.
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part.encode("utf-8") if isinstance(part, str) else part)
+    return sha.hexdigest()
+
+
+def put(data):
+    """
+    Takes artifact bytes and stores them under their digest, if not
+    already stored, then evicts down to ARTIFACT_MAX_BYTES.
+    Returns the digest.
+    """
+    address = digest(data)
+    pipe = ARTIFACT_DB.pipeline()
+    pipe.set(ARTIFACT_PREFIX + address, data, nx=True)
+    pipe.zadd(LRU_KEY, {address: time()})
+    created = pipe.execute()[0]
+    if created:
+        total = ARTIFACT_DB.incrby(BYTES_KEY, len(data))
+        if total > ARTIFACT_MAX_BYTES:
+            _evict(keep=address)
+    return address
+
+
+def get(address):
+    """
+    Takes an artifact digest.
+    Returns its bytes, marking it recently used, or None if evicted.
+    """
+    data = ARTIFACT_DB.get(ARTIFACT_PREFIX + address)
+    if data is not None:
+        ARTIFACT_DB.zadd(LRU_KEY, {address: time()})
+    return data
+
+
+def lookup(render_key):
+    """
+    Takes a render key.
+    Returns digest of the artifact rendered for it, or None if it was
+    never rendered or has since been evicted, in which case a render key
+    left from before _evict removed them is deleted.
+    """
+    address = ARTIFACT_DB.get(RENDER_PREFIX + render_key)
+    if address is None:
+        return None
+    address = address.decode("utf-8")
+    if not ARTIFACT_DB.exists(ARTIFACT_PREFIX + address):
+        ARTIFACT_DB.delete(RENDER_PREFIX + render_key)
+        return None
+    return address
+
+
+def remember(render_key, address):
+    """
+    Takes a render key and the digest of the artifact it produced.
+    Points the render key at it so later identical renders reuse it,
+    unless it was evicted in the meantime.
+    """
+    REMEMBER_SCRIPT(keys=[ARTIFACT_PREFIX + address, RENDER_PREFIX + render_key,
+                          RENDERS_PREFIX + address], args=[address, render_key])
+
+
+def _evict(keep):
+    """
+    Takes the digest of an artifact that must stay.
+    Deletes least recently used artifacts, and the render keys pointing
+    at them, until the total size is back under ARTIFACT_MAX_BYTES.
+    """
+    while int(ARTIFACT_DB.get(BYTES_KEY) or 0) > ARTIFACT_MAX_BYTES:
+        oldest = [address.decode("utf-8") for address in ARTIFACT_DB.zrange(LRU_KEY, 0, 1)]
+        oldest = [address for address in oldest if address != keep]
+        if not oldest:
+            break
+        pipe = ARTIFACT_DB.pipeline()
+        pipe.zrem(LRU_KEY, oldest[0])
+        pipe.strlen(ARTIFACT_PREFIX + oldest[0])
+        pipe.delete(ARTIFACT_PREFIX + oldest[0])
+        pipe.smembers(RENDERS_PREFIX + oldest[0])
+        pipe.delete(RENDERS_PREFIX + oldest[0])
+        _, size, _, render_keys, _ = pipe.execute()
+        pipe = ARTIFACT_DB.pipeline()
+        pipe.decrby(BYTES_KEY, size)
+        for render_key in render_keys:
+            pipe.delete(RENDER_PREFIX + render_key.decode("utf-8"))
+        pipe.execute()
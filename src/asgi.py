@@ -0,0 +1,261 @@
+"""
+Author: Christian R. Garcia
+Asyncio serving mode for the api. The routes clients poll, GET /spots,
+/spots/summary, /spots/ids, /spots/years, /jobs, /jobs/<id>, and
+/jobs/<id>/results, are served by Starlette on an async redis connection
+pool, so a request waiting on redis holds a coroutine instead of a
+thread. Every other route, including all writes, goes to the Flask app
+in api.py on a threadpool. Inputs are checked by the same input_checker
+and responses, including their ETags and 304s, match the Flask ones.
+
+Run with "python3 asgi.py" in place of "python3 api.py".
+"""
+import os
+import json
+from collections.abc import Iterator
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+import api
+import jobs
+import get_db_data
+import redis_conn
+from api import (input_checker, stream_chunks, spots_etag, results_etag, results_last_modified,
+                 headers_not_modified, tag_headers, choose_stream_format)
+
+SPOTS_DB_ID = os.getenv("SPOTS_DB_ID")
+ASGI_PORT = int(os.getenv("ASGI_PORT", "5000"))
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "10"))
+
+SPOTS_DB = redis_conn.get_async_client(SPOTS_DB_ID)
+
+NO_JOB = "Job id supplied led to no hits in our database, please try again."
+
+
+def dumps(value):
+    """
+    Takes a json serializable value.
+    Returns it as json text the way Flask's jsonify writes it.
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+def json_response(value, status_code=200, headers=None):
+    """
+    Takes a small json serializable value, status code, and headers.
+    Returns json Response.
+    """
+    return Response(dumps(value), status_code, headers, media_type="application/json")
+
+
+async def large_json_response(value, headers=None):
+    """
+    Takes a json serializable value that may be large, and headers.
+    Returns json Response, encoded on the threadpool.
+    """
+    return Response(await run_in_threadpool(dumps, value), headers=headers,
+                    media_type="application/json")
+
+
+def stream_response(records, stream_format, headers=None):
+    """
+    Takes an iterable of json serializable records, a stream format, and
+    headers.
+    Returns StreamingResponse of api.stream_chunks.
+    """
+    media_type = "application/x-ndjson" if stream_format == "ndjson" else "application/json"
+    return StreamingResponse(stream_chunks(records, stream_format), headers=headers,
+                             media_type=media_type)
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Takes the request and the ETag and last modified datetime, if any, of
+    its response.
+    Returns api.headers_not_modified for the request's headers.
+    """
+    return headers_not_modified(etag, last_modified, request.headers.get("if-none-match"),
+                                request.headers.get("if-modified-since"))
+
+
+def get_stream_format(request):
+    """
+    Takes the request.
+    Returns api.choose_stream_format for its 'stream' route argument and
+    Accept header.
+    """
+    return choose_stream_format(request.query_params.get('stream'),
+                                request.headers.get("accept"))
+
+
+async def get_data_version():
+    """
+    Returns the current data version, see get_db_data.get_data_version.
+    """
+    return get_db_data.data_version(*await SPOTS_DB.mget(get_db_data.EPOCH_KEY,
+                                                          get_db_data.VERSION_KEY))
+
+
+async def get_dataset():
+    """
+    Checks the data version against the dataset cached by this process,
+    the same cache get_db_data.get_dataset keeps, and reloads the snapshot
+    and its deltas only if the version moved.
+    Returns (version, SpotsData) of the whole dataset.
+    """
+    cached = get_db_data.cached_dataset()
+    if await get_data_version() == cached[0]:
+        return cached
+
+    async with SPOTS_DB.pipeline() as pipe:
+        pipe.get(get_db_data.EPOCH_KEY)
+        pipe.get(get_db_data.VERSION_KEY)
+        pipe.get(get_db_data.SNAPSHOT_KEY)
+        pipe.lrange(get_db_data.DELTA_KEY, 0, -1)
+        epoch, counter, snapshot, deltas = await pipe.execute()
+    if snapshot is None:
+        return await run_in_threadpool(get_db_data.get_dataset)
+    return get_db_data.use_snapshot(get_db_data.data_version(epoch, counter), snapshot, deltas)
+
+
+async def get_data(start, end, limit, offset):
+    """
+    Takes start, end, limit, and offset, already checked.
+    Returns SpotsData of the requested rows, read as get_db_data does.
+    """
+    if not get_db_data.DATA_CACHE:
+        return await run_in_threadpool(get_db_data.get_db_data, start, end, limit, offset, True)
+    _, dataset = await get_dataset()
+    return dataset.select(start, end, limit, offset)
+
+
+async def get_spots(request):
+    """
+    Async GET /spots, see api.get_db_data_with_args.
+    """
+    args = request.query_params
+    start, end, limit, offset, errors = input_checker(
+        args.get('start'), args.get('end'), args.get('limit'), args.get('offset'))
+    if errors:
+        return json_response(errors, 400)
+    stream_format = get_stream_format(request)
+    etag = spots_etag(await get_data_version(), start, end, limit, offset, stream_format)
+    headers = tag_headers(etag)
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    data = await get_data(start, end, limit, offset)
+    if stream_format:
+        return stream_response(data.iter_rows(), stream_format, headers)
+    return await large_json_response(data.to_list(), headers)
+
+
+async def get_summary(request):
+    """
+    Async GET /spots/summary, see api.get_summary.
+    """
+    args = request.query_params
+    start, end, limit, offset, errors = input_checker(
+        args.get('start'), args.get('end'), args.get('limit'), args.get('offset'))
+    if errors:
+        return json_response(errors, 400)
+    if get_db_data.DATA_CACHE:
+        _, dataset = await get_dataset()
+    else:
+        dataset = await run_in_threadpool(get_db_data.current_dataset)
+    first, last = dataset.bounds(start, end, limit, offset)
+    return json_response(dataset.aggregates.summary(first, last))
+
+
+async def get_id(request):
+    """
+    Async GET /spots/ids/<id>, see api.get_id.
+    """
+    start, end, limit, offset, errors = input_checker(id_input=request.path_params['id_input'])
+    if errors:
+        return json_response(errors, 400)
+    data = await get_data(start, end, limit, offset)
+    return json_response(data[:1].to_list()[0])
+
+
+async def get_year(request):
+    """
+    Async GET /spots/years/<year>, see api.get_year.
+    """
+    start, end, limit, offset, errors = input_checker(year=request.path_params['year'])
+    if errors:
+        return json_response(errors, 400)
+    data = await get_data(start, end, limit, offset)
+    return json_response(data[:1].to_list()[0])
+
+
+async def get_all_jobs(request):
+    """
+    Async GET /jobs, see api.get_all_jobs.
+    """
+    args = request.query_params
+    cursor, count, errors = api.jobs_page_checker(args.get('cursor'),
+                                                  args.get('count', api.JOBS_PAGE_SIZE))
+    if errors:
+        return json_response(errors, 400)
+    jobs_list, next_cursor = await jobs.get_jobs_async(args.get('status'), args.get('type'),
+                                                       cursor, count)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor is not None else None
+    return json_response(jobs_list, headers=headers)
+
+
+async def get_one_job(request):
+    """
+    Async GET /jobs/<id>, see api.get_one_job.
+    """
+    try:
+        return json_response(await jobs.get_job_async(request.path_params['job_id']))
+    except KeyError:
+        return json_response(NO_JOB, 400)
+
+
+async def get_job_results(request):
+    """
+    Async GET /jobs/<id>/results, see api.get_job_results.
+    """
+    job_id = request.path_params['job_id']
+    try:
+        status, updated_time = await jobs.get_job_state_async(job_id)
+    except KeyError:
+        return json_response(NO_JOB, 400)
+    stream_format = get_stream_format(request)
+    etag = results_etag(status, updated_time, stream_format)
+    last_modified = results_last_modified(status, updated_time)
+    if not_modified(request, etag, last_modified):
+        # Like Werkzeug's, a 304 carries no Last-Modified, see RFC 7232 4.1.
+        return Response(status_code=304, headers=tag_headers(etag))
+
+    try:
+        results = await jobs.get_job_results_async(job_id, stream=stream_format is not None)
+    except KeyError:
+        return json_response(NO_JOB, 400)
+    if results == "":
+        return json_response("Your job is not yet completed.", headers=tag_headers(etag))
+    headers = tag_headers(etag, last_modified)
+    if isinstance(results, Iterator):
+        return stream_response(results, stream_format, headers)
+    return await large_json_response(results, headers)
+
+
+app = Starlette(routes=[
+    Route('/spots', get_spots, methods=['GET']),
+    Route('/spots/summary', get_summary, methods=['GET']),
+    Route('/spots/ids/{id_input}', get_id, methods=['GET']),
+    Route('/spots/years/{year}', get_year, methods=['GET']),
+    Route('/jobs', get_all_jobs, methods=['GET']),
+    Route('/jobs/{job_id}', get_one_job, methods=['GET']),
+    Route('/jobs/{job_id}/results', get_job_results, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(api.app, workers=WSGI_THREADS)),
+])
+
+
+if __name__ == "__main__":
+    api.start_up()
+    uvicorn.run(app, host='0.0.0.0', port=ASGI_PORT)
@@ -0,0 +1,117 @@
+"""
+Author: Christian R. Garcia
+Binary encodings for what is stored in redis. The dataset is stored as a
+packed snapshot of its year and spots columns, little endian int32 when
+the values fit and int64 otherwise, so loading it is one GET and a
+buffer copy instead of parsing every record. Job results are stored
+with RESULTS_CODEC, msgpack, or zlib compressed json when space matters
+more than speed or msgpack is not installed.
+Everything decodes values written as plain json by older versions too.
+"""
+import os
+import io
+import json
+import zlib
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+RESULTS_CODEC = os.getenv("RESULTS_CODEC", "msgpack")
+ZLIB_LEVEL = 6
+
+SNAPSHOT_MAGIC = b"SPOTS"
+# Json text never starts with a null byte, so it marks a coded value.
+CODED_MARK = b"\x00"
+CODECS = {"zlib": b"z", "msgpack": b"m"}
+
+INT32 = np.iinfo(np.int32)
+
+
+def encode_columns(years, spots):
+    """
+    Takes years and spots columns of a whole dataset.
+    Returns bytes of the header, b"SPOTS", the integer width, and the row
+    count, followed by the packed years and then the packed spots.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    spots = np.asarray(spots, dtype=np.int64)
+    width = 4
+    for column in (years, spots):
+        if len(column) and (column.min() < INT32.min or column.max() > INT32.max):
+            width = 8
+    dtype = "<i{}".format(width)
+    header = SNAPSHOT_MAGIC + bytes([width]) + np.array([len(years)], dtype="<u8").tobytes()
+    return header + years.astype(dtype).tobytes() + spots.astype(dtype).tobytes()
+
+
+def decode_columns(snapshot):
+    """
+    Takes bytes from encode_columns.
+    Returns (years, spots) int64 columns.
+    Raises ValueError if snapshot is not a dataset snapshot.
+    """
+    if not snapshot.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("not a dataset snapshot")
+    start = len(SNAPSHOT_MAGIC)
+    width = snapshot[start]
+    count = int(np.frombuffer(snapshot, dtype="<u8", count=1, offset=start + 1)[0])
+    offset = start + 9
+    columns = np.frombuffer(snapshot, dtype="<i{}".format(width), count=2 * count, offset=offset)
+    return columns[:count].astype(np.int64), columns[count:].astype(np.int64)
+
+
+def encode_value(value, codec=None):
+    """
+    Takes a json serializable value and a codec name, RESULTS_CODEC if
+    not given. Falls back to zlib if msgpack is not installed.
+    Returns bytes of the coded value, json text for the 'json' codec.
+    """
+    codec = codec or RESULTS_CODEC
+    if codec == "msgpack" and msgpack is None:
+        codec = "zlib"
+    if codec == "msgpack":
+        return CODED_MARK + CODECS[codec] + msgpack.packb(value, use_bin_type=True)
+    if codec == "zlib":
+        return CODED_MARK + CODECS[codec] + zlib.compress(json.dumps(value).encode("utf-8"),
+                                                          ZLIB_LEVEL)
+    return json.dumps(value).encode("utf-8")
+
+
+def decode_value(raw):
+    """
+    Takes bytes written by encode_value, or plain json by older versions.
+    Returns the decoded value.
+    """
+    if not raw.startswith(CODED_MARK):
+        return json.loads(raw)
+    codec, payload = raw[1:2], raw[2:]
+    if codec == CODECS["zlib"]:
+        return json.loads(zlib.decompress(payload))
+    if codec == CODECS["msgpack"]:
+        if msgpack is None:
+            raise ValueError("value was stored with msgpack, which is not installed")
+        return msgpack.unpackb(payload, raw=False)
+    raise ValueError("unknown codec {!r}".format(codec))
+
+
+def iter_value(raw):
+    """
+    Takes bytes written by encode_value, or plain json by older versions.
+    Returns an iterator over the items of a list value, decoded one item
+    at a time for msgpack so a large list is never all in memory at once,
+    or the decoded value itself if it is not a list.
+    """
+    if msgpack is None or not raw.startswith(CODED_MARK + CODECS["msgpack"]):
+        value = decode_value(raw)
+        return iter(value) if isinstance(value, list) else value
+    payload = io.BytesIO(raw)
+    payload.seek(2)
+    unpacker = msgpack.Unpacker(payload, raw=False)
+    try:
+        count = unpacker.read_array_header()
+    except ValueError:
+        return decode_value(raw)
+    return (unpacker.unpack() for _ in range(count))
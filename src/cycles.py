@@ -0,0 +1,128 @@
+"""
+Author: Christian R. Garcia
+Solar cycle analysis of the spots column. Estimates the dominant period
+from a periodogram of the series and splits it into cycles between
+smoothed minima. Everything is numpy array work so monthly or daily
+series cost about the same as yearly ones per point.
+"""
+import numpy as np
+
+PERIODOGRAM_PEAKS = 10
+# A period only counts if the range holds at least this many of it, which
+# keeps slow drifts like the Dalton minimum from passing as a cycle.
+MIN_CYCLES = 3
+
+
+def analyze_cycles(years, spots):
+    """
+    Takes year sorted years and spots columns.
+    Averages repeated years, fills gaps onto an evenly spaced grid, and
+    runs the periodogram and cycle detection on it.
+    Returns dictionary of the dominant period, the strongest periodogram
+    peaks, each detected cycle, and the mean cycle length. Periods longer
+    than a third of the range are left out.
+    """
+    grid, values = even_series(years, spots)
+    results = {"points": len(values), "dominant period": None, "periodogram": [],
+               "cycles": [], "mean cycle length": None}
+    if len(values) < 4:
+        return results
+
+    step = grid[1] - grid[0]
+    periods, power = periodogram(values, step)
+    in_band = periods <= (grid[-1] - grid[0] + step) / MIN_CYCLES
+    if not in_band.any():
+        return results
+    periods, power = periods[in_band], power[in_band]
+    strongest = np.argsort(power)[::-1][:PERIODOGRAM_PEAKS]
+    results["periodogram"] = [{"period": float(periods[index]), "power": float(power[index])}
+                              for index in strongest]
+    dominant = float(periods[strongest[0]])
+    results["dominant period"] = dominant
+
+    cycles = find_cycles(grid, values, dominant)
+    results["cycles"] = cycles
+    if cycles:
+        results["mean cycle length"] = float(np.mean([cycle["length"] for cycle in cycles]))
+    return results
+
+
+def even_series(years, spots):
+    """
+    Takes year sorted years and spots columns.
+    Returns (grid, values) with one averaged value per distinct year,
+    interpolated onto an evenly spaced grid at the most common spacing.
+    """
+    years = np.asarray(years, dtype=np.float64)
+    spots = np.asarray(spots, dtype=np.float64)
+    if not len(years):
+        return years, spots
+
+    distinct, inverse = np.unique(years, return_inverse=True)
+    values = np.bincount(inverse, weights=spots) / np.bincount(inverse)
+    if len(distinct) < 2:
+        return distinct, values
+
+    step = float(np.median(np.diff(distinct)))
+    grid = distinct[0] + step * np.arange(int(round((distinct[-1] - distinct[0]) / step)) + 1)
+    return grid, np.interp(grid, distinct, values)
+
+
+def periodogram(values, step):
+    """
+    Takes evenly spaced values and their spacing in years.
+    Returns (periods, power) of the real FFT of the linearly detrended,
+    Hann windowed series, without the zero frequency.
+    """
+    index = np.arange(len(values))
+    trend = np.polyval(np.polyfit(index, values, 1), index)
+    window = np.hanning(len(values))
+    spectrum = np.fft.rfft((values - trend) * window)
+    frequencies = np.fft.rfftfreq(len(values), d=step)
+    power = np.abs(spectrum[1:]) ** 2 / np.sum(window ** 2)
+    return 1 / frequencies[1:], power
+
+
+def smooth(values, width):
+    """
+    Takes values and an odd window width.
+    Returns centered running mean of the same length from a cumulative
+    sum, with the window shrinking at the ends.
+    """
+    half = width // 2
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    index = np.arange(len(values))
+    lower = np.maximum(index - half, 0)
+    upper = np.minimum(index + half + 1, len(values))
+    return (sums[upper] - sums[lower]) / (upper - lower)
+
+
+def find_cycles(grid, values, period):
+    """
+    Takes the evenly spaced grid and values and the dominant period.
+    Smooths over about a quarter period, takes the lowest local minima at
+    least half a period apart as cycle boundaries, and the peak between
+    each pair of minima as that cycle's maximum.
+    Returns list of cycle dictionaries in year order.
+    """
+    step = grid[1] - grid[0]
+    width = max(int(round(period / step / 4)) | 1, 1)
+    smoothed = smooth(values, width)
+
+    inner = smoothed[1:-1]
+    candidates = np.flatnonzero((inner <= smoothed[:-2]) & (inner <= smoothed[2:])) + 1
+    separation = period / 2 / step
+    minima = []
+    for index in candidates[np.argsort(smoothed[candidates], kind="stable")]:
+        if all(abs(index - kept) >= separation for kept in minima):
+            minima.append(index)
+    minima.sort()
+
+    cycles = []
+    for start, end in zip(minima, minima[1:]):
+        peak = start + int(np.argmax(values[start:end + 1]))
+        cycles.append({"start": float(grid[start]), "end": float(grid[end]),
+                       "length": float(grid[end] - grid[start]),
+                       "max year": float(grid[peak]), "max spots": float(values[peak]),
+                       "min spots": float(values[start])})
+    return cycles
@@ -0,0 +1,26 @@
+"""
+Author: Christian R. Garcia
+Cycles worker that waits for a queue to be filled with a job_id, once filled
+the worker gets the job_dict, updates the job status, and executes the job.
+Once done the status is again change, now from 'processing' to 'completed'.
+Worker then begins waiting for a new job_id.
+"""
+import worker
+from get_db_data import get_db_data
+from cycles import analyze_cycles
+
+def execute_job(job_dict):
+    """
+    Takes job_dict as input.
+    Gets the data from get_db_data so data bounds are correct.
+    Runs cycles.analyze_cycles on the year and spots columns.
+    Returns dictionary of period and cycle results.
+    """
+    data = get_db_data(job_dict["start"], job_dict["end"],
+                       job_dict["limit"], job_dict["offset"], columnar=True)
+    return analyze_cycles(data.years, data.spots)
+
+
+if __name__ == "__main__":
+    print("Cycles worker running")
+    worker.run("cycles", execute_job, default_pool="process")
@@ -0,0 +1,82 @@
+"""
+Author: Christian R. Garcia
+Reduces a long series to a fixed number of points so graphs and json
+stay the same size however large the requested range is. Both methods
+return the indices of the points they keep, in order, so any column of
+the data can be picked with them.
+"""
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def downsample(x, y, points, method="lttb"):
+    """
+    Takes x and y columns, the number of points to keep, and a method
+    name from METHODS.
+    Returns sorted indices of at most points kept points, every index
+    if the series is already short enough.
+    """
+    if method == "lttb":
+        return lttb(x, y, points)
+    if method == "minmax":
+        return minmax(y, points)
+    raise ValueError("method must be one of {}".format(", ".join(METHODS)))
+
+
+def lttb(x, y, points):
+    """
+    Takes x and y columns and the number of points to keep.
+    Largest triangle three buckets: keeps the first and last points, and
+    from each bucket in between the point making the largest triangle
+    with the last kept point and the average of the next bucket, which
+    follows the shape of the series far better than every n-th point.
+    Returns sorted indices of the kept points.
+    """
+    size = len(y)
+    if points >= size:
+        return np.arange(size)
+    if points < 3:
+        return np.array([0, size - 1][:max(points, 0)], dtype=np.int64)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # points - 2 buckets over everything but the end points, each at least one point long.
+    edges = np.floor(np.linspace(1, size - 1, points - 1)).astype(np.int64)
+    kept = np.empty(points, dtype=np.int64)
+    kept[0] = last = 0
+    for bucket in range(points - 2):
+        first, stop = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[stop:edges[bucket + 2]].mean()
+            next_y = y[stop:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[size - 1], y[size - 1]
+        areas = np.abs((x[last] - next_x) * (y[first:stop] - y[last]) -
+                       (x[last] - x[first:stop]) * (next_y - y[last]))
+        last = first + int(np.argmax(areas))
+        kept[bucket + 1] = last
+    kept[points - 1] = size - 1
+    return kept
+
+
+def minmax(y, points):
+    """
+    Takes the y column and the number of points to keep.
+    Splits the series into points // 2 equal buckets and keeps the lowest
+    and highest point of each, so no peak or trough is ever dropped.
+    Returns sorted indices of the kept points.
+    """
+    size = len(y)
+    if points >= size:
+        return np.arange(size)
+    buckets = max(points // 2, 1)
+
+    y = np.asarray(y)
+    edges = np.linspace(0, size, buckets + 1).astype(np.int64)
+    kept = []
+    for first, stop in zip(edges[:-1], edges[1:]):
+        chunk = y[first:stop]
+        kept.append(first + int(np.argmin(chunk)))
+        kept.append(first + int(np.argmax(chunk)))
+    return np.unique(kept)
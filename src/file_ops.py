@@ -3,69 +3,336 @@ Author: Christian R. Garcia
 File operations to allow initialization of data database, updating
 of data database, and updating of data file. All done atomically
 or using pipes to insure data is not used when being written.
+
+New data is merged into redis in place and appended to a change log
+next to the csv. A background compactor folds the change log back into
+the csv snapshot, and the redis snapshot's deltas into it, every so often.
 """
 import os
+import uuid
+import hashlib
 import tempfile as tmp
 from contextlib import contextmanager
-import json
+from threading import Event, Lock, Thread
+from time import sleep
 import operator
+import numpy as np
 import redis
+import codec
+import redis_conn
+from get_db_data import (get_dataset, RECORDS_KEY, YEARS_KEY, VERSION_KEY, SNAPSHOT_KEY,
+                         DELTA_KEY, EPOCH_KEY)
+from spots_data import SpotsData
 
 CSV_LOC = "sunspots.csv"
+LOG_LOC = "sunspots.log"
+# First line of the change log, followed by the csv_digest it applies to.
+LOG_HEADER = "#csv "
 
-REDIS_IP = os.getenv("REDIS_IP")
-REDIS_PORT = os.getenv("REDIS_PORT")
 SPOTS_DB_ID = os.getenv("SPOTS_DB_ID")
+COMPACT_INTERVAL = int(os.getenv("COMPACT_INTERVAL", "60"))
+GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW", "0"))
+MAX_WRITE_RETRIES = 20
+
+SPOTS_DB = redis_conn.get_client(SPOTS_DB_ID)
 
-SPOTS_DB = redis.StrictRedis(host=REDIS_IP, port=REDIS_PORT, db=SPOTS_DB_ID)
+# Held while merging into redis, appending to the log, or compacting.
+WRITE_LOCK = Lock()
+# Batches waiting for the next group commit, see update_redis_and_csv.
+PENDING_BATCHES = []
+PENDING_LOCK = Lock()
 
 def init_db_data():
     """
-    Once called, function will take CSV_FILE, parse it, and
-    upload it to the SPOTS_DB for use throughout.
+    Once called, function will take CSV_FILE along with any rows in the
+    change log not yet compacted, parse them, and upload them to the
+    SPOTS_DB for use throughout. A change log already folded into the csv
+    is emptied first, see read_change_log.
     """
-    data_list = []
-    with open(CSV_LOC, mode='r') as csv_file:
-        for index, line in enumerate(csv_file):
-            year, spots = line.split(',')
-            year = int(year)
-            spots = int(spots)
-            data_list.append({'id': index, 'year': year, 'spots': spots})
-    pipe_write_redis(data_list)
+    with WRITE_LOCK:
+        log_rows = read_change_log()
+        if log_rows is None:
+            reset_change_log(csv_digest())
+            log_rows = []
+    rows = sorted(read_rows(CSV_LOC) + log_rows, key=operator.itemgetter(0))
+    data = SpotsData.from_columns([row[0] for row in rows], [row[1] for row in rows])
+    pipe_write_redis(data)
     print("Initial data upload to redis complete")
 
 
-def pipe_write_redis(data):
+def read_rows(filepath):
+    """
+    Takes path to a "year,spots" csv or change log.
+    Returns list of (year, spots) tuples, empty if file does not exist.
+    Lines starting with '#' are skipped.
+    """
+    rows = []
+    if not os.path.exists(filepath):
+        return rows
+    with open(filepath, mode='r') as csv_file:
+        for line in csv_file:
+            if not line.strip() or line.startswith('#'):
+                continue
+            year, spots = line.split(',')
+            rows.append((int(year), int(spots)))
+    return rows
+
+
+def pipe_write_redis(data, first_id=0):
     """
-    Writes data to SPOTS_DB with pipeline to insure that no data
-    is overwritten or corrupted due to race conditions.
+    Takes SpotsData of the whole dataset and the first id that changed.
+    Writes rows from first_id on to SPOTS_DB with pipeline to insure that
+    no data is overwritten or corrupted due to race conditions.
     """
     pipe = SPOTS_DB.pipeline()
-    pipe.set("data", json.dumps(data))
+    queue_redis_writes(pipe, data, first_id)
     pipe.execute()
 
 
+def queue_redis_writes(pipe, data, first_id, new_columns=None):
+    """
+    Takes a pipeline, SpotsData of the whole dataset, the first id that
+    changed, and the (years, spots) columns of the rows added, if only
+    rows were added. Queues writes of rows from first_id on.
+    Each record goes into the RECORDS_KEY hash as "year,spots" under
+    its id, and its id goes into the YEARS_KEY sorted set scored by year.
+    Added rows are packed onto DELTA_KEY, to be folded into the snapshot
+    by fold_snapshot, otherwise SNAPSHOT_KEY is replaced by the packed
+    columns of the whole dataset, DELTA_KEY emptied, and EPOCH_KEY given a
+    new token, see get_db_data.data_version.
+    VERSION_KEY is bumped in the same transaction so cached readers reload.
+    """
+    changed = data[first_id:]
+    if first_id == 0:
+        pipe.delete(RECORDS_KEY, YEARS_KEY)
+    if len(changed):
+        ids = changed.ids.tolist()
+        years = changed.years.tolist()
+        spots = changed.spots.tolist()
+        pipe.hset(RECORDS_KEY, mapping={
+            id_x: "{},{}".format(year, spot) for id_x, year, spot in zip(ids, years, spots)})
+        pipe.zadd(YEARS_KEY, dict(zip(ids, years)))
+    if new_columns is None:
+        pipe.set(SNAPSHOT_KEY, codec.encode_columns(data.years, data.spots))
+        pipe.delete(DELTA_KEY)
+        pipe.set(EPOCH_KEY, uuid.uuid4().hex)
+    else:
+        pipe.rpush(DELTA_KEY, codec.encode_columns(*new_columns))
+    pipe.incr(VERSION_KEY)
+
+
+def new_columns(new_data):
+    """
+    Takes new_data, a json list.
+    Returns (years, spots) columns of its rows sorted by year, keeping
+    the order of rows of the same year, ready for SpotsData.insert.
+    """
+    new_data = sorted(new_data, key=operator.itemgetter('year'))
+    return (np.array([dict_x['year'] for dict_x in new_data], dtype=np.int64),
+            np.array([dict_x['spots'] for dict_x in new_data], dtype=np.int64))
+
+
 def update_redis_and_csv(new_data):
     """
-    Takes new_data, a json list and adds it to the current data in database.
-    Sorts this new total set, correctly set 'ids' according to sorting and
-    uploads data to redis with pipeline and writes to .csv atomically to
-    insure uncorrupted read/writes.
+    Takes new_data, a json list and merges it into the current data in
+    database with commit_rows. If GROUP_COMMIT_WINDOW is set, the first
+    caller waits that long and commits every batch that arrived in the
+    meantime as one merge and one log append. Every caller returns once
+    its rows are committed, or raises the error the commit hit.
+    """
+    if not new_data:
+        return
+    if GROUP_COMMIT_WINDOW <= 0:
+        commit_rows(new_data)
+        return
+
+    batch = {'rows': new_data, 'done': Event(), 'error': None}
+    with PENDING_LOCK:
+        PENDING_BATCHES.append(batch)
+        leader = len(PENDING_BATCHES) == 1
+
+    if leader:
+        sleep(GROUP_COMMIT_WINDOW)
+        with PENDING_LOCK:
+            batches = PENDING_BATCHES[:]
+            del PENDING_BATCHES[:]
+        try:
+            commit_rows([dict_x for batch_x in batches for dict_x in batch_x['rows']])
+        except Exception as errors:
+            for batch_x in batches:
+                batch_x['error'] = errors
+        finally:
+            for batch_x in batches:
+                batch_x['done'].set()
+
+    batch['done'].wait()
+    if batch['error'] is not None:
+        raise batch['error']
+
+
+def commit_rows(new_data):
+    """
+    Takes new_data, a json list and merges it into the current data in
+    database. Only records from the first insertion point on get new
+    'ids' and are rewritten to redis, and the new rows are added to the
+    snapshot's deltas rather than the whole snapshot rewritten. VERSION_KEY is watched while merging
+    so a concurrent writer from any process makes the transaction fail
+    and the merge is retried on top of its data instead of dropping it.
+    The new rows are then appended to the change log, the csv itself is
+    rewritten atomically later by compact_csv.
     """
-    data_list = json.loads(SPOTS_DB.get("data"))
-    data_list += new_data
-    data_list = sorted(data_list, key=operator.itemgetter('year'))
-    for index, dict_x in enumerate(data_list):
-        dict_x["id"] = int(index)
+    columns = new_columns(new_data)
+    with WRITE_LOCK:
+        with SPOTS_DB.pipeline() as pipe:
+            for attempt in range(MAX_WRITE_RETRIES):
+                try:
+                    pipe.watch(VERSION_KEY)
+                    _, data = get_dataset()
+                    merged, first_id = data.insert(*columns)
+                    pipe.multi()
+                    queue_redis_writes(pipe, merged, first_id, columns)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    print("Concurrent write detected, retrying merge")
+                    sleep(0.01 * (attempt + 1))
+            else:
+                raise RuntimeError("Could not merge new data after {} attempts"
+                                   .format(MAX_WRITE_RETRIES))
+        print("Redis updated")
+
+        append_change_log(new_data)
+        print("Change log updated")
 
-    pipe_write_redis(data_list)
-    print("Redis updated")
 
-    with open_atomic(CSV_LOC, 'w') as csv_file:
-        for dict_x in data_list:
-            row = ("{},{}\n").format(dict_x['year'], dict_x['spots'])
-            csv_file.write(row)
-    print("CSV updated")
+def append_change_log(new_data):
+    """
+    Takes new_data, a json list, and appends its rows to LOG_LOC as
+    "year,spots" lines, flushed to disk before returning. A new log
+    starts with the header naming the csv it applies to, see
+    read_change_log.
+    """
+    if not os.path.exists(LOG_LOC) or not os.path.getsize(LOG_LOC):
+        reset_change_log(csv_digest())
+    with open(LOG_LOC, 'a') as log_file:
+        for dict_x in new_data:
+            log_file.write("{},{}\n".format(dict_x['year'], dict_x['spots']))
+        log_file.flush()
+        os.fsync(log_file.fileno())
+
+
+def csv_digest(content=None):
+    """
+    Takes the csv's content, or reads it from CSV_LOC.
+    Returns its sha256 hex digest, "" if there is no csv.
+    """
+    if content is None:
+        if not os.path.exists(CSV_LOC):
+            return ""
+        with open(CSV_LOC, 'rb') as csv_file:
+            content = csv_file.read()
+    return hashlib.sha256(content).hexdigest()
+
+
+def read_change_log():
+    """
+    Reads the change log. Its first line, "#csv <digest>", names the csv
+    its rows apply to by csv_digest. compact_csv replaces the csv before
+    resetting the log, so if it stopped in between the log names the old
+    csv, whose rows plus the log's are the new csv, and the log must not
+    be replayed again. Logs from before the header are always replayed.
+    Returns list of (year, spots) rows not yet in the csv, or None if the
+    log has already been folded into it.
+    """
+    if not os.path.exists(LOG_LOC):
+        return []
+    with open(LOG_LOC, mode='r') as log_file:
+        header = log_file.readline()
+    if header.startswith(LOG_HEADER) and header[len(LOG_HEADER):].strip() != csv_digest():
+        return None
+    return read_rows(LOG_LOC)
+
+
+def reset_change_log(digest):
+    """
+    Takes the csv_digest of the csv now on disk.
+    Atomically replaces the change log with an empty one for that csv.
+    """
+    with open_atomic(LOG_LOC, 'w', fsync=True) as log_file:
+        log_file.write("{}{}\n".format(LOG_HEADER, digest))
+
+
+def compact_csv():
+    """
+    Folds the change log into the csv snapshot. Merges csv and log rows,
+    writes the csv atomically, then resets the log for the new csv. A log
+    left behind by a compaction that stopped in between is only reset.
+    Returns True if there was anything to compact.
+    """
+    with WRITE_LOCK:
+        log_rows = read_change_log()
+        if log_rows is None:
+            reset_change_log(csv_digest())
+            return False
+        if not log_rows:
+            return False
+
+        rows = sorted(read_rows(CSV_LOC) + log_rows, key=operator.itemgetter(0))
+        content = "".join("{},{}\n".format(year, spots) for year, spots in rows)
+        with open_atomic(CSV_LOC, 'w', fsync=True) as csv_file:
+            csv_file.write(content)
+        reset_change_log(csv_digest(content.encode("utf-8")))
+    print("CSV compacted")
+    return True
+
+
+def fold_snapshot():
+    """
+    Folds the deltas on DELTA_KEY into SNAPSHOT_KEY, so readers reloading
+    the dataset have few to apply. The data does not change, so neither
+    does VERSION_KEY, which is watched so a concurrent write makes the
+    fold start over on top of it.
+    Returns True if there was anything to fold.
+    """
+    with SPOTS_DB.pipeline() as pipe:
+        for attempt in range(MAX_WRITE_RETRIES):
+            try:
+                pipe.watch(VERSION_KEY)
+                if not pipe.llen(DELTA_KEY):
+                    pipe.unwatch()
+                    return False
+                _, data = get_dataset()
+                pipe.multi()
+                pipe.set(SNAPSHOT_KEY, codec.encode_columns(data.years, data.spots))
+                pipe.delete(DELTA_KEY)
+                pipe.execute()
+                print("Snapshot folded")
+                return True
+            except redis.WatchError:
+                sleep(0.01 * (attempt + 1))
+    print("Error: Snapshot not folded, writes kept landing")
+    return False
+
+
+def start_compactor(interval=COMPACT_INTERVAL):
+    """
+    Takes an interval in seconds.
+    Starts a daemon thread running fold_snapshot and compact_csv every
+    interval.
+    """
+    def compactor():
+        while True:
+            sleep(interval)
+            try:
+                fold_snapshot()
+            except redis.RedisError as errors:
+                print("Error: Snapshot fold failed, {}".format(errors))
+            try:
+                compact_csv()
+            except OSError as errors:
+                print("Error: CSV compaction failed, {}".format(errors))
+
+    Thread(target=compactor, daemon=True).start()
 
 
 @contextmanager
@@ -95,7 +362,7 @@ def open_atomic(filepath, *args, **kwargs):
     Takes tempfile and atomically merges it with sunspots.csv to insure
     good read/writes.
     """
-    fsync = kwargs.get('fsync', False)
+    fsync = kwargs.pop('fsync', False)
 
     with tempfile(dir=os.path.dirname(os.path.abspath(filepath))) as tmppath:
         with open(tmppath, *args, **kwargs) as file:
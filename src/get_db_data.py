@@ -2,54 +2,207 @@
 Author: Christian R. Garcia
 Gets data from redis data database and parses it using start, end,
 limit, and offset parameters. Results list of said data.
+
+Data is stored per record, a hash of "year,spots" strings keyed by id
+and a sorted set of ids scored by year, so lookups only move the
+records they return, and as a packed snapshot of the whole dataset, see
+codec.encode_columns. Writes add their new rows, packed the same way,
+to a list of deltas instead of rewriting the snapshot, and the
+compactor folds the deltas into the snapshot every so often. Each
+process also keeps a decoded copy of the whole dataset tagged with the
+data version, which is reused until a write bumps the version. The
+version pairs a counter with an epoch token that every full write
+replaces, so a counter restarted by redis losing its data never matches
+a version read before.
 """
 import os
-import json
-import redis
+import numpy as np
+import codec
+import redis_conn
+from spots_data import SpotsData
 
-REDIS_IP = os.getenv("REDIS_IP")
-REDIS_PORT = os.getenv("REDIS_PORT")
 SPOTS_DB_ID = os.getenv("SPOTS_DB_ID")
+DATA_CACHE = os.getenv("DATA_CACHE", "1") != "0"
+
+SPOTS_DB = redis_conn.get_client(SPOTS_DB_ID)
+
+RECORDS_KEY = "records"
+YEARS_KEY = "years"
+VERSION_KEY = "data_version"
+EPOCH_KEY = "data_epoch"
+SNAPSHOT_KEY = "dataset"
+DELTA_KEY = "dataset.delta"
+
+# (version, SpotsData) of the last dataset read.
+_DATASET = (None, SpotsData.from_columns([], []))
+
+
+def get_db_data(start, end, limit, offset, columnar=False):
+    """
+    Takes start, end, limit, and offset.
+    Gets data from the process cache, or SPOTS_DB if caching is off.
+    Returns list with correct start, end, or limit, offset, or the
+    same rows as a SpotsData if columnar is set.
+    """
+    if not DATA_CACHE:
+        data_list = _get_db_data_uncached(start, end, limit, offset)
+        return SpotsData.from_list(data_list) if columnar else data_list
+
+    _, dataset = get_dataset()
+    data = dataset.select(start, end, limit, offset)
+    return data if columnar else data.to_list()
+
+
+def current_dataset():
+    """
+    Gets the whole dataset from the process cache, or SPOTS_DB if caching
+    is off, as get_db_data does.
+    Returns SpotsData of the whole dataset.
+    """
+    if not DATA_CACHE:
+        _, years, spots = _get_records_columns()
+        return SpotsData.from_columns(years, spots)
+    _, dataset = get_dataset()
+    return dataset
+
+
+def get_data_version():
+    """
+    Returns the current data version from SPOTS_DB, see data_version.
+    """
+    return data_version(*SPOTS_DB.mget(EPOCH_KEY, VERSION_KEY))
+
+
+def data_version(epoch, counter):
+    """
+    Takes the raw EPOCH_KEY and VERSION_KEY values, None if never written.
+    Returns the data version, "<epoch>.<counter>".
+    """
+    return "{}.{}".format(epoch.decode("utf-8") if epoch is not None else "",
+                          int(counter) if counter is not None else 0)
+
+
+def get_dataset():
+    """
+    Checks the data version in SPOTS_DB against the cached dataset.
+    Reloads the snapshot and its deltas in one transaction only if the
+    version moved, or every record if the data was written before there
+    were snapshots.
+    Returns (version, SpotsData) of the whole dataset.
+    """
+    global _DATASET
+    version = get_data_version()
+    if version == _DATASET[0]:
+        return _DATASET
+
+    pipe = SPOTS_DB.pipeline()
+    pipe.get(EPOCH_KEY)
+    pipe.get(VERSION_KEY)
+    pipe.get(SNAPSHOT_KEY)
+    pipe.lrange(DELTA_KEY, 0, -1)
+    epoch, counter, snapshot, deltas = pipe.execute()
+    if snapshot is not None:
+        return use_snapshot(data_version(epoch, counter), snapshot, deltas)
 
-SPOTS_DB = redis.StrictRedis(host=REDIS_IP, port=REDIS_PORT, db=SPOTS_DB_ID)
+    version, years, spots = _get_records_columns()
+    _DATASET = (version, SpotsData.from_columns(years, spots))
+    return _DATASET
 
 
-def get_db_data(start, end, limit, offset):
+def cached_dataset():
+    """
+    Returns (version, SpotsData) of the dataset last read by this process,
+    without checking it is current.
+    """
+    return _DATASET
+
+
+def use_snapshot(version, snapshot, deltas=()):
+    """
+    Takes a data version, see data_version, and the SNAPSHOT_KEY bytes
+    and DELTA_KEY list read along with it.
+    Caches the decoded dataset, with the deltas applied, for this process.
+    Returns (version, SpotsData) of the whole dataset.
+    """
+    global _DATASET
+    _DATASET = (version,
+                apply_deltas(SpotsData.from_columns(*codec.decode_columns(snapshot)), deltas))
+    return _DATASET
+
+
+def apply_deltas(data, deltas):
+    """
+    Takes SpotsData of a whole dataset and a list of deltas, each the
+    codec.encode_columns bytes of a batch of rows added to it, in order.
+    Returns SpotsData with every batch inserted as it was written. The
+    batches are stably sorted together and inserted at once, which keeps
+    rows of one year in the order they were added.
+    """
+    if not deltas:
+        return data
+    columns = [codec.decode_columns(delta) for delta in deltas]
+    years = np.concatenate([column[0] for column in columns])
+    spots = np.concatenate([column[1] for column in columns])
+    order = np.argsort(years, kind='stable')
+    merged, _ = data.insert(years[order], spots[order])
+    return merged
+
+
+def _get_records_columns():
+    """
+    Reads every record in one transaction.
+    Returns (version, years, spots) of the whole dataset.
+    """
+    pipe = SPOTS_DB.pipeline()
+    pipe.get(EPOCH_KEY)
+    pipe.get(VERSION_KEY)
+    pipe.hgetall(RECORDS_KEY)
+    epoch, counter, records = pipe.execute()
+
+    years = np.zeros(len(records), dtype=np.int64)
+    spots = np.zeros(len(records), dtype=np.int64)
+    for id_x, record in records.items():
+        year, spot = record.decode("utf-8").split(',')
+        years[int(id_x)] = int(year)
+        spots[int(id_x)] = int(spot)
+    return data_version(epoch, counter), years, spots
+
+
+def _get_db_data_uncached(start, end, limit, offset):
     """
     Takes start, end, limit, and offset.
-    Gets data from SPOTS_DB.
+    Resolves the ids needed straight from SPOTS_DB.
     Returns list with correct start, end, or limit, offset.
     """
-    redis_data = json.loads(SPOTS_DB.get("data"))
+    if start is not None or end is not None:
+        min_year = "-inf" if start is None else start
+        max_year = "+inf" if end is None else end
+        ids = sorted(int(id_x) for id_x in
+                     SPOTS_DB.zrangebyscore(YEARS_KEY, min_year, max_year))
+    else:
+        first = offset if offset is not None else 0
+        last = SPOTS_DB.hlen(RECORDS_KEY)
+        if limit is not None:
+            last = min(last, first + limit)
+        ids = range(first, last)
+
+    return _get_records(ids)
+
+
+def _get_records(ids):
+    """
+    Takes a sorted iterable of ids.
+    Fetches only those records from SPOTS_DB in one round trip.
+    Returns list of record dictionaries.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+
     data_list = []
-    limit_counter = 0
-
-    for index, dict_x in enumerate(redis_data):
-        year = dict_x['year']
-        spots = dict_x['spots']
-
-        if start is not None or end is not None:
-            if start is None:
-                if year <= end:
-                    data_list.append({'id': index, 'year': year, 'spots': spots})
-            elif end is None:
-                if year >= start:
-                    data_list.append({'id': index, 'year': year, 'spots': spots})
-            elif year >= start and year <= end:
-                data_list.append({'id': index, 'year': year, 'spots': spots})
-
-        elif limit is not None or offset is not None:
-            if limit is None:
-                if index >= offset:
-                    data_list.append({'id': index, 'year': year, 'spots': spots})
-            elif offset is None:
-                if limit_counter < limit:
-                    data_list.append({'id': index, 'year': year, 'spots': spots})
-                    limit_counter += 1
-            elif index >= offset and limit_counter < limit:
-                data_list.append({'id': index, 'year': year, 'spots': spots})
-                limit_counter += 1
-
-        else:
-            data_list.append({'id': index, 'year': year, 'spots': spots})
+    for id_x, record in zip(ids, SPOTS_DB.hmget(RECORDS_KEY, ids)):
+        if record is None:
+            continue
+        year, spots = record.decode("utf-8").split(',')
+        data_list.append({'id': id_x, 'year': int(year), 'spots': int(spots)})
     return data_list
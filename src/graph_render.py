@@ -0,0 +1,63 @@
+"""
+Author: Christian R. Garcia
+Renders graph pngs for the graph worker without pyplot. Uses the
+non-interactive Agg canvas with one Figure per thread that is cleared
+and reused for every job, and writes into an in-memory buffer, so
+nothing piles up between jobs and no files are written.
+"""
+from io import BytesIO
+import numpy as np
+from threading import local
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+FIGURE_SIZE = (6.4, 4.8)
+FIGURE_DPI = 100
+# Most points worth drawing, one per pixel across the figure.
+GRAPH_POINTS = int(FIGURE_SIZE[0] * FIGURE_DPI)
+
+_RENDERERS = local()
+
+
+class GraphRenderer:
+    """
+    Holds one Figure, its Agg canvas, and its axes for reuse.
+    """
+
+    def __init__(self):
+        self.figure = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+
+    def render(self, years, spots):
+        """
+        Takes year and spots columns as x and y data.
+        Clears the axes left from the last job, then bar plots the data.
+        Bars are as wide as the usual gap between years, so downsampled
+        data still fills the plot.
+        Returns png bytes.
+        """
+        width = 0.8
+        if len(years) > 1:
+            width *= float(np.median(np.diff(years)))
+        self.axes.clear()
+        self.axes.bar(years, spots, width=width)
+        self.axes.set_title("Sunspots recorded per year")
+        self.axes.set_xlabel("Year")
+        self.axes.set_ylabel("Number of Sunspots")
+
+        image = BytesIO()
+        self.canvas.print_png(image)
+        return image.getvalue()
+
+
+def render_graph(years, spots):
+    """
+    Takes year and spots columns as x and y data.
+    Renders them with this thread's GraphRenderer, creating it on first use.
+    Returns png bytes.
+    """
+    renderer = getattr(_RENDERERS, "renderer", None)
+    if renderer is None:
+        renderer = _RENDERERS.renderer = GraphRenderer()
+    return renderer.render(years, spots)
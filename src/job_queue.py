@@ -0,0 +1,173 @@
+"""
+Author: Christian R. Garcia
+Priority queue of job_keys with weighted fair share between clients,
+replacing the plain FIFO HotQueues. Jobs of a higher priority are always
+served first. Within a priority every client has its own FIFO list, and
+clients take turns by stride scheduling: each serve moves a client's pass
+forward by 1 / weight and the client with the lowest pass goes next, so a
+client with weight 2 gets twice the turns of a client with weight 1 and no
+client can starve the others by queueing more jobs.
+
+Keys, all prefixed by the queue name:
+    .priorities         set of priorities with queued jobs
+    .p<priority>        zset of clients with queued jobs, scored by pass
+    .p<priority>.c.<c>  list of client c's job_keys
+    .p<priority>.pass   hash of the pass of clients that ran out of jobs
+    .p<priority>.vtime  pass of the last client served
+    .weights            hash of client weights
+    .queued             hash of each client's number of queued jobs
+    .levels             set of every priority used, to find .pass entries
+    .size               number of queued jobs
+    .wake               token list blocking gets wait on
+"""
+import redis_conn
+
+# Most job_keys sent to PUSH_SCRIPT in one call, Lua's unpack has a limit.
+PUSH_CHUNK = 1000
+
+# Adds job_keys to the end of a client's list for a priority. A client
+# joining a priority starts at the current virtual time, so idle clients
+# can not bank turns, but keep the pass they had if they left a priority
+# and came back while still having jobs queued at another.
+APPEND_LUA = """
+local function append(name, priority, client, weight, job_keys)
+    local base = name .. '.p' .. priority
+    redis.call('RPUSH', base .. '.c.' .. client, unpack(job_keys))
+    redis.call('HSET', name .. '.weights', client, weight)
+    redis.call('SADD', name .. '.priorities', priority)
+    redis.call('SADD', name .. '.levels', priority)
+    if not redis.call('ZSCORE', base, client) then
+        local pass = tonumber(redis.call('HGET', base .. '.pass', client) or '0')
+        local vtime = tonumber(redis.call('GET', base .. '.vtime') or '0')
+        redis.call('HDEL', base .. '.pass', client)
+        redis.call('ZADD', base, math.max(pass, vtime), client)
+    end
+    redis.call('DEL', name .. '.wake')
+    redis.call('RPUSH', name .. '.wake', 1)
+end
+"""
+
+# ARGV: queue name, priority, client, weight, job_keys...
+PUSH_SCRIPT = APPEND_LUA + """
+local name = ARGV[1]
+append(name, ARGV[2], ARGV[3], ARGV[4], {unpack(ARGV, 5)})
+redis.call('HINCRBY', name .. '.queued', ARGV[3], #ARGV - 4)
+redis.call('INCRBY', name .. '.size', #ARGV - 4)
+return 1
+"""
+
+# ARGV: queue name, old priority, new priority, client, weight, job_key.
+# Moves a queued job_key to the end of the client's list for the new
+# priority. Returns 0 if it was no longer queued.
+MOVE_SCRIPT = APPEND_LUA + """
+local name = ARGV[1]
+local old_base = name .. '.p' .. ARGV[2]
+local client = ARGV[4]
+local list = old_base .. '.c.' .. client
+if redis.call('LREM', list, 1, ARGV[6]) == 0 then
+    return 0
+end
+if redis.call('LLEN', list) == 0 then
+    local pass = redis.call('ZSCORE', old_base, client)
+    redis.call('ZREM', old_base, client)
+    if pass then
+        redis.call('HSET', old_base .. '.pass', client, pass)
+    end
+end
+append(name, ARGV[3], client, ARGV[5], {ARGV[6]})
+return 1
+"""
+
+# ARGV: queue name. Pops the next job_key, or returns false if empty.
+# Leaves a wake token behind while jobs remain so other blocked gets go on.
+# A client left with no queued jobs at any priority has its weight and
+# passes dropped, so clients that come and go leave no state behind.
+POP_SCRIPT = """
+local name = ARGV[1]
+local priorities = redis.call('SMEMBERS', name .. '.priorities')
+table.sort(priorities, function(a, b) return tonumber(a) > tonumber(b) end)
+for _, priority in ipairs(priorities) do
+    local base = name .. '.p' .. priority
+    local next_client = redis.call('ZRANGE', base, 0, 0, 'WITHSCORES')
+    if #next_client == 0 then
+        redis.call('SREM', name .. '.priorities', priority)
+    else
+        local client, pass = next_client[1], tonumber(next_client[2])
+        local list = base .. '.c.' .. client
+        local job_key = redis.call('LPOP', list)
+        local weight = tonumber(redis.call('HGET', name .. '.weights', client) or '1')
+        redis.call('SET', base .. '.vtime', pass)
+        if redis.call('LLEN', list) == 0 then
+            redis.call('ZREM', base, client)
+            redis.call('HSET', base .. '.pass', client, pass + 1 / weight)
+        else
+            redis.call('ZADD', base, pass + 1 / weight, client)
+        end
+        if redis.call('HINCRBY', name .. '.queued', client, -1) <= 0 then
+            redis.call('HDEL', name .. '.queued', client)
+            redis.call('HDEL', name .. '.weights', client)
+            for _, level in ipairs(redis.call('SMEMBERS', name .. '.levels')) do
+                redis.call('HDEL', name .. '.p' .. level .. '.pass', client)
+            end
+        end
+        if redis.call('DECR', name .. '.size') > 0 then
+            redis.call('DEL', name .. '.wake')
+            redis.call('RPUSH', name .. '.wake', 1)
+        end
+        return job_key
+    end
+end
+return false
+"""
+
+
+class JobQueue:
+    """
+    Takes a queue name and the redis db to keep it in.
+    Has the put, get, and len of the HotQueues it replaces, with put
+    taking the jobs' priority, client, and client weight.
+    """
+
+    def __init__(self, name, db=None):
+        self.name = name
+        self.redis = redis_conn.get_client(db)
+        self._push = self.redis.register_script(PUSH_SCRIPT)
+        self._pop = self.redis.register_script(POP_SCRIPT)
+        self._move = self.redis.register_script(MOVE_SCRIPT)
+
+    def __len__(self):
+        return int(self.redis.get(self.name + ".size") or 0)
+
+    def put(self, *job_keys, priority=0, client="", weight=1):
+        """
+        Takes job_keys, all of the same priority and client, and the
+        client's weight.
+        Adds them to the end of the client's list for that priority.
+        """
+        for first in range(0, len(job_keys), PUSH_CHUNK):
+            self._push(args=[self.name, int(priority), client, weight]
+                       + list(job_keys[first:first + PUSH_CHUNK]))
+
+    def move(self, job_key, old_priority, new_priority, client="", weight=1):
+        """
+        Takes a queued job_key, the priority and client it was put with,
+        the priority to move it to, and the client's weight.
+        Moves it to the end of the client's list for the new priority.
+        Returns True if moved, False if it had already left the queue.
+        """
+        return bool(self._move(args=[self.name, int(old_priority), int(new_priority),
+                                     client, weight, job_key]))
+
+    def get(self, block=False, timeout=None):
+        """
+        Takes whether to block and for how many seconds, None for ever.
+        Returns the next job_key to run, or None if there was none in time.
+        """
+        while True:
+            job_key = self._pop(args=[self.name])
+            if job_key is not None:
+                return job_key.decode("utf-8")
+            if not block:
+                return None
+            if self.redis.blpop(self.name + ".wake", timeout=timeout or 0) is None:
+                return None
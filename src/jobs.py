@@ -6,25 +6,139 @@ Once done the status is again change, now from 'processing' to 'completed'.
 Worker then begins waiting for a new job_id.
 """
 import os
+import asyncio
 import uuid
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from time import time
+import io
+import pickle
 import redis
-from hotqueue import HotQueue
+import codec
+import redis_conn
+from job_queue import JobQueue
+from get_db_data import get_data_version
 
-REDIS_IP = os.getenv("REDIS_IP")
-REDIS_PORT = os.getenv("REDIS_PORT")
-SPOTS_DB_ID = os.getenv("SPOTS_DB_ID")
 JOB_DB_ID = os.getenv("JOB_DB_ID")
 DATA_Q_DB_ID = os.getenv("DATA_Q_DB_ID")
 GRAPH_Q_DB_ID = os.getenv("GRAPH_Q_DB_ID")
 STAT_Q_DB_ID = os.getenv("STAT_Q_DB_ID")
+CYCLE_Q_DB_ID = os.getenv("CYCLE_Q_DB_ID")
+JOB_CACHE_SIZE = int(os.getenv("JOB_CACHE_SIZE", "10000"))
+JOB_CACHE_TTL = int(os.getenv("JOB_CACHE_TTL", "3600"))
+# Seconds after which a job still 'Processing' is taken to be stuck and
+# identical submissions get a new job instead.
+JOB_PROCESSING_TIMEOUT = int(os.getenv("JOB_PROCESSING_TIMEOUT", "900"))
+# Seconds after which a job still 'Submitted' is taken to be lost, e.g.
+# prefetched by a worker that was killed, and likewise not reused.
+JOB_SUBMITTED_TIMEOUT = int(os.getenv("JOB_SUBMITTED_TIMEOUT", "900"))
+# Results larger than this are decoded off the event loop by the async reads.
+INLINE_RESULTS_BYTES = 64 * 1024
 
-SPOTS_DB = redis.StrictRedis(host=REDIS_IP, port=REDIS_PORT, db=SPOTS_DB_ID)
-JOB_DB = redis.StrictRedis(host=REDIS_IP, port=REDIS_PORT, db=JOB_DB_ID)
-DATA_Q = HotQueue("data_queue", host=REDIS_IP, port=REDIS_PORT, db=DATA_Q_DB_ID)
-GRAPH_Q = HotQueue("graph_queue", host=REDIS_IP, port=REDIS_PORT, db=GRAPH_Q_DB_ID)
-STATS_Q = HotQueue("stats_queue", host=REDIS_IP, port=REDIS_PORT, db=STAT_Q_DB_ID)
+JOB_DB = redis_conn.get_client(JOB_DB_ID)
+DATA_Q = JobQueue("data_queue", DATA_Q_DB_ID)
+GRAPH_Q = JobQueue("graph_queue", GRAPH_Q_DB_ID)
+STATS_Q = JobQueue("stats_queue", STAT_Q_DB_ID)
+CYCLES_Q = JobQueue("cycles_queue", CYCLE_Q_DB_ID)
+
+WORK_TYPES = ("data", "graph", "stats", "cycles")
+DEFAULT_PRIORITY = 0
+MAX_PRIORITY = 9
+
+JOB_INDEX = "jobs.index"
+JOB_CACHE = "jobs.cache"
+
+# KEYS: job key, results key, JOB_INDEX. ARGV: json status, json updated
+# time, coded results or "", "1" to return the job's fields. Moves the job
+# between status indexes if needed. Returning the fields lets a job be
+# started without a separate read.
+# The status index keys depend on the job's old status and work type, read
+# here, so they are built from KEYS[3] instead of being passed in KEYS.
+# Like the rest of this module, that assumes every job key lives on one
+# redis instance, not a Redis Cluster.
+UPDATE_JOB_SCRIPT = JOB_DB.register_script("""
+local old_status = redis.call('HGET', KEYS[1], 'status')
+if not old_status then
+    return redis.error_reply('no such job ' .. KEYS[1])
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[1], 'updated time', ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[3], 'NX')
+end
+if old_status ~= ARGV[1] then
+    local work_type = cjson.decode(redis.call('HGET', KEYS[1], 'work type'))
+    local score = redis.call('ZSCORE', KEYS[3], KEYS[1])
+    old_status = cjson.decode(old_status)
+    local new_status = cjson.decode(ARGV[1])
+    redis.call('ZREM', KEYS[3] .. '.status.' .. old_status, KEYS[1])
+    redis.call('ZREM', KEYS[3] .. '.type.' .. work_type .. '.status.' .. old_status, KEYS[1])
+    redis.call('ZADD', KEYS[3] .. '.status.' .. new_status, score, KEYS[1])
+    redis.call('ZADD', KEYS[3] .. '.type.' .. work_type .. '.status.' .. new_status, score, KEYS[1])
+end
+if ARGV[4] == '1' then
+    return redis.call('HGETALL', KEYS[1])
+end
+return 1
+""")
+
+# KEYS: cache key, job key, JOB_CACHE, the job's index keys. ARGV: key of a
+# cached job to replace or "", cache ttl, time now, index score, the job's
+# hash fields and values. Unless the cache key points at another job that
+# still exists, saves the job with its index entries and points the cache
+# key at it, all at once, so a job is never seen through the cache before
+# it exists. Returns {1, cache size} if saved, or {0, the cached job_key}.
+CLAIM_JOB_SCRIPT = JOB_DB.register_script("""
+local cached = redis.call('GET', KEYS[1])
+if cached and cached ~= ARGV[1] and redis.call('EXISTS', cached) == 1 then
+    return {0, cached}
+end
+redis.call('SET', KEYS[1], KEYS[2], 'EX', ARGV[2])
+redis.call('HSET', KEYS[2], unpack(ARGV, 5))
+for i = 4, #KEYS do
+    redis.call('ZADD', KEYS[i], ARGV[4], KEYS[2])
+end
+redis.call('ZADD', KEYS[3], ARGV[3], KEYS[1])
+return {1, redis.call('ZCARD', KEYS[3])}
+""")
+
+# KEYS: cache key, JOB_CACHE. ARGV: job_key. Drops the cache entry if it
+# still points at the job.
+RELEASE_CACHE_KEY_SCRIPT = JOB_DB.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[2], KEYS[1])
+end
+return 1
+""")
+
+# KEYS: an index. ARGV: score of the last job on the previous page or "",
+# its job_key or "", page size. Returns the next page newest first, with
+# scores. Jobs with equal scores are ordered by job_key, so the page starts
+# right after the last job's rank, or, if it has left the index since, after
+# the jobs sharing its score that sort before it.
+PAGE_JOBS_LUA = """
+local last = tonumber(ARGV[3]) - 1
+if ARGV[1] == '' then
+    return redis.call('ZREVRANGE', KEYS[1], 0, last, 'WITHSCORES')
+end
+if ARGV[2] == '' then
+    return redis.call('ZREVRANGEBYSCORE', KEYS[1], '(' .. ARGV[1], '-inf',
+                      'WITHSCORES', 'LIMIT', 0, ARGV[3])
+end
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[2])
+if rank then
+    return redis.call('ZREVRANGE', KEYS[1], rank + 1, rank + 1 + last, 'WITHSCORES')
+end
+local skip = 0
+for _, job_key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])) do
+    if job_key > ARGV[2] then
+        skip = skip + 1
+    end
+end
+return redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[1], '-inf',
+                  'WITHSCORES', 'LIMIT', skip, ARGV[3])
+"""
+PAGE_JOBS_SCRIPT = JOB_DB.register_script(PAGE_JOBS_LUA)
 
 
 def _generate_jid():
@@ -43,28 +157,182 @@ def _generate_job_key(jid):
     return 'job.{}'.format(jid)
 
 
-def _save_job(job_key, job_dict):
+def job_key_of(jid):
+    """
+    Takes a jid, with or without the 'job.' prefix.
+    Returns its job_key.
+    """
+    return _generate_job_key(str(jid).replace("job.", ""))
+
+
+def _generate_results_key(job_key):
     """
-    Takes job_key along with job_dictionary and creates/updates it in the JOB_DB.
+    Appends '.results' to job_key for use as results key.
+    Returns results_key.
+    """
+    return '{}.results'.format(job_key)
+
+
+def _async_job_db():
+    """
+    Returns an asyncio client on this process' asyncio pool for JOB_DB,
+    used by the *_async reads asgi.py serves from.
+    """
+    return redis_conn.get_async_client(JOB_DB_ID)
+
+
+def _save_job(job_key, job_dict, client=""):
+    """
+    Takes job_key along with job_dictionary and creates it in the JOB_DB.
     Allows for viewing the job and accessing it's information later.
+    Every field is stored json encoded in a hash so status changes are
+    single field writes, results go to their own key so they never travel
+    with the job. Adds the job to its index entries in the same transaction.
+    The submitting client is kept for requeueing but never shown.
     """
-    JOB_DB.set(job_key, json.dumps(job_dict))
+    pipe = JOB_DB.pipeline()
+    _queue_save_job(pipe, job_key, job_dict, client)
+    pipe.execute()
 
 
-def _queue_job(job_key, work_type):
+def _queue_save_job(pipe, job_key, job_dict, client=""):
+    """
+    Takes a JOB_DB pipeline, job_key, and job_dict.
+    Queues the writes of _save_job on pipe without executing them, so
+    many jobs can be saved in one round trip.
     """
-    Takes job_key and a work type, 'data', 'graph', or 'stats' and adds
-    the job_key to the corresponding queue to be used by workers.
+    score = _job_score(job_dict)
+    pipe.hset(job_key, mapping=_job_fields(job_dict, client))
+    if job_dict.get("results"):
+        pipe.set(_generate_results_key(job_key), codec.encode_value(job_dict["results"]))
+    for index_key in _job_index_keys(job_dict):
+        pipe.zadd(index_key, {job_key: score})
+
+
+def _job_fields(job_dict, client=""):
+    """
+    Takes job_dict and the submitting client.
+    Returns dict of the json encoded hash fields a job is saved as.
+    """
+    fields = {field: json.dumps(value) for field, value
+              in job_dict.items() if field != "results"}
+    fields["client"] = json.dumps(client)
+    return fields
+
+
+def _job_index_keys(job_dict):
+    """
+    Takes job_dict.
+    Returns list of the keys of every index the job belongs in.
+    """
+    work_type = job_dict["work type"]
+    return [_index_key(), _index_key(work_type=work_type),
+            _index_key(status=job_dict["status"]), _index_key(job_dict["status"], work_type)]
+
+
+def _load_job(job_key, fields):
+    """
+    Takes job_key and the raw hash fields read from JOB_DB.
+    Returns job_dict, with 'results' pointing at the results route
+    once the job is completed instead of carrying the results themselves.
+    """
+    job_dict = {field.decode("utf-8"): json.loads(value) for field, value in fields.items()}
+    job_dict.pop("client", None)
+    job_dict.pop("cache key", None)
+    if job_dict["status"] == "Completed":
+        job_dict["results"] = "/{}/results".format(job_key.replace("job.", "jobs/", 1))
+    else:
+        job_dict["results"] = ""
+    return job_dict
+
+
+def _index_key(status=None, work_type=None):
+    """
+    Takes an optional status and work type.
+    Returns key of the sorted set indexing jobs with them, scored by start time.
+    """
+    index_key = JOB_INDEX
+    if work_type is not None:
+        index_key += ".type." + work_type
+    if status is not None:
+        index_key += ".status." + status
+    return index_key
+
+
+def _job_score(job_dict):
+    """
+    Takes job_dict.
+    Returns its start time as a timestamp for use as index score.
+    """
+    return datetime.fromisoformat(job_dict["start time"]).timestamp()
+
+
+def _queue_job(job_key, work_type, priority=DEFAULT_PRIORITY, client=""):
+    """
+    Takes job_key, a work type, 'data', 'graph', 'stats', or 'cycles', and
+    the job's priority and client, and adds the job_key to the
+    corresponding queue to be used by workers.
+    """
+    work_queue(work_type).put(job_key, priority=priority, client=client,
+                               weight=_client_weight(client))
+
+
+def _parse_client_weights(setting):
+    """
+    Takes comma separated client=weight pairs, e.g. "dashboard=4,sweeps=1".
+    Skips, with an error printed, pairs that are malformed or do not have
+    a positive weight, so a bad setting never stops the api or workers.
+    Returns dict of client weights.
+    """
+    weights = {}
+    for pair in setting.split(","):
+        if not pair.strip():
+            continue
+        client, separator, weight = pair.partition("=")
+        try:
+            if not separator or "=" in weight or not client.strip():
+                raise ValueError
+            weight = float(weight)
+            if not weight > 0 or weight == float("inf"):
+                raise ValueError
+        except ValueError:
+            print("Error: Skipping CLIENT_WEIGHTS entry {!r}, must be client=weight "
+                  "with a positive weight".format(pair))
+            continue
+        weights[client.strip()] = weight
+    return weights
+
+
+# Fair share weights of clients, e.g. "dashboard=4,sweeps=1". Others get 1.
+CLIENT_WEIGHTS = _parse_client_weights(os.getenv("CLIENT_WEIGHTS", ""))
+
+
+def _client_weight(client):
+    """
+    Takes a client.
+    Returns its fair share weight from CLIENT_WEIGHTS.
+    """
+    return CLIENT_WEIGHTS.get(client, 1)
+
+
+def work_queue(work_type):
+    """
+    Takes a work type, 'data', 'graph', 'stats', or 'cycles'.
+    Returns the queue its workers listen on.
     """
     if work_type == "data":
-        DATA_Q.put(job_key)
+        return DATA_Q
     elif work_type == "graph":
-        GRAPH_Q.put(job_key)
+        return GRAPH_Q
     elif work_type == "stats":
-        STATS_Q.put(job_key)
+        return STATS_Q
+    elif work_type == "cycles":
+        return CYCLES_Q
+    raise ValueError("work type must be one of {}".format(", ".join(WORK_TYPES)))
 
 
-def _create_job(jid, work_type, status, start, end, limit, offset, start_time, updated_time):
+def _create_job(jid, work_type, status, start, end, limit, offset, start_time, updated_time,
+                percentiles=None, priority=DEFAULT_PRIORITY):
     """
     Takes parameters and creates a job_dict with them for use in queues and DB's.
     Returns job_dict.
@@ -79,6 +347,8 @@ def _create_job(jid, work_type, status, start, end, limit, offset, start_time, u
                 'offset': offset,
                 'start time': start_time,
                 'updated time': updated_time,
+                'percentiles': percentiles,
+                'priority': priority,
                 'results': ""}
 
     return {'id': jid.decode('utf-8'),
@@ -90,54 +360,520 @@ def _create_job(jid, work_type, status, start, end, limit, offset, start_time, u
             'offset': offset.decode('utf-8'),
             'start time': start_time.decode('utf-8'),
             'updated time': updated_time.decode('utf-8'),
+            'percentiles': percentiles,
+            'priority': priority,
             'results': ""}
 
 
-def add_job(work_type, start, end, limit, offset):
+def add_job(work_type, start, end, limit, offset, percentiles=None,
+            priority=DEFAULT_PRIORITY, client=""):
     """
     Creates job corresponding to it's inputted information and type.
+    The job is queued at priority, taking turns with other clients' jobs.
+    If an identical job was already submitted against the current data
+    version, that job is returned instead, so identical in-flight jobs
+    share one worker run and completed ones come back immediately. A job
+    still waiting to run is raised to priority if that is higher.
     Returns to completed job_dict with information about the job.
     """
     jid = _generate_jid()
     job_key = _generate_job_key(jid)
     start_time = str(datetime.now())
     job_dict = _create_job(jid, work_type, "Submitted", start, end, limit,
-                           offset, start_time, start_time)
-    _save_job(job_key, job_dict)
-    _queue_job(job_key, work_type)
+                           offset, start_time, start_time, percentiles, priority)
+    if JOB_CACHE_SIZE <= 0:
+        _save_job(job_key, job_dict, client)
+        _queue_job(job_key, work_type, priority, client)
+        return json.dumps(job_dict)
+
+    cache_key = _generate_cache_key(work_type, start, end, limit, offset, percentiles)
+    _, reused, size = _claim_jobs([cache_key], [job_key], [job_dict], client)
+    if reused:
+        _touch_cache_keys([cache_key])
+        return json.dumps(reused[0])
+    _queue_job(job_key, work_type, priority, client)
+    _evict_cache_keys(size)
     return json.dumps(job_dict)
 
 
+def add_jobs(specs, client=""):
+    """
+    Takes a list of job specs, dictionaries with 'work type', 'start',
+    'end', 'limit', 'offset', 'percentiles', and 'priority' keys, already
+    checked, and the client submitting them.
+    Creates every job the way add_job does, reusing cached jobs for specs
+    already submitted, including repeats within the list. Saving the jobs,
+    or finding the cached ones, is one JOB_DB pipeline, and each work
+    type's jobs of one priority go onto its queue in one push.
+    Returns list of job ids in the order of specs.
+    """
+    job_keys = [_generate_job_key(_generate_jid()) for _ in specs]
+    # A microsecond apart, so the jobs keep the order of specs in the index.
+    now = datetime.now()
+    start_times = [str(now + timedelta(microseconds=position)) for position in range(len(specs))]
+    job_dicts = [_create_job(job_key.replace("job.", "", 1), spec["work type"], "Submitted",
+                             spec["start"], spec["end"], spec["limit"], spec["offset"],
+                             start_time, start_time, spec.get("percentiles"),
+                             spec.get("priority", DEFAULT_PRIORITY))
+                 for job_key, spec, start_time in zip(job_keys, specs, start_times)]
+    if JOB_CACHE_SIZE > 0:
+        cache_keys = [_generate_cache_key(spec["work type"], spec["start"], spec["end"],
+                                          spec["limit"], spec["offset"], spec.get("percentiles"))
+                      for spec in specs]
+        saved, reused, size = _claim_jobs(cache_keys, job_keys, job_dicts, client)
+    else:
+        pipe = JOB_DB.pipeline()
+        for job_key, job_dict in zip(job_keys, job_dicts):
+            _queue_save_job(pipe, job_key, job_dict, client)
+        pipe.execute()
+        saved, reused, size = range(len(specs)), {}, 0
+
+    queued = {}
+    for position in saved:
+        job_dict = job_dicts[position]
+        queued.setdefault((job_dict["work type"], job_dict["priority"]),
+                          []).append(job_keys[position])
+    for (work_type, priority), queued_keys in queued.items():
+        work_queue(work_type).put(*queued_keys, priority=priority, client=client,
+                                  weight=_client_weight(client))
+    if reused:
+        _touch_cache_keys(list({cache_keys[position] for position in reused}))
+    if JOB_CACHE_SIZE > 0:
+        _evict_cache_keys(size)
+    return [job_key.replace("job.", "", 1) for job_key in job_keys]
+
+
+def _claim_jobs(cache_keys, job_keys, job_dicts, client=""):
+    """
+    Takes lists of cache_keys and of the job_keys and job_dicts of new jobs
+    for them, and the client submitting them.
+    Saves each new job and points its cache key at it with one
+    CLAIM_JOB_SCRIPT call, unless the cache key already points at a job,
+    including one saved for an earlier position, which is then reused and
+    its job_key put in job_keys in place. A cached job that disappears
+    before it is read, or can not be reused, see _reusable, is replaced by
+    the new one. Each round of claims, and of reading the cached jobs, is
+    one pipeline.
+    Returns (set of positions whose new jobs were saved, dict of reused
+    job_dicts by position, cache size after the claims).
+    """
+    def claim(position, replace, client_db):
+        job_dict = job_dicts[position]
+        fields = [item for field in _job_fields(job_dict, client).items() for item in field]
+        fields += ["cache key", json.dumps(cache_keys[position])]
+        return CLAIM_JOB_SCRIPT(keys=[cache_keys[position], job_keys[position], JOB_CACHE]
+                                + _job_index_keys(job_dict),
+                                args=[replace, JOB_CACHE_TTL, time(), repr(_job_score(job_dict))]
+                                + fields, client=client_db)
+
+    saved, reused, clients, size = set(), {}, {}, 0
+    pending = {position: "" for position in range(len(job_keys))}
+    while pending:
+        if len(pending) == 1:
+            # A pipeline checks its scripts are loaded first, a lone call does not.
+            replies = [claim(position, replace, JOB_DB) for position, replace in pending.items()]
+        else:
+            pipe = JOB_DB.pipeline(transaction=False)
+            for position, replace in pending.items():
+                claim(position, replace, pipe)
+            replies = pipe.execute()
+        cached = {}
+        for position, (claimed, value) in zip(pending, replies):
+            if claimed:
+                saved.add(position)
+                size = max(size, value)
+            else:
+                cached[position] = value.decode("utf-8")
+
+        pending = {}
+        cached_fields = redis_conn.hgetall_many(JOB_DB, list(cached.values()))
+        for (position, cached_key), fields in zip(cached.items(), cached_fields):
+            if fields and _reusable(fields):
+                job_keys[position] = cached_key
+                reused[position] = _load_job(cached_key, fields)
+                clients[position] = json.loads(fields.get(b"client", b'""'))
+            else:
+                pending[position] = cached_key
+    _raise_priorities(saved, reused, clients, job_keys, job_dicts)
+    return saved, reused, size
+
+
+def _raise_priorities(saved, reused, clients, job_keys, job_dicts):
+    """
+    Takes the positions saved and the job_dicts reused by _claim_jobs,
+    dict of the clients that submitted the reused jobs by position, and
+    the job_keys and job_dicts asked for.
+    Raises each reused job still waiting to run to the highest priority
+    asked for it, moving it between its queue's priority lists, so an
+    identical job resubmitted at a higher priority does not wait behind
+    the original one. A job saved earlier in the same batch is not queued
+    yet, so only its job_dict changes. Lower priorities leave jobs as they are.
+    """
+    wanted = {}
+    for position, job_dict in reused.items():
+        priority = job_dicts[position]["priority"]
+        job_key = job_keys[position]
+        if job_dict["status"] == "Submitted" and \
+                priority > wanted.get(job_key, (job_dict["priority"],))[0]:
+            wanted[job_key] = (priority, position)
+
+    saved_keys = {job_keys[position]: position for position in saved}
+    raised = {}
+    for job_key, (priority, position) in wanted.items():
+        job_dict, client = reused[position], clients[position]
+        if job_key in saved_keys:
+            job_dicts[saved_keys[job_key]]["priority"] = priority
+            raised[job_key] = priority
+        elif work_queue(job_dict["work type"]).move(job_key, job_dict["priority"], priority,
+                                                    client, _client_weight(client)):
+            raised[job_key] = priority
+    if not raised:
+        return
+    redis_conn.pipelined(JOB_DB, (("hset", job_key, "priority", json.dumps(priority))
+                                  for job_key, priority in raised.items()))
+    for position, job_dict in reused.items():
+        job_dict["priority"] = raised.get(job_keys[position], job_dict["priority"])
+
+
+def _reusable(fields):
+    """
+    Takes the raw hash fields of a cached job.
+    Returns False if the job failed, has been 'Processing' for longer than
+    JOB_PROCESSING_TIMEOUT, or 'Submitted' for longer than
+    JOB_SUBMITTED_TIMEOUT, so identical submissions run it again.
+    """
+    status = json.loads(fields[b"status"])
+    if status == "Failed":
+        return False
+    timeouts = {"Processing": JOB_PROCESSING_TIMEOUT, "Submitted": JOB_SUBMITTED_TIMEOUT}
+    if status in timeouts:
+        updated_time = datetime.fromisoformat(json.loads(fields[b"updated time"]))
+        return (datetime.now() - updated_time).total_seconds() < timeouts[status]
+    return True
+
+
+def _generate_cache_key(work_type, start, end, limit, offset, percentiles=None):
+    """
+    Takes a job's work type and parameters.
+    Returns key identifying the job's answer, which is only valid for
+    the current data version.
+    """
+    params = json.dumps([start, end, limit, offset, percentiles], separators=(',', ':'))
+    return "{}.{}.{}.{}".format(JOB_CACHE, work_type, get_data_version(), params)
+
+
+def _touch_cache_keys(cache_keys):
+    """
+    Takes a list of cache_keys and marks them most recently used.
+    Entries also expire after JOB_CACHE_TTL on their own.
+    """
+    now = time()
+    JOB_DB.zadd(JOB_CACHE, {cache_key: now for cache_key in cache_keys})
+
+
+def _evict_cache_keys(size):
+    """
+    Takes the cache size.
+    Drops the least recently used entries past JOB_CACHE_SIZE.
+    """
+    if size <= JOB_CACHE_SIZE:
+        return
+    evicted = [key for key, _ in JOB_DB.zpopmin(JOB_CACHE, size - JOB_CACHE_SIZE)]
+    if evicted:
+        JOB_DB.delete(*evicted)
+
+
 def update_job(jid, new_status, results=""):
     """
     Takes jid, status and results.
     Updates job_db with new status and uploads results if they exist.
+    Done in one UPDATE_JOB_SCRIPT call so the status, updated time, results,
+    and index entries change together without reading the job back.
+    A failed job is also dropped from the job cache, so the next identical
+    submission runs again instead of getting the failure back.
+    """
+    job_key = _generate_job_key(str(jid))
+    UPDATE_JOB_SCRIPT(keys=[job_key, _generate_results_key(job_key), JOB_INDEX],
+                      args=[json.dumps(new_status), json.dumps(str(datetime.now())),
+                            codec.encode_value(results) if results != "" else "", ""])
+    if new_status == "Failed":
+        release_job(jid)
+
+
+def release_job(jid):
+    """
+    Takes a jid.
+    Drops the job from the job cache if it is still cached, so the next
+    identical submission gets a new job instead of this one, e.g. once
+    its results can no longer be served.
     """
-    job_dict = json.loads(JOB_DB.get(_generate_job_key(str(jid))))
-    updated_time = str(datetime.now())
-    job_dict["updated time"] = updated_time
-    job_dict["status"] = new_status
-    if not job_dict["results"]:
-        job_dict["results"] = results
-    _save_job(_generate_job_key(str(jid)), job_dict)
+    job_key = job_key_of(jid)
+    cache_key = JOB_DB.hget(job_key, "cache key")
+    if cache_key is not None:
+        RELEASE_CACHE_KEY_SCRIPT(keys=[json.loads(cache_key), JOB_CACHE], args=[job_key])
+
+
+def start_job(job_key):
+    """
+    Takes a job_key from a queue.
+    Marks the job 'Processing' and reads it back in one round trip.
+    Returns its job_dict.
+    Raises KeyError if there is no such job.
+    """
+    try:
+        fields = UPDATE_JOB_SCRIPT(keys=[job_key, _generate_results_key(job_key), JOB_INDEX],
+                                   args=[json.dumps("Processing"),
+                                         json.dumps(str(datetime.now())), "", "1"])
+    except redis.ResponseError as error:
+        if "no such job" not in str(error):
+            raise
+        raise KeyError(job_key) from error
+    return _load_job(job_key, dict(zip(fields[::2], fields[1::2])))
 
 
 def get_job(jid):
     """
     Takes a jid.
-    Returns corresponding job_dict from JOB_DB.
+    Returns corresponding job_dict from JOB_DB, without its results.
+    Raises KeyError if there is no such job.
     """
-    if "job." in jid:
-        jid = jid.replace("job.", "")
-    job_dict = json.loads(JOB_DB.get(_generate_job_key(str(jid))))
-    return job_dict
+    job_key = job_key_of(jid)
+    return _found_job(job_key, JOB_DB.hgetall(job_key))
+
+
+async def get_job_async(jid):
+    """
+    Takes a jid.
+    Returns what get_job does, read on the asyncio pool.
+    """
+    job_key = job_key_of(jid)
+    return _found_job(job_key, await _async_job_db().hgetall(job_key))
+
+
+def _found_job(job_key, fields):
+    """
+    Takes job_key and its raw hash fields, empty if there is no such job.
+    Returns its job_dict, raises KeyError if there is no such job.
+    """
+    if not fields:
+        raise KeyError(job_key)
+    return _load_job(job_key, fields)
+
+
+def get_job_state(jid):
+    """
+    Takes a jid.
+    Returns (status, updated time) of the job, read without its other fields.
+    Raises KeyError if there is no such job.
+    """
+    return _found_state(jid, JOB_DB.hmget(job_key_of(jid), "status", "updated time"))
+
+
+async def get_job_state_async(jid):
+    """
+    Takes a jid.
+    Returns what get_job_state does, read on the asyncio pool.
+    """
+    return _found_state(jid, await _async_job_db().hmget(job_key_of(jid),
+                                                         "status", "updated time"))
+
+
+def _found_state(jid, fields):
+    """
+    Takes a jid and its raw status and updated time fields.
+    Returns (status, updated time), raises KeyError if there is no such job.
+    """
+    status, updated_time = fields
+    if status is None:
+        raise KeyError(jid)
+    return json.loads(status), json.loads(updated_time) if updated_time else ""
+
+
+def get_job_results(jid, stream=False):
+    """
+    Takes a jid, and whether the results are going to be streamed.
+    Returns corresponding results from JOB_DB, "" if not yet completed.
+    With stream, list results are an iterator instead, see
+    codec.iter_value, so records are decoded as they are sent.
+    Raises KeyError if there is no such job.
+    """
+    job_key = job_key_of(jid)
+    pipe = JOB_DB.pipeline()
+    pipe.exists(job_key)
+    pipe.get(_generate_results_key(job_key))
+    exists, results = pipe.execute()
+    if not exists:
+        raise KeyError(jid)
+    if results is None:
+        return ""
+    return codec.iter_value(results) if stream else codec.decode_value(results)
+
+
+async def get_job_results_async(jid, stream=False):
+    """
+    Takes a jid, and whether the results are going to be streamed.
+    Returns what get_job_results does, read on the asyncio pool. Results
+    larger than INLINE_RESULTS_BYTES are decoded on the default executor
+    so the event loop is not held up.
+    """
+    job_key = job_key_of(jid)
+    async with _async_job_db().pipeline() as pipe:
+        pipe.exists(job_key)
+        pipe.get(_generate_results_key(job_key))
+        exists, results = await pipe.execute()
+    if not exists:
+        raise KeyError(jid)
+    if results is None:
+        return ""
+    decode = codec.iter_value if stream else codec.decode_value
+    if len(results) > INLINE_RESULTS_BYTES:
+        return await asyncio.get_running_loop().run_in_executor(None, decode, results)
+    return decode(results)
+
+
+def parse_cursor(cursor):
+    """
+    Takes a cursor from a previous page of get_jobs, as given by a client,
+    '<score>_<job_key>' of the page's last job, or the bare score older
+    versions gave.
+    Returns (score, job_key or None), raises ValueError if it is not one.
+    """
+    score, _, job_key = cursor.partition("_")
+    score = float(score)
+    if not job_key:
+        return score, None
+    if not job_key.startswith("job."):
+        raise ValueError(cursor)
+    return score, job_key
+
+
+def get_jobs(status=None, work_type=None, cursor=None, count=100):
+    """
+    Takes optional status and work type filters, the cursor returned for
+    the previous page, see parse_cursor, and a page size.
+    Reads one page of job keys, newest first, from the matching index and
+    fetches their job_dicts in a single pipeline.
+    Returns (list of job_dicts, cursor for the next page or None).
+    """
+    keys, args = _page_args(status, work_type, cursor, count)
+    index = PAGE_JOBS_SCRIPT(keys=keys, args=args)
+    job_keys = [job_key.decode("utf-8") for job_key in index[::2]]
+    return _load_page(index, job_keys, redis_conn.hgetall_many(JOB_DB, job_keys), count)
+
+
+async def get_jobs_async(status=None, work_type=None, cursor=None, count=100):
+    """
+    Takes what get_jobs does.
+    Returns what get_jobs does, read on the asyncio pool.
+    """
+    job_db = _async_job_db()
+    keys, args = _page_args(status, work_type, cursor, count)
+    index = await job_db.register_script(PAGE_JOBS_LUA)(keys=keys, args=args)
+    job_keys = [job_key.decode("utf-8") for job_key in index[::2]]
+    found = []
+    if job_keys:
+        async with job_db.pipeline(transaction=False) as pipe:
+            for job_key in job_keys:
+                pipe.hgetall(job_key)
+            found = await pipe.execute()
+    return _load_page(index, job_keys, found, count)
+
+
+def _page_args(status, work_type, cursor, count):
+    """
+    Takes the status and work type filters, cursor, and size of a page of
+    jobs.
+    Returns (keys, args) to read the page with PAGE_JOBS_LUA.
+    """
+    score, job_key = ("", None) if cursor is None else parse_cursor(cursor)
+    return [_index_key(status, work_type)], ["" if score == "" else repr(score),
+                                             job_key or "", count]
+
+
+def _load_page(index, job_keys, found, count):
+    """
+    Takes a page read by PAGE_JOBS_LUA, job_keys and scores in turn, its
+    job_keys, their raw hash fields, and the page size.
+    Returns (list of job_dicts, cursor for the next page or None), skipping
+    jobs deleted since the index was read.
+    """
+    jobs_list = [_load_job(job_key, fields) for job_key, fields
+                 in zip(job_keys, found) if fields]
+    next_cursor = None
+    if job_keys and len(job_keys) == count:
+        next_cursor = "{!r}_{}".format(float(index[-1]), job_keys[-1])
+    return jobs_list, next_cursor
+
+
+def index_existing_jobs():
+    """
+    Moves jobs saved by older versions, whole json documents with no
+    index entries, into the job hashes and index.
+    Walks JOB_DB with SCAN so redis is never blocked.
+    """
+    if JOB_DB.exists(JOB_INDEX):
+        return
+    for job_key in JOB_DB.scan_iter(match="job.*", count=1000):
+        if JOB_DB.type(job_key) != b"string" or job_key.endswith(b".results"):
+            continue
+        job_dict = json.loads(JOB_DB.get(job_key))
+        JOB_DB.delete(job_key)
+        _save_job(job_key.decode("utf-8"), job_dict)
+
+
+def requeue_jobs(work_type, job_keys):
+    """
+    Takes a work type and job_keys taken off its queue but never run.
+    Puts them back on the queue with the priority and client they were
+    submitted with.
+    """
+    fields = redis_conn.pipelined(JOB_DB, (("hmget", job_key, "priority", "client")
+                                           for job_key in job_keys))
+    for job_key, (priority, client) in zip(job_keys, fields):
+        _queue_job(job_key, work_type,
+                   json.loads(priority) if priority else DEFAULT_PRIORITY,
+                   json.loads(client) if client else "")
+
+
+def requeue_legacy_jobs():
+    """
+    Moves job_keys left on the HotQueues used by older versions onto the
+    job queues, at the default priority. Messages that are not a pickled
+    job_key are dropped, see _load_legacy_message.
+    """
+    for work_type in WORK_TYPES:
+        queue = work_queue(work_type)
+        legacy_key = "hotqueue:" + queue.name
+        while True:
+            message = queue.redis.lpop(legacy_key)
+            if message is None:
+                break
+            job_key = _load_legacy_message(message)
+            if job_key is None:
+                print("Error: Dropping malformed message from {}".format(legacy_key))
+                continue
+            _queue_job(job_key, work_type)
+
+
+class _StrUnpickler(pickle.Unpickler):
+    """
+    Unpickler that refuses every global, so a message can only load as
+    plain values and never runs code.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("global {}.{} is not allowed".format(module, name))
 
 
-def get_all_jobs():
+def _load_legacy_message(message):
     """
-    Returns a list of all job_dicts from the JOB_DB.
+    Takes a message from a legacy HotQueue, which holds a pickled job_key.
+    Returns the job_key, or None if message is anything else.
     """
-    jobs_list = []
-    for k in JOB_DB.keys():
-        jobs_list.append(json.loads(JOB_DB.get(k)))
-    return jobs_list
+    try:
+        job_key = _StrUnpickler(io.BytesIO(message)).load()
+    except Exception:
+        return None
+    if not isinstance(job_key, str) or not job_key.startswith("job."):
+        return None
+    return job_key
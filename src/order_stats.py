@@ -0,0 +1,61 @@
+"""
+Author: Christian R. Garcia
+Order statistics over ranges of the spots column. A wavelet matrix is
+built once over the spots in year order, after which the k-th smallest
+value of any [first, last) range takes one step per bit of the largest
+value, no matter how long the range is.
+"""
+import numpy as np
+
+
+class WaveletMatrix:
+    """
+    Takes a non negative int spots array in year order.
+    Each level stably splits the values by one bit, high bit first, and
+    keeps a prefix count of zero bits so ranges can follow values down.
+    """
+
+    def __init__(self, spots):
+        values = np.asarray(spots, dtype=np.int64)
+        self.size = len(values)
+        self.bits = max(int(values.max()).bit_length(), 1) if self.size else 1
+        count_type = np.int32 if self.size < 2 ** 31 else np.int64
+        self.zero_counts = []
+        self.zero_totals = []
+
+        for level in range(self.bits - 1, -1, -1):
+            is_zero = ((values >> level) & 1) == 0
+            zero_counts = np.zeros(self.size + 1, dtype=count_type)
+            np.cumsum(is_zero, out=zero_counts[1:])
+            self.zero_counts.append(zero_counts)
+            self.zero_totals.append(int(zero_counts[-1]))
+            values = np.concatenate((values[is_zero], values[~is_zero]))
+
+    def kth_smallest(self, first, last, k):
+        """
+        Takes a [first, last) range and a 0 based k below its length.
+        Returns the k-th smallest spots value in that range.
+        """
+        if not 0 <= k < last - first:
+            raise IndexError("k is outside the range")
+
+        value = 0
+        for level, zero_counts in enumerate(self.zero_counts):
+            zeros_first = int(zero_counts[first])
+            zeros_last = int(zero_counts[last])
+            zeros = zeros_last - zeros_first
+            if k < zeros:
+                first, last = zeros_first, zeros_last
+            else:
+                k -= zeros
+                first = self.zero_totals[level] + first - zeros_first
+                last = self.zero_totals[level] + last - zeros_last
+                value |= 1 << (self.bits - 1 - level)
+        return value
+
+    def ranked(self, first, last):
+        """
+        Takes a [first, last) range.
+        Returns function giving the k-th smallest value within that range.
+        """
+        return lambda k: self.kth_smallest(first, last, k)
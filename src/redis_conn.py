@@ -0,0 +1,116 @@
+"""
+Author: Christian R. Garcia
+Redis connections for every component. Keeps one blocking connection
+pool per logical db per process, shared by every module using that db,
+with socket timeouts, TCP keepalive, health checks, and optionally a
+unix socket in place of TCP, all set from env vars. Also has the asyncio
+pools for asgi.py and helpers to batch many commands into one pipeline.
+"""
+import os
+import socket
+from threading import Lock
+import redis
+
+REDIS_IP = os.getenv("REDIS_IP", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# Path of redis' unix socket, used instead of REDIS_IP and REDIS_PORT if set.
+REDIS_SOCKET = os.getenv("REDIS_SOCKET")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+# Seconds to wait for a free pooled connection before failing.
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "20"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+# Must stay above the longest blocking read, queue gets block for 1 second.
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "30"))
+REDIS_KEEPALIVE = os.getenv("REDIS_KEEPALIVE", "1") != "0"
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+_POOLS = {}
+_ASYNC_POOLS = {}
+_POOLS_LOCK = Lock()
+
+
+def connection_kwargs():
+    """
+    Returns the connection settings shared by every pool.
+    """
+    kwargs = {'socket_connect_timeout': REDIS_CONNECT_TIMEOUT,
+              'socket_timeout': REDIS_SOCKET_TIMEOUT,
+              'health_check_interval': REDIS_HEALTH_CHECK_INTERVAL}
+    if REDIS_SOCKET:
+        kwargs['path'] = REDIS_SOCKET
+        return kwargs
+
+    kwargs.update(host=REDIS_IP, port=REDIS_PORT, socket_keepalive=REDIS_KEEPALIVE)
+    if REDIS_KEEPALIVE and hasattr(socket, "TCP_KEEPIDLE"):
+        # Notices a dead peer in about a minute instead of the os default hours.
+        kwargs['socket_keepalive_options'] = {socket.TCP_KEEPIDLE: 30,
+                                              socket.TCP_KEEPINTVL: 10,
+                                              socket.TCP_KEEPCNT: 3}
+    return kwargs
+
+
+def get_pool(db):
+    """
+    Takes a db id, a string from the env vars or an int.
+    Returns this process' connection pool for that db, creating it once.
+    """
+    db = int(db or 0)
+    with _POOLS_LOCK:
+        if db not in _POOLS:
+            kwargs = connection_kwargs()
+            if REDIS_SOCKET:
+                kwargs['connection_class'] = redis.UnixDomainSocketConnection
+            _POOLS[db] = redis.BlockingConnectionPool(
+                db=db, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT, **kwargs)
+        return _POOLS[db]
+
+
+def get_client(db):
+    """
+    Takes a db id.
+    Returns a client using the shared pool of that db.
+    """
+    return redis.StrictRedis(connection_pool=get_pool(db))
+
+
+def get_async_client(db):
+    """
+    Takes a db id.
+    Returns an asyncio client using this process' asyncio pool for that
+    db, which shares the settings of the blocking pools.
+    """
+    import redis.asyncio as aioredis
+
+    db = int(db or 0)
+    with _POOLS_LOCK:
+        if db not in _ASYNC_POOLS:
+            kwargs = connection_kwargs()
+            if REDIS_SOCKET:
+                kwargs['connection_class'] = aioredis.UnixDomainSocketConnection
+            _ASYNC_POOLS[db] = aioredis.BlockingConnectionPool(
+                db=db, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT, **kwargs)
+        return aioredis.Redis(connection_pool=_ASYNC_POOLS[db])
+
+
+def pipelined(client, commands, transaction=False):
+    """
+    Takes a client and an iterable of commands, each a tuple of the client
+    method name and its arguments, e.g. ("hgetall", "job.1").
+    Sends them all in one round trip, in a transaction if asked.
+    Returns list of their replies in order.
+    """
+    pipe = client.pipeline(transaction=transaction)
+    for name, *args in commands:
+        getattr(pipe, name)(*args)
+    return pipe.execute()
+
+
+def hgetall_many(client, keys):
+    """
+    Takes a client and a list of hash keys.
+    Returns list of their fields in one round trip, empty dicts for
+    missing keys.
+    """
+    if not keys:
+        return []
+    return pipelined(client, (("hgetall", key) for key in keys))
@@ -0,0 +1,86 @@
+"""
+Author: Christian R. Garcia
+Sliding window aggregates over the spots column. Every aggregate is O(n)
+for the whole series no matter the window size: running sums for the
+mean and standard deviation, and monotonic deques for the min and max.
+"""
+from collections import deque
+import numpy as np
+
+AGGREGATES = ("mean", "min", "max", "std")
+
+
+def rolling(values, window, agg):
+    """
+    Takes int values in year order, a window length, and an aggregate
+    name from AGGREGATES.
+    Returns array with the aggregate of every full window, the i-th
+    entry covering values[i:i + window]. Empty if window is too long.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if window < 1 or window > len(values):
+        return np.empty(0)
+    if agg == "mean":
+        return rolling_mean(values, window)
+    if agg == "std":
+        return rolling_std(values, window)
+    if agg == "min":
+        return rolling_extreme(values, window, lambda kept, new: kept >= new)
+    if agg == "max":
+        return rolling_extreme(values, window, lambda kept, new: kept <= new)
+    raise ValueError("agg must be one of {}".format(", ".join(AGGREGATES)))
+
+
+def window_sums(values, window):
+    """
+    Takes values and a window length.
+    Returns exact int sums of every full window from one prefix sum.
+    """
+    sums = np.concatenate(([0], np.cumsum(values)))
+    return sums[window:] - sums[:-window]
+
+
+def rolling_mean(values, window):
+    """
+    Takes int values and a window length.
+    Returns mean of every full window.
+    """
+    return window_sums(values, window) / window
+
+
+def rolling_std(values, window):
+    """
+    Takes int values and a window length.
+    Works the sample variance out of exact int window sums of values
+    and squared values so there is no running float drift.
+    Returns sample standard deviation of every full window, nan for a
+    window of one.
+    """
+    if window < 2:
+        return np.full(len(values), np.nan)
+    totals = window_sums(values, window)
+    squares = window_sums(values * values, window)
+    variance = (window * squares - totals * totals) / (window * (window - 1))
+    return np.sqrt(variance)
+
+
+def rolling_extreme(values, window, dominated):
+    """
+    Takes int values, a window length, and dominated(kept, new) telling
+    when a kept value can never be the extreme again once new arrives.
+    Keeps a deque of candidate indexes whose values stay monotonic, so each
+    index is pushed and popped at most once.
+    Returns extreme of every full window.
+    """
+    values_list = values.tolist()
+    results = []
+    candidates = deque()
+    for index, value in enumerate(values_list):
+        while candidates and dominated(values_list[candidates[-1]], value):
+            candidates.pop()
+        candidates.append(index)
+        if candidates[0] <= index - window:
+            candidates.popleft()
+        if index >= window - 1:
+            results.append(values_list[candidates[0]])
+    return np.array(results, dtype=np.int64)
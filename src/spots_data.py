@@ -0,0 +1,133 @@
+"""
+Author: Christian R. Garcia
+Columnar form of the sunspots dataset. Holds contiguous numpy arrays of
+ids, years, and spots so ranges and filters are array slices or masks
+instead of lists of dictionaries. Only converted back to the list of
+dictionaries format when it has to be sent out as json.
+"""
+import numpy as np
+from stats_engine import RangeAggregates
+from order_stats import WaveletMatrix
+
+
+class SpotsData:
+    """
+    Takes ids, years, and spots sequences of equal length, sorted by year.
+    Slicing returns views so selecting a range never copies the columns.
+    """
+
+    def __init__(self, ids, years, spots):
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        self.years = np.ascontiguousarray(years, dtype=np.int64)
+        self.spots = np.ascontiguousarray(spots, dtype=np.int64)
+
+    @classmethod
+    def from_columns(cls, years, spots):
+        """
+        Takes years and spots columns of a whole dataset.
+        Returns SpotsData with ids as their positions.
+        """
+        return cls(np.arange(len(years)), years, spots)
+
+    @classmethod
+    def from_list(cls, data_list):
+        """
+        Takes a list of 'id', 'year', 'spots' dictionaries.
+        Returns SpotsData of the same rows.
+        """
+        return cls([dict_x['id'] for dict_x in data_list],
+                   [dict_x['year'] for dict_x in data_list],
+                   [dict_x['spots'] for dict_x in data_list])
+
+    @property
+    def aggregates(self):
+        """
+        Returns RangeAggregates over these rows, built on first use and
+        kept for as long as this SpotsData is, which for the cached
+        dataset is until the data version changes.
+        """
+        if getattr(self, "_aggregates", None) is None:
+            self._aggregates = RangeAggregates(self.spots)
+        return self._aggregates
+
+    @property
+    def order_stats(self):
+        """
+        Returns WaveletMatrix over these rows' spots, built on first use
+        and kept alongside aggregates.
+        """
+        if getattr(self, "_order_stats", None) is None:
+            self._order_stats = WaveletMatrix(self.spots)
+        return self._order_stats
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        """
+        Takes a slice or boolean/int index array.
+        Returns SpotsData of those rows.
+        """
+        return SpotsData(self.ids[index], self.years[index], self.spots[index])
+
+    def bounds(self, start, end, limit, offset):
+        """
+        Takes start, end, limit, and offset.
+        Binary searches years for start or end, otherwise slices by
+        position since ids are dense.
+        Returns (first, last) index range of the requested rows.
+        """
+        size = len(self)
+        if start is not None or end is not None:
+            first = 0 if start is None else int(np.searchsorted(self.years, start, 'left'))
+            last = size if end is None else int(np.searchsorted(self.years, end, 'right'))
+        else:
+            first = 0 if offset is None else min(offset, size)
+            last = size if limit is None else min(first + limit, size)
+        return first, max(first, last)
+
+    def select(self, start, end, limit, offset):
+        """
+        Takes start, end, limit, and offset.
+        Returns SpotsData view of the requested rows.
+        """
+        first, last = self.bounds(start, end, limit, offset)
+        return self[first:last]
+
+    def where(self, mask):
+        """
+        Takes a boolean array built from the columns, e.g. data.spots > 100.
+        Returns SpotsData of the rows where mask is True.
+        """
+        return self[np.asarray(mask, dtype=bool)]
+
+    def insert(self, years, spots):
+        """
+        Takes years and spots columns of new rows, sorted by year, to add
+        to this whole dataset.
+        Inserts each new row after any existing rows of the same year, so
+        ids before the first insertion point stay the same.
+        Returns (SpotsData of the merged dataset, first id that changed).
+        """
+        positions = np.searchsorted(self.years, years, 'right')
+        merged = SpotsData.from_columns(np.insert(self.years, positions, years),
+                                        np.insert(self.spots, positions, spots))
+        first_id = int(positions[0]) if len(positions) else len(self)
+        return merged, first_id
+
+    def iter_rows(self, chunk_size=1024):
+        """
+        Takes a chunk_size.
+        Yields rows as 'id', 'year', 'spots' dictionaries, converting only
+        chunk_size rows at a time so memory stays flat for large ranges.
+        """
+        for first in range(0, len(self), chunk_size):
+            yield from self[first:first + chunk_size].to_list()
+
+    def to_list(self):
+        """
+        Returns rows as the list of 'id', 'year', 'spots' dictionaries
+        used in json responses.
+        """
+        return [{'id': id_x, 'year': year, 'spots': spots} for id_x, year, spots in
+                zip(self.ids.tolist(), self.years.tolist(), self.spots.tolist())]
@@ -0,0 +1,214 @@
+"""
+Author: Christian R. Garcia
+Computes every statistic the stats worker reports in a couple of passes
+over a spots column instead of one 'statistics' call per value.
+Sums are kept as exact integers so results match the 'statistics' module
+exactly: one sort, or a WaveletMatrix, gives all three medians and any
+percentiles, and one np.unique gives the mode and the harmonic mean.
+
+RangeAggregates holds prefix sums and sparse tables for a whole dataset so
+sums, moments, and extremes of any range need no scan at all.
+"""
+import math
+import statistics
+from fractions import Fraction
+import numpy as np
+
+# Same correctly rounded square root 'statistics.stdev' uses where it exists.
+_SQRT_OF_FRAC = getattr(statistics, "_float_sqrt_of_frac", None)
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def describe(spots, totals=None, kth=None, requested=None):
+    """
+    Takes a sequence of non negative int spots, and optionally their
+    (sum, sum of squares) already known from RangeAggregates, a function
+    giving their k-th smallest value such as WaveletMatrix.ranked, and a
+    list of requested percentiles.
+    Returns list of single stat dictionaries in the order the stats worker
+    has always reported them, or an empty list for an empty range.
+    'variance' and 'standard deviation' are None for a single value.
+    A 'percentiles' dictionary is appended if any were requested.
+    """
+    spots = np.asarray(spots, dtype=np.int64)
+    count = len(spots)
+    if not count:
+        return []
+
+    if totals is None:
+        totals = int(exact_prefix(spots)[-1]), int(exact_prefix(spots, 2)[-1])
+    total, squares = totals
+    if kth is None:
+        ordered = np.sort(spots)
+        kth = lambda k: int(ordered[k])
+    values, counts = np.unique(spots, return_counts=True)
+
+    variance, stdev = exact_variance(total, squares, count)
+    stats_list = [
+        {"mean": exact_mean(total, count)},
+        {"harmonic mean": harmonic_mean(values, counts, count)},
+        {"median": median(kth, count)},
+        {"low median": kth((count - 1) // 2)},
+        {"high median": kth(count // 2)},
+        {"mode": mode(spots, values, counts)},
+        {"variance": variance},
+        {"standard deviation": stdev},]
+    if requested:
+        stats_list.append({"percentiles": percentiles(kth, count, requested)})
+    return stats_list
+
+
+def exact_mean(total, count):
+    """
+    Takes the integer sum and count of a range.
+    Returns the mean as an int when exact, otherwise a correctly rounded float.
+    """
+    if total % count == 0:
+        return total // count
+    return total / count
+
+
+def exact_variance(total, squares, count):
+    """
+    Takes the integer sum, sum of squares, and count of a range.
+    Works on the exact fraction (count * squares - total ** 2) / count
+    instead of a float running update, so rounding matches 'statistics'.
+    Returns (sample variance, sample standard deviation), both None if
+    count is below two.
+    """
+    if count < 2:
+        return None, None
+    variance = Fraction(count * squares - total * total, count * (count - 1))
+    if _SQRT_OF_FRAC is not None:
+        stdev = _SQRT_OF_FRAC(variance.numerator, variance.denominator)
+    else:
+        stdev = math.sqrt(variance)
+    if variance.denominator == 1:
+        return int(variance), stdev
+    return float(variance), stdev
+
+
+def median(kth, count):
+    """
+    Takes a k-th smallest function and the number of values.
+    Returns their median, averaging the middle two for an even count.
+    """
+    if count % 2:
+        return kth(count // 2)
+    return (kth(count // 2 - 1) + kth(count // 2)) / 2
+
+
+def percentiles(kth, count, requested):
+    """
+    Takes a k-th smallest function, the number of values, and a list of
+    percentiles between 0 and 100.
+    Interpolates linearly between the closest ranks, like numpy's default.
+    Returns dictionary of each percentile, as a string, to its value.
+    """
+    results = {}
+    for percent in requested:
+        position = percent / 100 * (count - 1)
+        lower = math.floor(position)
+        upper = min(lower + 1, count - 1)
+        low_value = kth(lower)
+        value = low_value + (kth(upper) - low_value) * (position - lower)
+        results[str(percent)] = value
+    return results
+
+
+def mode(spots, values, counts):
+    """
+    Takes the spots array in year order, and its distinct values and how
+    often each appears, from np.unique.
+    Returns the most common value, the first one seen in year order on ties.
+    """
+    candidates = values[counts == counts.max()]
+    if len(candidates) == 1:
+        return int(candidates[0])
+    return int(spots[np.argmax(np.isin(spots, candidates))])
+
+
+def harmonic_mean(values, counts, count):
+    """
+    Takes the distinct spots in ascending order, how often each appears,
+    and the number of spots.
+    Sums the float reciprocal of each distinct value times how often it
+    appears, exactly as 'statistics.harmonic_mean' sums them.
+    Returns the harmonic mean, 0 if any value is 0.
+    """
+    if values[0] == 0:
+        return 0
+    if count == 1:
+        return int(values[0])
+    total = sum(Fraction(1 / value) * frequency
+                for value, frequency in zip(values.tolist(), counts.tolist()))
+    return float(count / total)
+
+
+def exact_prefix(spots, power=1):
+    """
+    Takes an int64 array of non negative spots and a power, 1 or 2.
+    Returns the prefix sums of spots ** power, starting at 0. They are
+    int64 while the total can not wrap, otherwise exact python ints in an
+    object array, slower but never wrong.
+    """
+    peak = int(spots.max()) if len(spots) else 0
+    if peak ** power * len(spots) > INT64_MAX:
+        spots = spots.astype(object)
+    return np.concatenate(([0], np.cumsum(spots ** power)))
+
+
+class RangeAggregates:
+    """
+    Takes a spots array in year order and builds prefix sums of spots and
+    squared spots plus min and max sparse tables over it, O(n log n) once.
+    Then count, sum, mean, variance, stdev, min, and max of any [first, last)
+    range are answered in constant time.
+    """
+
+    def __init__(self, spots):
+        spots = np.asarray(spots, dtype=np.int64)
+        self.sums = exact_prefix(spots)
+        self.squares = exact_prefix(spots, 2)
+        self.mins = [spots]
+        self.maxes = [spots]
+        width = 1
+        while width * 2 <= len(spots):
+            self.mins.append(np.minimum(self.mins[-1][:-width], self.mins[-1][width:]))
+            self.maxes.append(np.maximum(self.maxes[-1][:-width], self.maxes[-1][width:]))
+            width *= 2
+
+    def totals(self, first, last):
+        """
+        Takes a [first, last) range.
+        Returns (sum, sum of squares) of its spots as ints.
+        """
+        return (int(self.sums[last] - self.sums[first]),
+                int(self.squares[last] - self.squares[first]))
+
+    def extremes(self, first, last):
+        """
+        Takes a non empty [first, last) range.
+        Returns (min, max) of its spots from two overlapping table entries.
+        """
+        level = (last - first).bit_length() - 1
+        other = last - (1 << level)
+        return (int(min(self.mins[level][first], self.mins[level][other])),
+                int(max(self.maxes[level][first], self.maxes[level][other])))
+
+    def summary(self, first, last):
+        """
+        Takes a [first, last) range.
+        Returns dictionary of its count, sum, mean, variance, standard
+        deviation, min, and max, None where the range is too small.
+        """
+        count = max(last - first, 0)
+        if not count:
+            return {"count": 0, "sum": 0, "mean": None, "variance": None,
+                    "standard deviation": None, "min": None, "max": None}
+        total, squares = self.totals(first, last)
+        variance, stdev = exact_variance(total, squares, count)
+        low, high = self.extremes(first, last)
+        return {"count": count, "sum": total, "mean": exact_mean(total, count),
+                "variance": variance, "standard deviation": stdev,
+                "min": low, "max": high}
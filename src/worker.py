@@ -0,0 +1,119 @@
+"""
+Author: Christian R. Garcia
+Worker runtime shared by every job type. A worker module only provides
+its execute_job, run takes care of the rest: waiting for redis, taking
+job_ids off the work type's queue, running several jobs at once on a
+thread or process pool, keeping a few jobs prefetched so no slot waits on
+the queue, and on SIGTERM or SIGINT finishing the running jobs and
+putting the ones not yet started back on the queue.
+"""
+import os
+import signal
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from threading import Event
+import jobs
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", str(os.cpu_count() or 1)))
+WORKER_POOL = os.getenv("WORKER_POOL")
+WORKER_PREFETCH = int(os.getenv("WORKER_PREFETCH", "2"))
+# Seconds a queue read blocks before checking for shutdown again.
+QUEUE_TIMEOUT = 1
+
+
+def run(work_type, execute_job, default_pool="thread"):
+    """
+    Takes a work type, the execute_job function its jobs are run with, and
+    the pool kind, 'thread' or 'process', to use unless WORKER_POOL is set.
+    Runs up to WORKER_CONCURRENCY jobs at once with WORKER_PREFETCH more
+    claimed and waiting, until told to stop.
+    """
+    pool = WORKER_POOL or default_pool
+    queue = jobs.work_queue(work_type)
+    stopping = Event()
+
+    def stop(signum, frame):
+        print("Worker stopping, finishing running jobs")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    wait_for_redis(queue, stopping)
+
+    if pool == "process":
+        executor = ProcessPoolExecutor(max_workers=WORKER_CONCURRENCY,
+                                       initializer=ignore_signals)
+    else:
+        executor = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY)
+    in_flight = {}
+    try:
+        while not stopping.is_set():
+            if len(in_flight) >= WORKER_CONCURRENCY + WORKER_PREFETCH:
+                done, _ = wait(in_flight, timeout=QUEUE_TIMEOUT, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+                continue
+            for future in [future for future in in_flight if future.done()]:
+                in_flight.pop(future)
+
+            try:
+                job_key = queue.get(block=True, timeout=QUEUE_TIMEOUT)
+            except Exception:
+                print("Error: Lost connection to redis. Reattempting connection in 3 seconds")
+                wait_for_redis(queue, stopping, first_wait=3)
+                continue
+            if job_key is not None:
+                in_flight[executor.submit(run_job, execute_job, job_key)] = job_key
+    finally:
+        requeue = [job_key for future, job_key in in_flight.items() if future.cancel()]
+        if requeue:
+            jobs.requeue_jobs(work_type, requeue)
+            print("Put {} prefetched jobs back on the queue".format(len(requeue)))
+        executor.shutdown(wait=True)
+    print("Worker stopped")
+
+
+def wait_for_redis(queue, stopping, first_wait=0):
+    """
+    Takes the queue and the shutdown event.
+    Waits until redis is in operation and the queue can be read.
+    """
+    stopping.wait(first_wait)
+    while not stopping.is_set():
+        try:
+            len(queue)
+            return
+        except Exception:
+            print("Error: Redis not yet initialized. Reattempting connection in 3 seconds")
+            stopping.wait(3)
+
+
+def ignore_signals():
+    """
+    Runs in each pool process so only the main process handles shutdown.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_job(execute_job, job_key):
+    """
+    Takes execute_job and a job_key from the queue, runs on the pool.
+    Gets the job_dict as its status is updated, executes the job, stores
+    its results, updates status again to complete and prints out
+    "job_id complete" to console. A job that raises is marked 'Failed'
+    so one bad job never takes the worker down.
+    """
+    try:
+        job_dict = jobs.start_job(job_key)
+    except KeyError:
+        print(job_key + " no longer exists, skipping")
+        return
+    try:
+        results = execute_job(job_dict)
+        jobs.update_job(job_dict["id"], "Completed", results)
+        print(job_key + " complete")
+    except Exception:
+        traceback.print_exc()
+        jobs.update_job(job_dict["id"], "Failed")
+        print(job_key + " failed")
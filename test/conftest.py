@@ -0,0 +1,40 @@
+"""
+Author: Christian R. Garcia
+Points redis_conn at an in process fakeredis server, when fakeredis is
+installed, so the modules that keep their data in redis can be tested
+without one. Tests that need it take the redis_server fixture, which
+skips them if fakeredis is missing and empties every db beforehand.
+"""
+import sys
+import os
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import redis_conn
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+if fakeredis is not None:
+    SERVER = fakeredis.FakeServer()
+
+    def fake_pool(db):
+        return fakeredis.FakeStrictRedis(server=SERVER, db=int(db or 0)).connection_pool
+
+    def fake_async_client(db):
+        return fakeredis.aioredis.FakeRedis(server=SERVER, db=int(db or 0))
+
+    redis_conn.get_pool = fake_pool
+    redis_conn.get_async_client = fake_async_client
+
+
+@pytest.fixture
+def redis_server():
+    if fakeredis is None:
+        pytest.skip("fakeredis is not installed")
+    fakeredis.FakeStrictRedis(server=SERVER).flushall()
+    return SERVER
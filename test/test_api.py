@@ -161,3 +161,26 @@ def test_a6CheckStatus(section_six):
 
 def test_b6CheckJSON(section_six):
     assert isinstance(section_six.json(), str)
+
+
+# Checking conditional GET /spots
+@pytest.fixture(scope="module")
+def section_seven():
+    first = get_from_server("/spots?limit=5")
+    again = r.get("{}/spots?limit=5".format(BASE_URL),
+                  headers={"If-None-Match": first.headers["ETag"]})
+    other = r.get("{}/spots?limit=6".format(BASE_URL),
+                  headers={"If-None-Match": first.headers["ETag"]})
+    return first, again, other
+
+def test_a7CheckETag(section_seven):
+    assert section_seven[0].headers["ETag"]
+
+def test_b7CheckNotModified(section_seven):
+    assert section_seven[1].status_code == 304
+
+def test_c7CheckEmptyBody(section_seven):
+    assert section_seven[1].content == b""
+
+def test_d7CheckOtherParams(section_seven):
+    assert section_seven[2].status_code == 200
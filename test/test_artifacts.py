@@ -0,0 +1,49 @@
+"""
+Author: Christian R. Garcia
+Tests the artifact store's eviction, and that render keys go with the
+artifacts they point at, against fakeredis, see conftest.py.
+
+Run with "py.test-3 test_artifacts.py"
+"""
+import sys
+import os
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import artifacts
+
+
+def test_render_keys_reuse_artifact(redis_server):
+    address = artifacts.put(b"png")
+    artifacts.remember("render", address)
+    assert artifacts.lookup("render") == address
+    assert artifacts.get(address) == b"png"
+
+def test_eviction_removes_render_keys(redis_server, monkeypatch):
+    monkeypatch.setattr(artifacts, "ARTIFACT_MAX_BYTES", 10)
+    first = artifacts.put(b"first")
+    artifacts.remember("render.1", first)
+    artifacts.remember("render.2", first)
+    second = artifacts.put(b"second")
+    artifacts.remember("render.3", second)
+
+    assert artifacts.get(first) is None
+    assert artifacts.lookup("render.1") is None
+    assert artifacts.lookup("render.3") == second
+    assert not artifacts.ARTIFACT_DB.exists(artifacts.RENDER_PREFIX + "render.1",
+                                            artifacts.RENDER_PREFIX + "render.2",
+                                            artifacts.RENDERS_PREFIX + first)
+    assert int(artifacts.ARTIFACT_DB.get(artifacts.BYTES_KEY)) == len(b"second")
+
+def test_remember_evicted_artifact(redis_server, monkeypatch):
+    monkeypatch.setattr(artifacts, "ARTIFACT_MAX_BYTES", 10)
+    first = artifacts.put(b"first")
+    artifacts.put(b"second")
+    artifacts.remember("render", first)
+    assert not artifacts.ARTIFACT_DB.exists(artifacts.RENDER_PREFIX + "render")
+
+def test_lookup_drops_stale_render_key(redis_server):
+    artifacts.ARTIFACT_DB.set(artifacts.RENDER_PREFIX + "render", "gone")
+    assert artifacts.lookup("render") is None
+    assert not artifacts.ARTIFACT_DB.exists(artifacts.RENDER_PREFIX + "render")
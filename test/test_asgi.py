@@ -0,0 +1,110 @@
+"""
+Author: Christian R. Garcia
+Tests that the routes asgi.py serves itself answer exactly as the Flask
+app in api.py does, bodies, status codes, and ETag, Last-Modified, and
+X-Next-Cursor headers, including 304s, with both apps' test clients
+against fakeredis, see conftest.py.
+
+Run with "py.test-3 test_asgi.py"
+"""
+import sys
+import os
+import json
+import warnings
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import api
+import jobs
+import file_ops
+import get_db_data as gdd
+from spots_data import SpotsData
+
+starlette_testclient = pytest.importorskip("starlette.testclient")
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import asgi
+
+HEADERS = ("etag", "last-modified", "x-next-cursor", "cache-control", "content-type")
+
+
+@pytest.fixture
+def clients(redis_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(file_ops, "CSV_LOC", str(tmp_path / "sunspots.csv"))
+    monkeypatch.setattr(file_ops, "LOG_LOC", str(tmp_path / "sunspots.log"))
+    monkeypatch.setattr(gdd, "_DATASET", (None, SpotsData.from_columns([], [])))
+    with open(file_ops.CSV_LOC, 'w') as csv_file:
+        for year in range(1700, 1750):
+            csv_file.write("{},{}\n".format(year, (year * 7) % 90))
+    file_ops.init_db_data()
+    with starlette_testclient.TestClient(asgi.app) as asgi_client:
+        yield asgi_client, api.app.test_client()
+
+
+@pytest.fixture
+def job_ids(clients):
+    completed = json.loads(jobs.add_job("stats", 1700, 1720, None, None))["id"]
+    jobs.start_job("job." + completed)
+    jobs.update_job(completed, "Completed", [{"mean": 1.5}, {"median": 2}])
+    submitted = [json.loads(jobs.add_job("data", 1700, 1701 + i, None, None))["id"]
+                 for i in range(4)]
+    return completed, submitted
+
+
+def assert_same(clients, path, headers=None):
+    asgi_client, flask_client = clients
+    ours = asgi_client.get(path, headers=headers or {})
+    theirs = flask_client.get(path, headers=headers or {})
+    assert ours.status_code == theirs.status_code, path
+    assert ours.content == theirs.get_data(), path
+    for name in HEADERS:
+        assert ours.headers.get(name) == theirs.headers.get(name), (path, name)
+    return ours
+
+
+def test_spots_routes_match(clients):
+    for path in ("/spots", "/spots?start=1710&end=1720", "/spots?limit=5&offset=3",
+                 "/spots?start=x", "/spots?stream=ndjson&limit=3", "/spots?stream=json",
+                 "/spots/summary?start=1705", "/spots/summary?start=1800",
+                 "/spots/ids/3", "/spots/years/1711"):
+        assert_same(clients, path)
+    assert_same(clients, "/spots?limit=3", {"Accept": "application/x-ndjson"})
+
+def test_spots_not_modified(clients):
+    etag = assert_same(clients, "/spots?start=1710").headers["etag"]
+    assert assert_same(clients, "/spots?start=1710",
+                       {"If-None-Match": etag}).status_code == 304
+    assert assert_same(clients, "/spots?start=1711",
+                       {"If-None-Match": etag}).status_code == 200
+
+def test_job_routes_match(clients, job_ids):
+    completed, submitted = job_ids
+    for path in ("/jobs/" + completed, "/jobs/" + submitted[0], "/jobs/missing",
+                 "/jobs/{}/results".format(completed), "/jobs/{}/results".format(submitted[0]),
+                 "/jobs/{}/results?stream=ndjson".format(completed), "/jobs/missing/results"):
+        assert_same(clients, path)
+
+def test_results_not_modified(clients, job_ids):
+    completed, _ = job_ids
+    path = "/jobs/{}/results".format(completed)
+    response = assert_same(clients, path)
+    assert assert_same(clients, path, {"If-None-Match": response.headers["etag"]}) \
+        .status_code == 304
+    assert assert_same(clients, path, {"If-Modified-Since": response.headers["last-modified"]}) \
+        .status_code == 304
+
+def test_jobs_pages_match(clients, job_ids):
+    cursor = None
+    pages = 0
+    while True:
+        path = "/jobs?count=2" + ("&cursor=" + cursor if cursor else "")
+        cursor = assert_same(clients, path).headers.get("x-next-cursor")
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 3
+    for path in ("/jobs?type=data&status=Submitted", "/jobs?count=0", "/jobs?count=x",
+                 "/jobs?cursor=bad"):
+        assert_same(clients, path)
@@ -0,0 +1,62 @@
+"""
+Author: Christian R. Garcia
+Tests the dataset snapshot and results codecs round trip and still read
+plain json.
+
+Run with "py.test-3 test_codec.py"
+"""
+import sys
+import os
+import json
+import numpy as np
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import codec
+
+
+@pytest.mark.parametrize("spots", [[], [0, 5, 250], [2 ** 31, 3]])
+def test_columns_round_trip(spots):
+    years = list(range(1770, 1770 + len(spots)))
+    snapshot = codec.encode_columns(years, spots)
+    decoded_years, decoded_spots = codec.decode_columns(snapshot)
+    assert decoded_years.tolist() == years and decoded_spots.tolist() == spots
+    assert decoded_spots.dtype == np.int64
+
+def test_columns_packed_as_int32():
+    assert len(codec.encode_columns(range(100), range(100))) == len(codec.encode_columns([], [])) + 800
+
+def test_not_a_snapshot():
+    with pytest.raises(ValueError):
+        codec.decode_columns(b"1770,101")
+
+@pytest.mark.parametrize("name", ["json", "zlib", "msgpack"])
+def test_value_round_trip(name):
+    results = [{'id': 0, 'year': 1770, 'spots': 101}, {'mean': 47.11, 'median': None}]
+    assert codec.decode_value(codec.encode_value(results, name)) == results
+
+def test_reads_plain_json():
+    results = {"graph": "/jobs/1/graph", "artifact": None}
+    assert codec.decode_value(json.dumps(results).encode("utf-8")) == results
+
+@pytest.mark.parametrize("name", ["json", "zlib", "msgpack"])
+@pytest.mark.parametrize("results", [[], [{'id': 0, 'year': 1770, 'spots': 101}],
+                                     [{'id': 0}, [1, 2], "three"]])
+def test_iter_value_of_list(name, results):
+    items = codec.iter_value(codec.encode_value(results, name))
+    assert not isinstance(items, list)
+    assert list(items) == results
+
+@pytest.mark.parametrize("name", ["json", "zlib", "msgpack"])
+def test_iter_value_of_dict(name):
+    results = {"graph": "/jobs/1/graph", "artifact": None}
+    assert codec.iter_value(codec.encode_value(results, name)) == results
+
+def test_iter_value_decodes_lazily():
+    items = codec.iter_value(codec.encode_value([{'id': 0}, {'id': 1}], "msgpack"))
+    assert next(items) == {'id': 0}
+    assert next(items) == {'id': 1}
+    with pytest.raises(StopIteration):
+        next(items)
@@ -0,0 +1,93 @@
+"""
+Author: Christian R. Garcia
+Tests the ETag and Last-Modified handling of GET /jobs/<id>/results, and
+GET /jobs/<id>/graph once its graph is evicted, with Flask's test client,
+against fakeredis, see conftest.py, so no server needs to be running.
+
+Run with "py.test-3 test_conditional.py"
+"""
+import sys
+import os
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from werkzeug.http import http_date
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import api
+import jobs
+
+
+@pytest.fixture
+def client(redis_server):
+    return api.app.test_client()
+
+
+@pytest.fixture
+def local_time(monkeypatch):
+    # Five hours behind utc, so a naive time taken as utc would be off.
+    monkeypatch.setenv("TZ", "EST+5")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def completed_job():
+    jid = json.loads(jobs.add_job("stats", 1750, 1800, None, None))["id"]
+    jobs.start_job("job." + jid)
+    jobs.update_job(jid, "Completed", [{"mean": 1.0}])
+    return jid
+
+
+def test_last_modified_is_utc(local_time):
+    assert api.results_last_modified("Completed", "2020-01-01 12:00:00.500000") == \
+        datetime(2020, 1, 1, 17, tzinfo=timezone.utc)
+    assert api.results_last_modified("Processing", "2020-01-01 12:00:00") is None
+
+def test_results_tagged(client, local_time):
+    jid = completed_job()
+    response = client.get("/jobs/{}/results".format(jid))
+    assert response.status_code == 200
+    assert response.get_json() == [{"mean": 1.0}]
+    status, updated_time = jobs.get_job_state(jid)
+    updated = datetime.fromisoformat(updated_time).astimezone(timezone.utc)
+    assert response.headers["Last-Modified"] == http_date(updated.replace(microsecond=0))
+    assert response.headers["ETag"] == '"{}"'.format(api.results_etag(status, updated_time, None))
+    assert response.headers["Cache-Control"] == "no-cache"
+
+def test_results_not_modified(client, local_time):
+    jid = completed_job()
+    path = "/jobs/{}/results".format(jid)
+    response = client.get(path)
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get(path, headers={"If-Modified-Since": last_modified}).status_code == 304
+    earlier = datetime.now(timezone.utc) - timedelta(hours=1)
+    assert client.get(path, headers={"If-Modified-Since": http_date(earlier)}).status_code == 200
+    # If-None-Match wins over If-Modified-Since.
+    assert client.get(path, headers={"If-None-Match": '"other"',
+                                     "If-Modified-Since": last_modified}).status_code == 200
+
+def test_results_of_unfinished_job(client):
+    jid = json.loads(jobs.add_job("stats", 1750, 1800, None, None))["id"]
+    path = "/jobs/{}/results".format(jid)
+    response = client.get(path)
+    assert response.get_json() == "Your job is not yet completed."
+    assert "Last-Modified" not in response.headers
+    assert client.get(path, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    jobs.start_job("job." + jid)
+    assert client.get(path, headers={"If-None-Match": response.headers["ETag"]}).status_code == 200
+
+def test_evicted_graph_job_is_released(client):
+    jid = json.loads(jobs.add_job("graph", 1750, 1800, None, None))["id"]
+    jobs.start_job("job." + jid)
+    jobs.update_job(jid, "Completed", {"graph": "/jobs/{}/graph".format(jid),
+                                       "artifact": "0" * 64})
+    assert json.loads(jobs.add_job("graph", 1750, 1800, None, None))["id"] == jid
+    assert client.get("/jobs/{}/graph".format(jid)).status_code == 410
+    assert json.loads(jobs.add_job("graph", 1750, 1800, None, None))["id"] != jid
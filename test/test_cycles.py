@@ -0,0 +1,45 @@
+"""
+Author: Christian R. Garcia
+Tests the solar cycle analysis on a synthetic cycle and on the
+sunspots.csv data, whose cycle minima are well known.
+
+Run with "py.test-3 test_cycles.py"
+"""
+import sys
+import os
+import numpy as np
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+from cycles import analyze_cycles
+CSV_FILE = CODE_DIR + "/../src/sunspots.csv"
+
+
+def test_monthly_sine_period():
+    years = np.arange(1750, 2020, 1 / 12)
+    spots = (100 + 90 * np.sin(2 * np.pi * years / 11.1)).astype(int)
+    results = analyze_cycles(years, spots)
+    assert abs(results["dominant period"] - 11.1) < 0.3
+    assert abs(results["mean cycle length"] - 11.1) < 0.3
+    assert len(results["cycles"]) == 24
+
+def test_csv_cycle_minima():
+    data = np.loadtxt(CSV_FILE, delimiter=',', dtype=int)
+    results = analyze_cycles(data[:, 0], data[:, 1])
+    assert 10 < results["dominant period"] < 12.5
+    starts = [cycle["start"] for cycle in results["cycles"]]
+    for known in [1775, 1784, 1798, 1810, 1823, 1833, 1843, 1856]:
+        assert min(abs(start - known) for start in starts) <= 1
+
+def test_repeated_years_are_averaged():
+    data = np.loadtxt(CSV_FILE, delimiter=',', dtype=int)
+    years = np.repeat(data[:, 0], 2)
+    spots = np.repeat(data[:, 1], 2)
+    assert analyze_cycles(years, spots) == analyze_cycles(data[:, 0], data[:, 1])
+
+def test_too_short():
+    results = analyze_cycles([1800, 1801], [3, 4])
+    assert results["dominant period"] is None
+    assert results["cycles"] == []
+    assert analyze_cycles([], [])["points"] == 0
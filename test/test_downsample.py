@@ -0,0 +1,53 @@
+"""
+Author: Christian R. Garcia
+Tests downsampling keeps end points, extremes, and the point budget.
+
+Run with "py.test-3 test_downsample.py"
+"""
+import sys
+import os
+import numpy as np
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+from downsample import downsample, lttb, minmax
+
+
+@pytest.fixture(scope="module")
+def series():
+    rng = np.random.default_rng(18)
+    years = np.arange(1000, 1000 + 5000)
+    return years, rng.integers(0, 250, len(years))
+
+@pytest.mark.parametrize("points", [3, 10, 640, 4999])
+def test_lttb_budget(series, points):
+    years, spots = series
+    kept = lttb(years, spots, points)
+    assert len(kept) == points
+    assert kept[0] == 0 and kept[-1] == len(years) - 1
+    assert np.all(np.diff(kept) > 0)
+
+@pytest.mark.parametrize("points", [4, 11, 640])
+def test_minmax_keeps_extremes(series, points):
+    _, spots = series
+    kept = minmax(spots, points)
+    assert len(kept) <= points
+    assert np.all(np.diff(kept) > 0)
+    assert spots[kept].max() == spots.max() and spots[kept].min() == spots.min()
+
+def test_lttb_keeps_spike():
+    years = np.arange(1000)
+    spots = np.zeros(1000, dtype=np.int64)
+    spots[437] = 500
+    assert 437 in lttb(years, spots, 20)
+
+def test_short_series_untouched(series):
+    years, spots = series
+    assert downsample(years[:50], spots[:50], 640).tolist() == list(range(50))
+    assert downsample(years[:50], spots[:50], 640, "minmax").tolist() == list(range(50))
+
+def test_unknown_method(series):
+    with pytest.raises(ValueError):
+        downsample(*series, 10, "every_nth")
@@ -0,0 +1,227 @@
+"""
+Author: Christian R. Garcia
+Tests file_ops' merging of new rows into redis, the snapshot's deltas,
+and the change log's compaction into the csv, against fakeredis, see
+conftest.py, with the csv and change log in a temporary directory.
+
+Run with "py.test-3 test_file_ops.py"
+"""
+import sys
+import os
+import json
+from threading import Thread
+from time import sleep
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import api
+import file_ops
+import get_db_data as gdd
+from spots_data import SpotsData
+
+
+@pytest.fixture
+def spots(redis_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(file_ops, "CSV_LOC", str(tmp_path / "sunspots.csv"))
+    monkeypatch.setattr(file_ops, "LOG_LOC", str(tmp_path / "sunspots.log"))
+    monkeypatch.setattr(gdd, "_DATASET", (None, SpotsData.from_columns([], [])))
+    with open(file_ops.CSV_LOC, 'w') as csv_file:
+        csv_file.write("1700,5\n1701,11\n1702,16\n")
+    file_ops.init_db_data()
+    return tmp_path
+
+
+def rows(data):
+    return list(zip(data.years.tolist(), data.spots.tolist()))
+
+
+def group_commit(monkeypatch, batches):
+    """
+    Calls update_redis_and_csv with each of batches on its own thread,
+    with the leader's GROUP_COMMIT_WINDOW lasting until every batch is
+    pending. Returns list of what each call raised, None if nothing.
+    """
+    monkeypatch.setattr(file_ops, "GROUP_COMMIT_WINDOW", 5)
+
+    def window(seconds):
+        for _ in range(500):
+            if len(file_ops.PENDING_BATCHES) == len(batches):
+                return
+            sleep(0.01)
+
+    monkeypatch.setattr(file_ops, "sleep", window)
+    errors = [None] * len(batches)
+
+    def call(index):
+        try:
+            file_ops.update_redis_and_csv(batches[index])
+        except Exception as error:
+            errors[index] = error
+
+    threads = [Thread(target=call, args=(index,)) for index in range(len(batches))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert file_ops.PENDING_BATCHES == []
+    return errors
+
+
+def records():
+    _, years, spots = gdd._get_records_columns()
+    return rows(SpotsData.from_columns(years, spots))
+
+
+def test_write_adds_delta(spots):
+    snapshot = file_ops.SPOTS_DB.get(gdd.SNAPSHOT_KEY)
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 1}])
+    file_ops.update_redis_and_csv([{'year': 1703, 'spots': 2}, {'year': 1699, 'spots': 3}])
+    assert file_ops.SPOTS_DB.get(gdd.SNAPSHOT_KEY) == snapshot
+    assert file_ops.SPOTS_DB.llen(gdd.DELTA_KEY) == 2
+    expected = [(1699, 3), (1700, 5), (1701, 11), (1701, 1), (1702, 16), (1703, 2)]
+    assert rows(gdd.get_dataset()[1]) == expected
+    assert records() == expected
+
+def test_deltas_keep_order_of_repeated_years(spots):
+    for spot in range(5):
+        file_ops.update_redis_and_csv([{'year': 1701, 'spots': 100 + spot},
+                                       {'year': 1700, 'spots': 200 + spot}])
+    _, data = gdd.use_snapshot(gdd.get_data_version(), file_ops.SPOTS_DB.get(gdd.SNAPSHOT_KEY),
+                               file_ops.SPOTS_DB.lrange(gdd.DELTA_KEY, 0, -1))
+    expected = ([(1700, 5)] + [(1700, 200 + spot) for spot in range(5)] + [(1701, 11)]
+                + [(1701, 100 + spot) for spot in range(5)] + [(1702, 16)])
+    assert rows(data) == expected
+    assert records() == expected
+
+def test_fold_snapshot(spots):
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 1}])
+    version, data = gdd.get_dataset()
+    assert file_ops.fold_snapshot()
+    assert not file_ops.fold_snapshot()
+    assert file_ops.SPOTS_DB.llen(gdd.DELTA_KEY) == 0
+    assert gdd.get_data_version() == version
+    _, folded = gdd.use_snapshot(version, file_ops.SPOTS_DB.get(gdd.SNAPSHOT_KEY))
+    assert rows(folded) == rows(data)
+
+def test_full_write_clears_deltas(spots):
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 1}])
+    file_ops.init_db_data()
+    assert file_ops.SPOTS_DB.llen(gdd.DELTA_KEY) == 0
+    assert rows(gdd.get_dataset()[1]) == [(1700, 5), (1701, 11), (1701, 1), (1702, 16)]
+
+def crash(digest):
+    raise OSError("crashed before the log was reset")
+
+def read_csv():
+    return file_ops.read_rows(file_ops.CSV_LOC)
+
+def test_compact_merges_in_order(spots):
+    file_ops.update_redis_and_csv([{'year': 1703, 'spots': 2}, {'year': 1701, 'spots': 1}])
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 7}, {'year': 1699, 'spots': 3}])
+    assert file_ops.compact_csv()
+    expected = [(1699, 3), (1700, 5), (1701, 11), (1701, 1), (1701, 7), (1702, 16), (1703, 2)]
+    assert read_csv() == expected
+    assert file_ops.read_change_log() == []
+    assert not file_ops.compact_csv()
+    assert read_csv() == expected
+
+def test_log_replayed_on_init(spots):
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 1}])
+    file_ops.init_db_data()
+    assert rows(gdd.get_dataset()[1]) == [(1700, 5), (1701, 11), (1701, 1), (1702, 16)]
+
+def test_compaction_stopped_before_log_reset(spots, monkeypatch):
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 1}, {'year': 1701, 'spots': 1}])
+    expected = [(1700, 5), (1701, 11), (1701, 1), (1701, 1), (1702, 16)]
+    with monkeypatch.context() as patch:
+        patch.setattr(file_ops, "reset_change_log", crash)
+        with pytest.raises(OSError):
+            file_ops.compact_csv()
+    assert read_csv() == expected
+    assert file_ops.read_change_log() is None
+
+    file_ops.init_db_data()
+    assert rows(gdd.get_dataset()[1]) == expected
+    assert file_ops.read_change_log() == []
+    file_ops.update_redis_and_csv([{'year': 1704, 'spots': 4}])
+    assert file_ops.compact_csv()
+    assert read_csv() == expected + [(1704, 4)]
+
+def test_compaction_resets_stale_log(spots, monkeypatch):
+    file_ops.update_redis_and_csv([{'year': 1701, 'spots': 1}])
+    with monkeypatch.context() as patch:
+        patch.setattr(file_ops, "reset_change_log", crash)
+        with pytest.raises(OSError):
+            file_ops.compact_csv()
+    assert not file_ops.compact_csv()
+    assert read_csv() == [(1700, 5), (1701, 11), (1701, 1), (1702, 16)]
+    assert file_ops.read_change_log() == []
+
+def test_legacy_log_replayed(spots):
+    with open(file_ops.LOG_LOC, 'w') as log_file:
+        log_file.write("1701,1\n")
+    file_ops.init_db_data()
+    assert rows(gdd.get_dataset()[1]) == [(1700, 5), (1701, 11), (1701, 1), (1702, 16)]
+    assert file_ops.compact_csv()
+    assert read_csv() == [(1700, 5), (1701, 11), (1701, 1), (1702, 16)]
+
+def test_current_dataset_honours_data_cache(spots, monkeypatch):
+    assert rows(gdd.current_dataset()) == [(1700, 5), (1701, 11), (1702, 16)]
+    # Written behind the cache's back, without bumping the version.
+    file_ops.SPOTS_DB.hset(gdd.RECORDS_KEY, 0, "1700,6")
+    assert rows(gdd.current_dataset()) == [(1700, 5), (1701, 11), (1702, 16)]
+    monkeypatch.setattr(gdd, "DATA_CACHE", False)
+    assert rows(gdd.current_dataset()) == [(1700, 6), (1701, 11), (1702, 16)]
+
+def test_post_rejects_out_of_range_rows(spots):
+    client = api.app.test_client()
+    for row, message in (({'year': 2 ** 63, 'spots': 1}, "'year' must be a postive int"),
+                         ({'year': 1701, 'spots': 2 ** 70}, "'spots' must be a postive int"),
+                         ({'year': 1701, 'spots': 2 ** 31}, "'spots' must be a postive int")):
+        response = client.post("/spots", data=json.dumps([row]))
+        assert response.status_code == 400
+        assert message in response.get_json()
+    assert client.post("/spots", data=json.dumps([{'year': 1701, 'spots': 1}])).status_code == 200
+    assert rows(gdd.get_dataset()[1]) == [(1700, 5), (1701, 11), (1701, 1), (1702, 16)]
+
+def test_redis_losing_data_changes_version(spots):
+    version, _ = gdd.get_dataset()
+    file_ops.SPOTS_DB.flushdb()
+    with open(file_ops.CSV_LOC, 'a') as csv_file:
+        csv_file.write("1703,20\n")
+    file_ops.init_db_data()
+    # The counter starts over at the same value, the epoch does not.
+    assert gdd.get_data_version().split(".")[1] == version.split(".")[1]
+    assert gdd.get_data_version() != version
+    assert rows(gdd.get_dataset()[1]) == [(1700, 5), (1701, 11), (1702, 16), (1703, 20)]
+
+def test_group_commit_coalesces(spots, monkeypatch):
+    appended = []
+    append_change_log = file_ops.append_change_log
+
+    def record_append(new_data):
+        appended.append(new_data)
+        append_change_log(new_data)
+
+    monkeypatch.setattr(file_ops, "append_change_log", record_append)
+    batches = [[{'year': 1710 + index, 'spots': index}] for index in range(4)]
+    assert group_commit(monkeypatch, batches) == [None] * 4
+    assert file_ops.SPOTS_DB.llen(gdd.DELTA_KEY) == 1
+    assert len(appended) == 1
+    assert sorted(row['year'] for row in appended[0]) == [1710, 1711, 1712, 1713]
+    expected = [(1700, 5), (1701, 11), (1702, 16)] + [(1710 + index, index) for index in range(4)]
+    assert rows(gdd.get_dataset()[1]) == expected
+    assert records() == expected
+
+def test_group_commit_error_reaches_every_caller(spots, monkeypatch):
+    def fail(new_data):
+        raise RuntimeError("Could not merge new data")
+
+    monkeypatch.setattr(file_ops, "commit_rows", fail)
+    errors = group_commit(monkeypatch, [[{'year': 1710 + index, 'spots': index}]
+                                        for index in range(3)])
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert file_ops.SPOTS_DB.llen(gdd.DELTA_KEY) == 0
@@ -0,0 +1,112 @@
+"""
+Author: Christian R. Garcia
+Tests get_db_data's binary search and slicing against the original
+linear scan for every start, end, limit, and offset combination.
+Uses the sunspots.csv data plus some repeated years, no redis needed.
+
+Run with "py.test-3 test_get_db_data.py"
+"""
+import sys
+import os
+import itertools
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import get_db_data as gdd
+from spots_data import SpotsData
+CSV_FILE = CODE_DIR + "/../src/sunspots.csv"
+
+
+def load_dataset():
+    rows = []
+    with open(CSV_FILE) as csv_file:
+        for line in csv_file:
+            year, spots = line.split(',')
+            rows.append((int(year), int(spots)))
+    rows += [(1771, 5), (1771, 6), (1800, 0), (1869, 12)]
+    rows.sort(key=lambda row: row[0])
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def linear_get_db_data(years, spots, start, end, limit, offset):
+    data_list = []
+    limit_counter = 0
+    for index, year in enumerate(years):
+        if start is not None or end is not None:
+            if start is None:
+                if year <= end:
+                    data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+            elif end is None:
+                if year >= start:
+                    data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+            elif year >= start and year <= end:
+                data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+        elif limit is not None or offset is not None:
+            if limit is None:
+                if index >= offset:
+                    data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+            elif offset is None:
+                if limit_counter < limit:
+                    data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+                    limit_counter += 1
+            elif index >= offset and limit_counter < limit:
+                data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+                limit_counter += 1
+        else:
+            data_list.append({'id': index, 'year': year, 'spots': spots[index]})
+    return data_list
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return load_dataset()
+
+@pytest.fixture
+def cached(dataset, monkeypatch):
+    monkeypatch.setattr(gdd, "DATA_CACHE", True)
+    monkeypatch.setattr(gdd, "get_dataset",
+                        lambda: (1, SpotsData.from_columns(dataset[0], dataset[1])))
+    return dataset
+
+
+YEAR_BOUNDS = [None, 0, 1769, 1770, 1771, 1772, 1800, 1801, 1835, 1868, 1869, 1870, 3000]
+COUNT_BOUNDS = [None, 0, 1, 2, 3, 50, 102, 103, 104, 105, 500]
+
+def test_year_ranges_match_linear(cached):
+    years, spots = cached
+    for start, end in itertools.product(YEAR_BOUNDS, YEAR_BOUNDS):
+        assert gdd.get_db_data(start, end, None, None) ==\
+                linear_get_db_data(years, spots, start, end, None, None)
+
+def test_limit_offset_match_linear(cached):
+    years, spots = cached
+    for limit, offset in itertools.product(COUNT_BOUNDS, COUNT_BOUNDS):
+        assert gdd.get_db_data(None, None, limit, offset) ==\
+                linear_get_db_data(years, spots, None, None, limit, offset)
+
+def test_mixed_arguments_match_linear(cached):
+    years, spots = cached
+    for start, end, limit, offset in itertools.product(YEAR_BOUNDS, YEAR_BOUNDS,
+                                                       COUNT_BOUNDS[:4], COUNT_BOUNDS[:4]):
+        assert gdd.get_db_data(start, end, limit, offset) ==\
+                linear_get_db_data(years, spots, start, end, limit, offset)
+
+def test_columnar_matches_list(cached):
+    for start, end in itertools.product(YEAR_BOUNDS, YEAR_BOUNDS):
+        data = gdd.get_db_data(start, end, None, None, columnar=True)
+        assert isinstance(data, SpotsData)
+        assert data.to_list() == gdd.get_db_data(start, end, None, None)
+
+def test_columnar_where(cached):
+    data = gdd.get_db_data(None, None, None, None, columnar=True)
+    busy = data.where(data.spots > 100)
+    assert busy.to_list() == [dict_x for dict_x in data.to_list() if dict_x['spots'] > 100]
+
+def test_empty_dataset(monkeypatch):
+    monkeypatch.setattr(gdd, "DATA_CACHE", True)
+    monkeypatch.setattr(gdd, "get_dataset", lambda: (0, SpotsData.from_columns([], [])))
+    assert gdd.get_db_data(None, None, None, None) == []
+    assert gdd.get_db_data(1800, 1900, None, None) == []
+    assert gdd.get_db_data(None, None, 5, 2) == []
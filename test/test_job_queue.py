@@ -0,0 +1,137 @@
+"""
+Author: Christian R. Garcia
+Tests JobQueue's priority and weighted fair share scheduling, run by its
+Lua scripts, against fakeredis, see conftest.py.
+
+Run with "py.test-3 test_job_queue.py"
+"""
+import sys
+import os
+from threading import Thread
+from time import sleep
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+from job_queue import JobQueue, PUSH_CHUNK
+
+
+@pytest.fixture
+def queue(redis_server):
+    return JobQueue("test_queue", 0)
+
+
+def drain(queue):
+    job_keys = []
+    while True:
+        job_key = queue.get()
+        if job_key is None:
+            return job_keys
+        job_keys.append(job_key)
+
+
+def test_empty_get(queue):
+    assert queue.get() is None
+    assert len(queue) == 0
+
+def test_strict_priority(queue):
+    queue.put("low", priority=0)
+    queue.put("middle", priority=5)
+    queue.put("high", priority=9)
+    assert drain(queue) == ["high", "middle", "low"]
+
+def test_priority_beats_fair_share(queue):
+    queue.put(*["a{}".format(i) for i in range(3)], priority=1, client="a")
+    queue.put("b0", priority=0, client="b")
+    assert drain(queue) == ["a0", "a1", "a2", "b0"]
+
+def test_fifo_within_priority(queue):
+    job_keys = ["job.{}".format(i) for i in range(20)]
+    for job_key in job_keys:
+        queue.put(job_key, priority=3)
+    assert len(queue) == 20
+    assert drain(queue) == job_keys
+    assert len(queue) == 0
+
+def test_equal_share_alternates(queue):
+    queue.put(*["a{}".format(i) for i in range(4)], client="a")
+    queue.put(*["b{}".format(i) for i in range(4)], client="b")
+    served = drain(queue)
+    assert served[:2] in (["a0", "b0"], ["b0", "a0"])
+    assert [key for key in served if key[0] == "a"] == ["a0", "a1", "a2", "a3"]
+    assert [key for key in served if key[0] == "b"] == ["b0", "b1", "b2", "b3"]
+
+def test_weighted_share(queue):
+    queue.put(*["a{}".format(i) for i in range(60)], client="a", weight=3)
+    queue.put(*["b{}".format(i) for i in range(60)], client="b", weight=1)
+    first = [queue.get() for _ in range(40)]
+    assert sum(key[0] == "a" for key in first) == 30
+    assert sum(key[0] == "b" for key in first) == 10
+
+def test_idle_client_banks_no_turns(queue):
+    queue.put(*["a{}".format(i) for i in range(10)], client="a")
+    for _ in range(8):
+        queue.get()
+    queue.put(*["b{}".format(i) for i in range(10)], client="b")
+    served = [queue.get() for _ in range(4)]
+    assert sum(key[0] == "a" for key in served) == 2
+
+def test_drained_clients_leave_no_state(queue):
+    for client in ("a", "b", "c"):
+        queue.put(client + "0", priority=1, client=client, weight=2)
+        queue.put(client + "1", priority=5, client=client, weight=2)
+    queue.get()
+    assert queue.redis.hlen("test_queue.queued") == 3
+    drain(queue)
+    assert not queue.redis.exists("test_queue.weights", "test_queue.queued",
+                                  "test_queue.p1.pass", "test_queue.p5.pass")
+
+def test_move_to_higher_priority(queue):
+    queue.put("a0", "a1", priority=1, client="a")
+    queue.put("b0", priority=5, client="b")
+    assert queue.move("a1", 1, 9, client="a")
+    assert len(queue) == 3
+    assert drain(queue) == ["a1", "b0", "a0"]
+
+def test_move_left_queue(queue):
+    queue.put("a0", priority=1)
+    assert queue.get() == "a0"
+    assert not queue.move("a0", 1, 9)
+    assert queue.get() is None
+
+def test_move_last_of_priority(queue):
+    queue.put("a0", priority=1, client="a")
+    assert queue.move("a0", 1, 9, client="a")
+    queue.put("b0", priority=1, client="b")
+    assert drain(queue) == ["a0", "b0"]
+
+def test_chunked_push(queue):
+    job_keys = ["job.{}".format(i) for i in range(2 * PUSH_CHUNK + 7)]
+    queue.put(*job_keys, priority=2, client="bulk")
+    assert len(queue) == len(job_keys)
+    assert drain(queue) == job_keys
+
+def test_blocking_get_times_out(queue):
+    assert queue.get(block=True, timeout=1) is None
+
+def test_blocking_get_wakes_on_put(queue):
+    got = []
+    getter = Thread(target=lambda: got.append(queue.get(block=True, timeout=5)))
+    getter.start()
+    sleep(0.2)
+    queue.put("job.late")
+    getter.join(6)
+    assert got == ["job.late"]
+
+def test_blocking_gets_all_woken(queue):
+    got = []
+    getters = [Thread(target=lambda: got.append(queue.get(block=True, timeout=5)))
+               for _ in range(3)]
+    for getter in getters:
+        getter.start()
+    sleep(0.2)
+    queue.put("job.1", "job.2", "job.3")
+    for getter in getters:
+        getter.join(6)
+    assert sorted(got) == ["job.1", "job.2", "job.3"]
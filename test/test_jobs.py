@@ -0,0 +1,253 @@
+"""
+Author: Christian R. Garcia
+Tests jobs, against fakeredis where it needs redis, see conftest.py.
+
+Run with "py.test-3 test_jobs.py"
+"""
+import sys
+import os
+import asyncio
+import pickle
+import json
+from threading import Thread
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import jobs
+
+
+def test_client_weights_parse():
+    assert jobs._parse_client_weights("dashboard=4, sweeps=0.5") == {"dashboard": 4.0,
+                                                                     "sweeps": 0.5}
+
+def test_client_weights_empty():
+    assert jobs._parse_client_weights("") == {}
+    assert jobs._parse_client_weights(" , ,") == {}
+
+def test_client_weights_skip_malformed():
+    assert jobs._parse_client_weights("a,a=b=c,b=x,=2,c=3") == {"c": 3.0}
+
+def test_client_weights_skip_not_positive():
+    assert jobs._parse_client_weights("a=0,b=-1,c=nan,d=inf,e=2") == {"e": 2.0}
+
+def test_client_id_only_for_weighted_clients(monkeypatch):
+    import api
+    monkeypatch.setattr(jobs, "CLIENT_WEIGHTS", {"dashboard": 4.0})
+    for header, client in (("dashboard", "dashboard"), ("made-up", "10.0.0.1"), (None, "10.0.0.1")):
+        headers = {"X-Client-Id": header} if header else {}
+        with api.app.test_request_context(headers=headers,
+                                          environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+            assert api.get_client() == client
+
+def test_legacy_message_job_key():
+    assert jobs._load_legacy_message(pickle.dumps("job.1234")) == "job.1234"
+
+def test_legacy_message_rejects_other_values():
+    assert jobs._load_legacy_message(pickle.dumps(["job.1234"])) is None
+    assert jobs._load_legacy_message(pickle.dumps("not a job")) is None
+    assert jobs._load_legacy_message(b"garbage") is None
+
+def test_legacy_message_rejects_globals():
+    assert jobs._load_legacy_message(pickle.dumps(os.getcwd)) is None
+    # What a crafted message calling os.system would look like.
+    assert jobs._load_legacy_message(b"cos\nsystem\n(S'true'\ntR.") is None
+
+
+def test_start_and_update_job(redis_server):
+    job_dict = json.loads(jobs.add_job("stats", 1750, 1800, None, None, client="tests"))
+    job_key = "job." + job_dict["id"]
+    started = jobs.start_job(job_key)
+    assert started["status"] == "Processing"
+    assert started["work type"] == "stats"
+    assert jobs.get_jobs(status="Processing")[0][0]["id"] == job_dict["id"]
+    jobs.update_job(job_dict["id"], "Completed", [{"mean": 1.0}])
+    assert jobs.get_job(job_dict["id"])["status"] == "Completed"
+    assert jobs.get_jobs(status="Processing")[0] == []
+    assert jobs.get_jobs(status="Completed", work_type="stats")[0][0]["id"] == job_dict["id"]
+    assert jobs.get_job_results(job_dict["id"]) == [{"mean": 1.0}]
+
+def test_start_missing_job(redis_server):
+    with pytest.raises(KeyError):
+        jobs.start_job("job.missing")
+
+def test_identical_jobs_share_one_job(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    other = json.loads(jobs.add_job("data", 1750, 1801, None, None))
+    assert again["id"] == first["id"]
+    assert other["id"] != first["id"]
+    assert len(jobs.work_queue("data")) == 2
+
+def test_concurrent_identical_jobs_share_one_job(redis_server):
+    ids = []
+    def submit():
+        ids.append(json.loads(jobs.add_job("data", 1700, 1900, None, None))["id"])
+    threads = [Thread(target=submit) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(ids)) == 1
+    assert len(jobs.work_queue("data")) == 1
+
+def test_batch_reuses_repeats(redis_server):
+    first = json.loads(jobs.add_job("stats", 1750, 1800, None, None))
+    specs = [{"work type": "stats", "start": 1750, "end": 1800, "limit": None, "offset": None},
+             {"work type": "stats", "start": 1700, "end": 1800, "limit": None, "offset": None},
+             {"work type": "stats", "start": 1700, "end": 1800, "limit": None, "offset": None}]
+    ids = jobs.add_jobs(specs)
+    assert ids[0] == first["id"]
+    assert ids[1] == ids[2] != ids[0]
+    assert len(jobs.work_queue("stats")) == 2
+
+def test_cached_job_gone_is_replaced(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    jobs.JOB_DB.delete("job." + first["id"])
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    assert again["id"] != first["id"]
+    assert jobs.get_job(again["id"])["status"] == "Submitted"
+
+def test_failed_job_is_not_reused(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    jobs.start_job("job." + first["id"])
+    jobs.update_job(first["id"], "Failed")
+    assert "cache key" not in jobs.get_job(first["id"])
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    assert again["id"] != first["id"]
+    assert json.loads(jobs.add_job("data", 1750, 1800, None, None))["id"] == again["id"]
+
+def test_failed_job_still_cached_is_replaced(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    # Failed, but its cache entry survived, e.g. a worker died in between.
+    jobs.UPDATE_JOB_SCRIPT(keys=["job." + first["id"], "job." + first["id"] + ".results",
+                                 jobs.JOB_INDEX],
+                           args=[json.dumps("Failed"), json.dumps("2020-01-01 00:00:00"), "", ""])
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    assert again["id"] != first["id"]
+
+def test_stuck_job_is_not_reused(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    jobs.start_job("job." + first["id"])
+    assert json.loads(jobs.add_job("data", 1750, 1800, None, None))["id"] == first["id"]
+    jobs.JOB_DB.hset("job." + first["id"], "updated time", json.dumps("2020-01-01 00:00:00"))
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    assert again["id"] != first["id"]
+
+def test_lost_submitted_job_is_not_reused(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    assert json.loads(jobs.add_job("data", 1750, 1800, None, None))["id"] == first["id"]
+    # Popped by a worker that died before starting it.
+    assert jobs.work_queue("data").get() == "job." + first["id"]
+    jobs.JOB_DB.hset("job." + first["id"], "updated time", json.dumps("2020-01-01 00:00:00"))
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None))
+    assert again["id"] != first["id"]
+    assert jobs.work_queue("data").get() == "job." + again["id"]
+
+def test_resubmit_raises_priority(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None, priority=1, client="a"))
+    other = json.loads(jobs.add_job("data", 1700, 1800, None, None, priority=5, client="b"))
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None, priority=9, client="b"))
+    assert again["id"] == first["id"]
+    assert again["priority"] == 9
+    assert jobs.get_job(first["id"])["priority"] == 9
+    assert len(jobs.work_queue("data")) == 2
+    assert jobs.work_queue("data").get() == "job." + first["id"]
+    assert jobs.work_queue("data").get() == "job." + other["id"]
+
+def test_resubmit_lower_priority_keeps_priority(redis_server):
+    first = json.loads(jobs.add_job("data", 1750, 1800, None, None, priority=5))
+    again = json.loads(jobs.add_job("data", 1750, 1800, None, None, priority=1))
+    assert again["id"] == first["id"]
+    assert jobs.get_job(first["id"])["priority"] == 5
+
+def test_batch_repeat_raises_priority(redis_server):
+    spec = {"work type": "stats", "start": 1750, "end": 1800, "limit": None, "offset": None}
+    ids = jobs.add_jobs([dict(spec, priority=1), {**spec, "end": 1801, "priority": 5},
+                         dict(spec, priority=9)])
+    assert ids[0] == ids[2]
+    assert jobs.get_job(ids[0])["priority"] == 9
+    assert jobs.work_queue("stats").get() == "job." + ids[0]
+
+def test_async_reads_match_sync(redis_server):
+    job_dict = json.loads(jobs.add_job("stats", 1750, 1800, None, None))
+    jobs.start_job("job." + job_dict["id"])
+    jobs.update_job(job_dict["id"], "Completed", [{"mean": 1.0}])
+    jobs.add_job("stats", 1700, 1800, None, None)
+
+    async def read():
+        return (await jobs.get_job_async(job_dict["id"]),
+                await jobs.get_job_state_async(job_dict["id"]),
+                await jobs.get_job_results_async(job_dict["id"]),
+                await jobs.get_jobs_async(work_type="stats", count=1))
+    assert asyncio.run(read()) == (jobs.get_job(job_dict["id"]),
+                                   jobs.get_job_state(job_dict["id"]),
+                                   jobs.get_job_results(job_dict["id"]),
+                                   jobs.get_jobs(work_type="stats", count=1))
+
+def test_async_reads_missing_job(redis_server):
+    for read in (jobs.get_job_async, jobs.get_job_state_async, jobs.get_job_results_async):
+        with pytest.raises(KeyError):
+            asyncio.run(read("missing"))
+
+def tied_jobs(number):
+    specs = [{"work type": "data", "start": 1700, "end": 1800 + i, "limit": None, "offset": None}
+             for i in range(number)]
+    ids = jobs.add_jobs(specs)
+    # Jobs submitted at once may share a start time, and so an index score.
+    for jid in ids:
+        jobs.JOB_DB.zadd(jobs.JOB_INDEX, {"job." + jid: 1.5})
+    return ids
+
+def page_through(count, cursor=None, status=None, between=None):
+    seen = []
+    while True:
+        page, cursor = jobs.get_jobs(status=status, cursor=cursor, count=count)
+        seen += [job_dict["id"] for job_dict in page]
+        if cursor is None:
+            return seen
+        if between is not None:
+            between(page)
+
+def test_jobs_pages_through_tied_scores(redis_server):
+    ids = tied_jobs(25)
+    for count in (1, 4, 25, 100):
+        seen = page_through(count)
+        assert sorted(seen) == sorted(ids)
+        assert len(seen) == len(set(seen))
+
+def test_jobs_pages_past_job_leaving_index(redis_server):
+    ids = jobs.add_jobs([{"work type": "data", "start": 1700, "end": 1800 + i,
+                          "limit": None, "offset": None} for i in range(12)])
+    score = jobs.JOB_DB.zscore(jobs.JOB_INDEX, "job." + ids[0])
+    for jid in ids:
+        jobs.JOB_DB.zadd(jobs._index_key("Submitted"), {"job." + jid: score})
+    started = []
+    def start_last(page):
+        started.append(page[-1]["id"])
+        jobs.start_job("job." + page[-1]["id"])
+    seen = page_through(5, status="Submitted", between=start_last)
+    assert len(started) == 2
+    assert sorted(seen) == sorted(ids)
+
+def test_jobs_cursor(redis_server):
+    tied_jobs(3)
+    page, cursor = jobs.get_jobs(count=2)
+    assert jobs.parse_cursor(cursor) == (1.5, "job." + page[-1]["id"])
+    assert asyncio.run(jobs.get_jobs_async(cursor=cursor, count=2)) == \
+        jobs.get_jobs(cursor=cursor, count=2)
+    # Bare scores from older versions still page, exclusive of the score.
+    assert jobs.get_jobs(cursor="1.5") == ([], None)
+    assert jobs.parse_cursor("1.5") == (1.5, None)
+    for cursor in ("x", "1.5_x", "_job.1"):
+        with pytest.raises(ValueError):
+            jobs.parse_cursor(cursor)
+
+def test_batch_jobs_have_distinct_scores(redis_server):
+    specs = [{"work type": "data", "start": 1700, "end": 1800 + i, "limit": None, "offset": None}
+             for i in range(250)]
+    ids = jobs.add_jobs(specs)
+    scores = jobs.JOB_DB.zrange(jobs.JOB_INDEX, 0, -1, withscores=True)
+    assert len({score for _, score in scores}) == len(ids)
+    assert page_through(100) == ids[::-1]
@@ -0,0 +1,59 @@
+"""
+Author: Christian R. Garcia
+Tests the wavelet matrix k-th smallest queries against sorting each range,
+and that medians and percentiles from it match the sorting path.
+
+Run with "py.test-3 test_order_stats.py"
+"""
+import sys
+import os
+import random
+import numpy as np
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+from order_stats import WaveletMatrix
+from stats_engine import describe
+CSV_FILE = CODE_DIR + "/../src/sunspots.csv"
+
+
+def csv_spots():
+    return [int(line.split(',')[1]) for line in open(CSV_FILE)]
+
+def test_kth_smallest_matches_sort():
+    rng = random.Random(13)
+    for _ in range(100):
+        spots = [rng.randint(0, rng.choice([1, 2, 9, 300])) for _ in range(rng.randint(1, 40))]
+        matrix = WaveletMatrix(spots)
+        for first in range(len(spots)):
+            for last in range(first + 1, len(spots) + 1):
+                ordered = sorted(spots[first:last])
+                for k, value in enumerate(ordered):
+                    assert matrix.kth_smallest(first, last, k) == value
+
+def test_kth_smallest_out_of_range():
+    matrix = WaveletMatrix([3, 1, 2])
+    try:
+        matrix.kth_smallest(0, 2, 2)
+        assert False
+    except IndexError:
+        pass
+
+def test_describe_with_wavelet_matches_sort():
+    spots = csv_spots()
+    matrix = WaveletMatrix(spots)
+    for first in range(0, len(spots), 9):
+        for last in range(first + 1, len(spots) + 1, 4):
+            assert describe(spots[first:last], kth=matrix.ranked(first, last)) ==\
+                    describe(spots[first:last])
+
+def test_percentiles_match_numpy():
+    spots = csv_spots()
+    matrix = WaveletMatrix(spots)
+    requested = [0, 10, 25, 50, 62.5, 90, 99, 100]
+    for first, last in [(0, len(spots)), (5, 6), (10, 35), (40, 99)]:
+        stats = describe(spots[first:last], kth=matrix.ranked(first, last), requested=requested)
+        expected = np.percentile(spots[first:last], requested)
+        for percent, value in zip(requested, expected):
+            assert abs(stats[-1]["percentiles"][str(percent)] - value) < 1e-9
@@ -0,0 +1,40 @@
+"""
+Author: Christian R. Garcia
+Tests the sliding window aggregates against recomputing every window.
+
+Run with "py.test-3 test_rolling.py"
+"""
+import sys
+import os
+import random
+import statistics
+import numpy as np
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+from rolling import rolling
+
+
+@pytest.fixture(scope="module")
+def series():
+    rng = random.Random(15)
+    return [rng.randint(0, 250) for _ in range(120)]
+
+@pytest.mark.parametrize("window", [1, 2, 3, 13, 50, 120])
+def test_matches_each_window(series, window):
+    windows = [series[first:first + window] for first in range(len(series) - window + 1)]
+    assert rolling(series, window, "min").tolist() == [min(chunk) for chunk in windows]
+    assert rolling(series, window, "max").tolist() == [max(chunk) for chunk in windows]
+    assert np.allclose(rolling(series, window, "mean"), [statistics.mean(chunk) for chunk in windows])
+    if window > 1:
+        assert np.allclose(rolling(series, window, "std"),
+                           [statistics.stdev(chunk) for chunk in windows])
+
+def test_window_too_long(series):
+    assert len(rolling(series, len(series) + 1, "mean")) == 0
+
+def test_unknown_aggregate(series):
+    with pytest.raises(ValueError):
+        rolling(series, 3, "median")
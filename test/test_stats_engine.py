@@ -0,0 +1,111 @@
+"""
+Author: Christian R. Garcia
+Tests stats_engine.describe against the 'statistics' calls the stats
+worker used to make, on the sunspots.csv data and random ranges.
+
+Run with "py.test-3 test_stats_engine.py"
+"""
+import sys
+import os
+import random
+import statistics
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+from stats_engine import describe, RangeAggregates
+CSV_FILE = CODE_DIR + "/../src/sunspots.csv"
+
+
+def statistics_list(sun_data):
+    return [
+        {"mean": statistics.mean(sun_data)},
+        {"harmonic mean": statistics.harmonic_mean(sun_data)},
+        {"median": statistics.median(sun_data)},
+        {"low median": statistics.median_low(sun_data)},
+        {"high median": statistics.median_high(sun_data)},
+        {"mode": statistics.mode(sun_data)},
+        {"variance": statistics.variance(sun_data)},
+        {"standard deviation": statistics.stdev(sun_data)},]
+
+def assert_same(result, expected):
+    assert result == expected
+    for got, want in zip(result, expected):
+        for key in want:
+            assert type(got[key]) is type(want[key])
+
+
+@pytest.fixture(scope="module")
+def csv_spots():
+    return [int(line.split(',')[1]) for line in open(CSV_FILE)]
+
+def test_csv_matches_statistics(csv_spots):
+    assert_same(describe(csv_spots), statistics_list(csv_spots))
+
+def test_csv_windows_match_statistics(csv_spots):
+    for first in range(0, len(csv_spots), 7):
+        for last in range(first + 2, len(csv_spots) + 1, 5):
+            window = csv_spots[first:last]
+            assert_same(describe(window), statistics_list(window))
+
+def test_random_matches_statistics():
+    rng = random.Random(11)
+    for _ in range(300):
+        size = rng.randint(2, 60)
+        sun_data = [rng.randint(1, rng.choice([3, 20, 400])) for _ in range(size)]
+        assert_same(describe(sun_data), statistics_list(sun_data))
+
+def test_exact_variance_is_int():
+    assert_same(describe([1, 3, 5]), statistics_list([1, 3, 5]))
+
+def test_mode_ties_take_first_seen():
+    assert describe([5, 2, 2, 5, 1])[5] == {"mode": 5}
+
+def test_single_value():
+    stats = describe([42])
+    assert stats[0] == {"mean": 42}
+    assert stats[1] == {"harmonic mean": 42}
+    assert stats[6] == {"variance": None}
+    assert stats[7] == {"standard deviation": None}
+
+def test_empty_range():
+    assert describe([]) == []
+
+def test_range_aggregates_match_scans(csv_spots):
+    aggregates = RangeAggregates(csv_spots)
+    for first in range(len(csv_spots)):
+        for last in range(first + 1, len(csv_spots) + 1):
+            window = csv_spots[first:last]
+            summary = aggregates.summary(first, last)
+            assert summary["count"] == len(window)
+            assert summary["sum"] == sum(window)
+            assert summary["min"] == min(window)
+            assert summary["max"] == max(window)
+            assert summary["mean"] == statistics.mean(window)
+            if len(window) > 1:
+                assert summary["variance"] == statistics.variance(window)
+                assert summary["standard deviation"] == statistics.stdev(window)
+
+def test_range_aggregates_feed_describe(csv_spots):
+    aggregates = RangeAggregates(csv_spots)
+    assert describe(csv_spots[10:40], aggregates.totals(10, 40)) == describe(csv_spots[10:40])
+
+def test_range_aggregates_empty_range(csv_spots):
+    summary = RangeAggregates(csv_spots).summary(5, 5)
+    assert summary["count"] == 0
+    assert summary["mean"] is None
+
+def test_range_aggregates_large_spots_stay_exact():
+    large = [2_000_000_000, 2_000_000_000, 5, 2_000_000_000, 7]
+    aggregates = RangeAggregates(large)
+    assert aggregates.totals(0, 5) == (sum(large), sum(spot * spot for spot in large))
+    summary = aggregates.summary(0, 5)
+    assert summary["variance"] == statistics.variance(large)
+    assert summary["standard deviation"] == statistics.stdev(large)
+    assert RangeAggregates([1, 2, 3]).squares.dtype == "int64"
+
+def test_describe_large_spots():
+    large = [3_100_000_000, 5, 3_100_000_000, 0, 7]
+    assert_same(describe(large), statistics_list(large))
+    assert_same(describe(large[:3]), statistics_list(large[:3]))
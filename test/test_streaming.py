@@ -0,0 +1,84 @@
+"""
+Author: Christian R. Garcia
+Tests the framing of streamed list responses, stream_chunks, and how
+their format is chosen from the 'stream' route argument and Accept
+header, choose_stream_format, then GET /jobs/<id>/results streamed with
+Flask's test client against fakeredis, see conftest.py.
+
+Run with "py.test-3 test_streaming.py"
+"""
+import sys
+import os
+import json
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import api
+import jobs
+
+RECORD = {'year': 1770, 'id': 0, 'spots': 101}
+
+
+def test_json_empty_list():
+    assert list(api.stream_chunks([], "json")) == ["[]\n"]
+
+def test_json_one_record():
+    chunks = list(api.stream_chunks([RECORD], "json"))
+    assert chunks == ['[{"id": 0, "spots": 101, "year": 1770}', "]\n"]
+    assert json.loads("".join(chunks)) == [RECORD]
+
+def test_json_records():
+    records = [RECORD, dict(RECORD, id=1), dict(RECORD, id=2)]
+    chunks = list(api.stream_chunks(iter(records), "json"))
+    assert len(chunks) == 4
+    assert json.loads("".join(chunks)) == records
+
+def test_ndjson_empty_list():
+    assert list(api.stream_chunks([], "ndjson")) == []
+
+def test_ndjson_one_record():
+    assert list(api.stream_chunks([RECORD], "ndjson")) == ['{"id": 0, "spots": 101, "year": 1770}\n']
+
+def test_ndjson_records():
+    records = [RECORD, dict(RECORD, id=1)]
+    lines = "".join(api.stream_chunks(records, "ndjson")).splitlines()
+    assert [json.loads(line) for line in lines] == records
+
+
+@pytest.mark.parametrize("stream, accept, expected", [
+    ("json", None, "json"),
+    ("ndjson", None, "ndjson"),
+    ("json", "application/x-ndjson", "json"),
+    (None, None, None),
+    (None, "application/json", None),
+    (None, "*/*", None),
+    (None, "application/x-ndjson", "ndjson"),
+    (None, "application/json;q=0.5, application/x-ndjson", "ndjson"),
+    (None, "application/json, application/x-ndjson;q=0.5", None),
+    ("csv", "application/x-ndjson", "ndjson"),
+    ("csv", None, None),
+])
+def test_choose_stream_format(stream, accept, expected):
+    assert api.choose_stream_format(stream, accept) == expected
+
+
+@pytest.fixture
+def completed_job(redis_server):
+    jid = json.loads(jobs.add_job("data", 1770, 1772, None, None))["id"]
+    jobs.start_job("job." + jid)
+    jobs.update_job(jid, "Completed", [RECORD, dict(RECORD, id=1)])
+    return jid
+
+def test_results_streamed_as_ndjson(completed_job):
+    response = api.app.test_client().get("/jobs/{}/results".format(completed_job),
+                                         headers={"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] \
+        == [RECORD, dict(RECORD, id=1)]
+
+def test_results_streamed_as_json(completed_job):
+    response = api.app.test_client().get("/jobs/{}/results?stream=json".format(completed_job))
+    assert response.is_streamed
+    assert response.get_json() == [RECORD, dict(RECORD, id=1)]
@@ -0,0 +1,112 @@
+"""
+Author: Christian R. Garcia
+Tests worker.run, the runtime every worker shares, against fakeredis, see
+conftest.py: a job that raises is marked 'Failed' without stopping the
+worker, and on SIGTERM the running job finishes while prefetched ones go
+back on the queue with the priority and client they were submitted with.
+
+Run with "py.test-3 test_worker_runtime.py"
+"""
+import sys
+import os
+import json
+import signal
+from threading import Event
+from time import sleep
+import pytest
+
+CODE_DIR = os.path.dirname(__file__)
+sys.path.append(CODE_DIR + "/../src/")
+
+import jobs
+import worker
+
+# Seconds a test waits on the worker before giving up.
+TIMEOUT = 10
+
+
+@pytest.fixture
+def runtime(redis_server, monkeypatch):
+    monkeypatch.setattr(worker, "WORKER_POOL", "thread")
+    monkeypatch.setattr(worker, "WORKER_CONCURRENCY", 1)
+    monkeypatch.setattr(worker, "WORKER_PREFETCH", 2)
+    monkeypatch.setattr(worker, "QUEUE_TIMEOUT", 0.05)
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def add_job(end, priority=jobs.DEFAULT_PRIORITY, client=""):
+    job_dict = json.loads(jobs.add_job("data", 1700, end, None, None,
+                                       priority=priority, client=client))
+    return job_dict["id"]
+
+
+def stop_worker():
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def wait_until(condition):
+    for _ in range(TIMEOUT * 100):
+        if condition():
+            return
+        sleep(0.01)
+    raise AssertionError("worker never got there")
+
+
+def test_failed_job_does_not_stop_worker(runtime):
+    bad = add_job(1701, priority=9)
+    good = add_job(1702, priority=1)
+    ran = []
+
+    def execute_job(job_dict):
+        ran.append(job_dict["id"])
+        if job_dict["id"] == bad:
+            raise ValueError("bad job")
+        stop_worker()
+        return [{"id": 0, "year": 1700, "spots": 5}]
+
+    worker.run("data", execute_job)
+    assert ran == [bad, good]
+    assert jobs.get_job(bad)["status"] == "Failed"
+    assert jobs.get_job(good)["status"] == "Completed"
+    assert jobs.get_job_results(good) == [{"id": 0, "year": 1700, "spots": 5}]
+
+def test_sigterm_requeues_prefetched_jobs(runtime, monkeypatch):
+    queue = jobs.work_queue("data")
+    running = add_job(1701, priority=9, client="alice")
+    prefetched = {add_job(1702, priority=5, client="alice"): ("5", "alice"),
+                  add_job(1703, priority=5, client="bob"): ("5", "bob")}
+    waiting = add_job(1704, priority=1, client="bob")
+    requeued = []
+    release = Event()
+    requeue_jobs = jobs.requeue_jobs
+
+    def record_requeue(work_type, job_keys):
+        requeued.extend(job_keys)
+        requeue_jobs(work_type, job_keys)
+        release.set()
+
+    def execute_job(job_dict):
+        assert job_dict["id"] == running
+        wait_until(lambda: len(queue) == 1)
+        stop_worker()
+        # Still running when the worker puts the prefetched jobs back.
+        assert release.wait(TIMEOUT)
+        return [{"id": 0, "year": 1700, "spots": 5}]
+
+    monkeypatch.setattr(jobs, "requeue_jobs", record_requeue)
+    worker.run("data", execute_job)
+
+    assert jobs.get_job(running)["status"] == "Completed"
+    assert sorted(requeued) == sorted(jobs.job_key_of(jid) for jid in prefetched)
+    assert len(queue) == 3
+    for jid, (priority, client) in prefetched.items():
+        assert jobs.get_job(jid)["status"] == "Submitted"
+        client_list = "{}.p{}.c.{}".format(queue.name, priority, client)
+        assert queue.redis.lrange(client_list, 0, -1) == [jobs.job_key_of(jid).encode()]
+    assert jobs.get_job(waiting)["status"] == "Submitted"
+    order = [queue.get() for _ in range(3)]
+    assert sorted(order[:2]) == sorted(jobs.job_key_of(jid) for jid in prefetched)
+    assert order[2] == jobs.job_key_of(waiting)